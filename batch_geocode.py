@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from itertools import islice
+
+import httpx
+from dotenv import load_dotenv
+
+from geocache import GeocodeCache, US_STATES, ZipCentroids, normalize_zip
+from index_manifest import previous_coordinates, reuse_coordinates
+from study_store import convert, is_jsonl, iter_studies
+
+load_dotenv()
+INPUT_FILE = "indexed_studies.jsonl"
+OUTPUT_FILE = "indexed_studies_with_coords.jsonl"
+CHECKPOINT_EVERY = int(os.getenv("GEOCODE_CHECKPOINT_EVERY", "500"))
+MAX_RETRIES = int(os.getenv("GEOCODE_MAX_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("GEOCODE_RETRY_BACKOFF", "2"))
+
+class TransientGeocodeError(Exception):
+    """The provider throttled us or failed in a way worth retrying."""
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class NominatimProvider:
+    name = "nominatim"
+    url = "https://nominatim.openstreetmap.org/search"
+
+    def __init__(self, rate=None, concurrency=1):
+        # The public instance's usage policy is at most one request per second
+        self.rate = rate or float(os.getenv("NOMINATIM_RATE", "1"))
+        self.concurrency = concurrency
+
+    async def geocode(self, client, location):
+        response = await client.get(
+            self.url,
+            params={"q": location, "format": "json", "limit": 1},
+            headers={"User-Agent": "heyhope-geocoder"},
+        )
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientGeocodeError(f"HTTP {response.status_code}")
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            return None
+        return [float(results[0]["lat"]), float(results[0]["lon"])]
+
+class GoogleProvider:
+    name = "google"
+    url = "https://maps.googleapis.com/maps/api/geocode/json"
+
+    def __init__(self, api_key=None, rate=None, concurrency=None):
+        self.api_key = api_key or os.getenv("GOOGLE_MAPS_API_KEY")
+        self.rate = rate or float(os.getenv("GOOGLE_GEOCODE_RATE", "20"))
+        self.concurrency = concurrency or int(os.getenv("GOOGLE_GEOCODE_CONCURRENCY", "10"))
+
+    async def geocode(self, client, location):
+        response = await client.get(self.url, params={"address": location, "key": self.api_key})
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientGeocodeError(f"HTTP {response.status_code}")
+        data = response.json()
+        status = data.get("status")
+        if status == "OK":
+            coords = data["results"][0]["geometry"]["location"]
+            return [coords["lat"], coords["lng"]]
+        if status == "ZERO_RESULTS":
+            return None
+        if status in ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR"):
+            raise TransientGeocodeError(status)
+        raise RuntimeError(f"{status}: {data.get('error_message', '')}")
+
+class OfflineProvider:
+    """
+    Network-free provider for dry runs: answers 5-digit ZIPs and
+    "City, State" pairs from the ZIP centroid table (a city resolves to the
+    mean of its ZIPs). `latency` simulates a remote round trip.
+    """
+
+    name = "offline"
+
+    def __init__(self, centroids=None, rate=1000.0, concurrency=50, latency=0.0):
+        self.centroids = centroids or ZipCentroids()
+        self.rate = rate
+        self.concurrency = concurrency
+        self.latency = latency
+        self._cities = None
+
+    def cities(self):
+        if self._cities is None:
+            points = defaultdict(list)
+            for value in self.centroids.table().values():
+                points[(value["city"].lower(), value["state"])].append((value["lat"], value["lng"]))
+            self._cities = {
+                key: [sum(p[0] for p in pts) / len(pts), sum(p[1] for p in pts) / len(pts)]
+                for key, pts in points.items()
+            }
+        return self._cities
+
+    async def geocode(self, client, location):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        match = re.search(r"\b\d{5}\b", location)
+        hit = self.centroids.get(match.group(0)) if match else None
+        if hit:
+            return [hit["lat"], hit["lng"]]
+        parts = [p.strip().lower() for p in location.split(",")]
+        for city, state in zip(parts, parts[1:]):
+            coords = self.cities().get((city, US_STATES.get(state, state.upper())))
+            if coords:
+                return coords
+        return None
+
+PROVIDERS = {
+    "nominatim": NominatimProvider,
+    "google": GoogleProvider,
+    "offline": OfflineProvider,
+}
+
+def place_key(location):
+    return "place:" + re.sub(r"\s+", " ", location.strip().lower())
+
+class BatchGeocoder:
+    """
+    Resolves batches of location strings through the shared persistent
+    geocode cache, sending only the misses to the provider, concurrently
+    up to provider.concurrency and paced by a token bucket at provider.rate.
+    """
+
+    def __init__(self, provider, cache=None):
+        self.provider = provider
+        self.cache = cache or GeocodeCache()
+        self.bucket = TokenBucket(provider.rate, burst=provider.concurrency)
+        self.semaphore = asyncio.Semaphore(provider.concurrency)
+        self.counters = Counter()
+
+    async def fetch(self, client, location):
+        """Return coordinates or None; failures are not cached so the next run retries them."""
+        error = None
+        for attempt in range(MAX_RETRIES):
+            async with self.semaphore:
+                await self.bucket.acquire()
+                self.counters["provider_calls"] += 1
+                try:
+                    coords = await self.provider.geocode(client, location)
+                    # Cached as soon as it arrives, so an interrupted batch keeps its answers
+                    self.cache.put(place_key(location), coords)
+                    return coords
+                except (TransientGeocodeError, httpx.TransportError) as e:
+                    error = e
+                except Exception as e:
+                    error = e
+                    break
+            if attempt + 1 < MAX_RETRIES:
+                self.counters["retries"] += 1
+                await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+        self.counters["failed"] += 1
+        print(f"❌ Failed to geocode: {location} ({error})")
+        return None
+
+    async def resolve(self, client, locations):
+        results = {}
+        pending = []
+        for location in locations:
+            found, coords = self.cache.get(place_key(location))
+            if found:
+                self.counters["cache_hits"] += 1
+                results[location] = coords
+            else:
+                pending.append(location)
+        fetched = await asyncio.gather(*(self.fetch(client, location) for location in pending))
+        results.update(zip(pending, fetched))
+        return results
+
+def checkpoint_path(output_path):
+    return output_path + ".checkpoint.json"
+
+def partial_path(output_path):
+    return output_path + ".partial.jsonl"
+
+def load_checkpoint(output_path, signature):
+    """Return (studies done, bytes of partial output to keep) for a matching checkpoint."""
+    try:
+        with open(checkpoint_path(output_path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return 0, 0
+    if data.get("signature") != signature or not os.path.exists(partial_path(output_path)):
+        return 0, 0
+    return data["studies_done"], data["partial_bytes"]
+
+def save_checkpoint(output_path, signature, studies_done, partial_bytes):
+    path = checkpoint_path(output_path)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"signature": signature, "studies_done": studies_done, "partial_bytes": partial_bytes}, f)
+    os.replace(path + ".tmp", path)
+
+US_COUNTRIES = {"united states", "usa", "us", "u.s.", "u.s.a."}
+
+def site_query(site):
+    """Lookup string shared by every site in the same US ZIP, or city/state/country elsewhere."""
+    country = (site.get("country") or "").strip()
+    zip5 = normalize_zip(site.get("zip"))
+    if zip5 and (not country or country.lower() in US_COUNTRIES):
+        return f"{zip5}, United States"
+    parts = ((site.get("city") or "").strip(), (site.get("state") or "").strip(), country)
+    return ", ".join(p for p in parts if p)
+
+def has_point(site):
+    return site.get("latitude") is not None and site.get("longitude") is not None
+
+def pending_queries(study, previous, counters):
+    """Location strings a study still needs: one per unlocated site, or its legacy location."""
+    sites = study.get("site_locations_and_contacts") or []
+    queries = {site_query(site) for site in sites if not has_point(site)}
+    queries.discard("")
+    if sites or study.get("coordinates"):
+        return queries
+    if reuse_coordinates(study, previous):
+        counters["reused"] += 1
+        return queries
+    location = (study.get("location") or "").strip()
+    if location:
+        queries.add(location)
+    else:
+        study["coordinates"] = None
+    return queries
+
+def apply_coordinates(study, resolved, counters):
+    sites = study.get("site_locations_and_contacts") or []
+    for site in sites:
+        if not has_point(site):
+            coords = resolved.get(site_query(site))
+            if coords:
+                site["latitude"], site["longitude"] = coords
+                counters["sites_located"] += 1
+    # A study with sites is matched on every site, so it gets no single center
+    if not sites and not study.get("coordinates"):
+        study["coordinates"] = resolved.get((study.get("location") or "").strip())
+
+async def geocode_file(input_path=INPUT_FILE, output_path=OUTPUT_FILE, provider=None, cache=None,
+                       batch_size=CHECKPOINT_EVERY, resume=True):
+    """
+    Stream input_path to output_path, filling in missing site and study
+    coordinates. Sites are looked up once per unique ZIP (or city/state
+    outside the US) across the whole batch.
+
+    Output goes to a .partial.jsonl file that is fsynced with a checkpoint
+    after every batch, so an interrupted run resumes after the last
+    completed batch instead of starting over.
+    """
+    provider = provider or NominatimProvider()
+    geocoder = BatchGeocoder(provider, cache)
+    stat = os.stat(input_path)
+    signature = {"input": os.path.abspath(input_path), "size": stat.st_size, "mtime": stat.st_mtime,
+                 "provider": provider.name}
+    done, keep_bytes = load_checkpoint(output_path, signature) if resume else (0, 0)
+    if done:
+        geocoder.counters["resumed_after"] = done
+        print(f"⏯️ Resuming {input_path} after {done} studies")
+    previous = previous_coordinates(output_path)
+    places = set()
+    start = time.perf_counter()
+
+    with open(partial_path(output_path), "ab" if done else "wb") as out:
+        out.truncate(keep_bytes)
+        studies = islice(iter_studies(input_path), done, None)
+        async with httpx.AsyncClient(timeout=httpx.Timeout(15.0)) as client:
+            while True:
+                batch = list(islice(studies, batch_size))
+                if not batch:
+                    break
+                todo = set()
+                for study in batch:
+                    todo |= pending_queries(study, previous, geocoder.counters)
+                places |= todo
+                resolved = await geocoder.resolve(client, todo)
+                for study in batch:
+                    apply_coordinates(study, resolved, geocoder.counters)
+                    out.write(json.dumps(study, separators=(",", ":")).encode("utf-8") + b"\n")
+                out.flush()
+                os.fsync(out.fileno())
+                done += len(batch)
+                save_checkpoint(output_path, signature, done, out.tell())
+                print(f"💾 {done} studies checkpointed ({geocoder.counters['provider_calls']} provider calls, "
+                      f"{geocoder.counters['cache_hits']} cache hits)")
+
+    if is_jsonl(output_path):
+        os.replace(partial_path(output_path), output_path)
+    else:
+        convert(partial_path(output_path), output_path)
+        os.remove(partial_path(output_path))
+    os.remove(checkpoint_path(output_path))
+
+    counters = geocoder.counters
+    counters["unique_places"] = len(places)
+    print(f"✅ Geocoded {done} studies with {provider.name} in {time.perf_counter() - start:.1f}s: "
+          f"{counters['sites_located']} sites located from {len(places)} unique places, "
+          f"{counters['provider_calls']} provider calls, {counters['cache_hits']} cache hits, "
+          f"{counters['reused']} reused, {counters['failed']} failed")
+    return counters
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Fill in study coordinates in batches.")
+    arg_parser.add_argument("--provider", choices=sorted(PROVIDERS), default="nominatim")
+    arg_parser.add_argument("--input", default=INPUT_FILE)
+    arg_parser.add_argument("--output", default=OUTPUT_FILE)
+    arg_parser.add_argument("--batch-size", type=int, default=CHECKPOINT_EVERY)
+    arg_parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start over")
+    args = arg_parser.parse_args(argv)
+    asyncio.run(geocode_file(args.input, args.output, PROVIDERS[args.provider](),
+                             batch_size=args.batch_size, resume=not args.restart))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+from catalog import StudyCatalog
+from match_cache import profile_fingerprint
+from matcher import rank_studies, NEARBY_RADIUS_MILES, EXACT_GEODESIC
+
+MATCH_BATCH_WORKERS = int(os.getenv("MATCH_BATCH_WORKERS", str(os.cpu_count() or 1)))
+BATCH_CELL_DEGREES = 1.0
+BATCH_CHUNK_PROFILES = 256
+
+_snapshot = None
+
+class CatalogChanged(Exception):
+    """The catalog file no longer holds the version a batch was planned against."""
+
+def _load_worker_catalog(path):
+    # Each pool worker parses and indexes the catalog once, then serves many batches
+    global _snapshot
+    _snapshot = StudyCatalog(path, auto_refresh=False).load()
+
+class MatchPool:
+    """
+    A process pool kept across batches for one catalog version, so workers
+    load the catalog file once rather than once per batch. A batch for a
+    new version replaces the pool; batches still running on the old one
+    finish on it first.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._key = None
+        self._lock = threading.Lock()
+
+    def executor(self, snapshot, workers):
+        key = (snapshot.path, snapshot.version, workers)
+        with self._lock:
+            if self._key != key:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_load_worker_catalog,
+                                                     initargs=(snapshot.path,))
+                self._key = key
+            return self._executor
+
+    def discard(self, executor):
+        # Workers that loaded another catalog (or died) are no use to later batches
+        with self._lock:
+            if self._executor is executor:
+                self._executor = self._key = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor, self._key = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+match_pool = MatchPool()
+
+def geo_cell(coords):
+    if not coords:
+        return (math.inf, math.inf)
+    return (math.floor(coords[0] / BATCH_CELL_DEGREES), math.floor(coords[1] / BATCH_CELL_DEGREES))
+
+def coordinate_key(coords):
+    return tuple(round(float(c), 6) for c in coords) if coords else None
+
+def plan_batches(participants, chunk_profiles=BATCH_CHUNK_PROFILES):
+    """
+    Group participants for matching: identical matching profiles are matched
+    once, profiles at the same coordinates share one proximity pass, and
+    chunks are cut along geographic cells so a chunk stays local.
+    Returns chunks of [coordinates, [(participant, [input indexes]), ...]].
+    """
+    profiles = {}
+    for i, participant in enumerate(participants):
+        fingerprint = profile_fingerprint(participant)
+        if fingerprint in profiles:
+            profiles[fingerprint][1].append(i)
+        else:
+            profiles[fingerprint] = (participant, [i])
+
+    places = {}
+    for participant, indexes in profiles.values():
+        coords = coordinate_key(participant.get("coordinates"))
+        places.setdefault(coords, []).append((participant, indexes))
+
+    chunks, chunk, size = [], [], 0
+    for coords in sorted(places, key=lambda c: (geo_cell(c), c or ())):
+        chunk.append((coords, places[coords]))
+        size += len(places[coords])
+        if size >= chunk_profiles:
+            chunks.append(chunk)
+            chunk, size = [], 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def compact_match(match):
+    return {
+        "nct_id": match["study"].get("nct_id"),
+        "study_title": match["study"].get("study_title"),
+        "match_score": match["match_score"],
+        "match_reason": match["match_reason"],
+        "distance_km": match["distance_km"],
+        "is_river": match["is_river"],
+    }
+
+def match_chunk(chunk, limit=10, exclude_river=False, snapshot=None, version=None):
+    snapshot = snapshot or _snapshot
+    if version is not None and snapshot.version != version:
+        # The file changed before this worker loaded it; fail rather than mix two catalogs
+        raise CatalogChanged(f"Study index changed during batch (expected {version}, found {snapshot.version})")
+    results = []
+    for coords, group in chunk:
+        proximity = snapshot.index.locator.measure(coords, NEARBY_RADIUS_MILES, exact=EXACT_GEODESIC)
+        for participant, indexes in group:
+            ranking = rank_studies(participant, snapshot.records, exclude_river, snapshot.index, proximity=proximity)
+            results.append((indexes, len(ranking), [compact_match(m) for m in ranking.page(0, limit)]))
+    return results
+
+def match_many(participants, catalog, limit=10, exclude_river=False, workers=1, pool=None):
+    """
+    Match every participant against one catalog snapshot and yield
+    {"index", "total", "matches"} per participant (plus "id" when the
+    participant has one), in geographic order rather than input order.
+    With workers > 1, chunks are spread over a long-lived process pool
+    (match_pool). If the pool's workers hold another catalog version, or
+    die, the last row is {"error", "detail"} and the rest are not matched.
+    """
+    participants = list(participants)
+    snapshot = catalog.snapshot()
+    chunks = plan_batches(participants)
+
+    if workers <= 1 or len(chunks) <= 1:
+        chunk_results = (match_chunk(chunk, limit, exclude_river, snapshot) for chunk in chunks)
+        yield from _rows(participants, chunk_results)
+        return
+    pool = pool or match_pool
+    executor = pool.executor(snapshot, workers)
+    try:
+        chunk_results = executor.map(match_chunk, chunks, repeat(limit), repeat(exclude_river),
+                                     repeat(None), repeat(snapshot.version))
+        yield from _rows(participants, chunk_results)
+    except CatalogChanged as e:
+        pool.discard(executor)
+        yield {"error": "catalog_changed", "detail": str(e)}
+    except BrokenProcessPool as e:
+        pool.discard(executor)
+        yield {"error": "workers_failed", "detail": str(e) or "a match worker exited"}
+
+def _rows(participants, chunk_results):
+    for results in chunk_results:
+        for indexes, total, matches in results:
+            for i in indexes:
+                row = {"index": i, "total": total, "matches": matches}
+                if participants[i].get("id") is not None:
+                    row["id"] = participants[i]["id"]
+                yield row
@@ -0,0 +1,1199 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+from catalog import StudyCatalog, normalize_study
+from chat_history import HISTORY_TOKEN_BUDGET
+from geo_index import StudyLocator
+from matcher import match_studies, is_site_nearby, synonym_vocabulary
+from study_index import CatalogIndex
+from study_records import StudyRecord, normalize
+from study_store import iter_studies, write_studies
+
+CONDITIONS = [
+    "depression", "major depressive disorder", "anxiety", "generalized anxiety disorder",
+    "ptsd", "post traumatic stress disorder", "insomnia", "schizophrenia", "obesity",
+]
+TAG_POOL = [
+    "include_depression", "include_anxiety", "include_ptsd", "include_telehealth",
+    "exclude_bipolar", "exclude_pregnant", "require_female", "require_veteran",
+]
+CITIES = [
+    ("San Francisco", "CA", 37.77, -122.42), ("Los Angeles", "CA", 34.05, -118.24),
+    ("Billings", "MT", 45.78, -108.50), ("New York", "NY", 40.71, -74.01),
+    ("Chicago", "IL", 41.88, -87.63), ("Houston", "TX", 29.76, -95.37),
+    ("Seattle", "WA", 47.61, -122.33), ("Boston", "MA", 42.36, -71.06),
+]
+
+SAMPLE_PARTICIPANT = {
+    "gender": "female",
+    "age": 34,
+    "state": "CA",
+    "diagnosis_history": "depression, anxiety",
+    "coordinates": (37.77, -122.42),
+}
+
+def make_study(i, rng, sites_per_study=3):
+    condition = rng.choice(CONDITIONS)
+    city, state, lat, lng = rng.choice(CITIES)
+    sites = []
+    for _ in range(sites_per_study):
+        s_city, s_state, s_lat, s_lng = rng.choice(CITIES)
+        sites.append({
+            "facility": f"Site {rng.randint(1, 999)}",
+            "city": s_city,
+            "state": s_state,
+            "latitude": s_lat + rng.uniform(-1, 1),
+            "longitude": s_lng + rng.uniform(-1, 1),
+        })
+    min_age = rng.choice([None, 18, 21])
+    return {
+        "nct_id": f"NCT{i:08d}",
+        "study_title": f"A Study of {condition.title()} Treatment {i}",
+        "summary": f"This trial evaluates a new treatment for {condition} in adults.",
+        "study_link": f"https://clinicaltrials.gov/study/NCT{i:08d}",
+        "location": f"{city}, {state}",
+        "coordinates": [lat + rng.uniform(-1, 1), lng + rng.uniform(-1, 1)],
+        "states": [state] if rng.random() < 0.2 else [],
+        "tags": rng.sample(TAG_POOL, rng.randint(0, 3)),
+        "eligibility_text": "Inclusion Criteria: adults 18 to 65 years. Exclusion: pregnancy.",
+        "min_age_years": min_age,
+        "max_age_years": rng.choice([None, 65, 75]) if min_age else None,
+        "site_locations_and_contacts": sites,
+    }
+
+def make_catalog(n, seed=7, sites_per_study=3):
+    rng = random.Random(seed)
+    return [make_study(i, rng, sites_per_study) for i in range(n)]
+
+def write_catalog(studies, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(studies, f)
+
+def time_calls(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+def report(label, p50, worst):
+    print(f"  {label:<32} p50 {p50:9.2f} ms   max {worst:9.2f} ms")
+
+def bench_catalog(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.json")
+        write_catalog(make_catalog(args.studies), path)
+        print(f"📊 Per-request latency, {args.studies} studies")
+
+        def before():
+            with open(path, "r") as f:
+                all_studies = json.load(f)
+            return all_studies
+
+        catalog = StudyCatalog(path)
+        catalog.load()
+
+        report("json.load per request", *time_calls(before, args.repeat))
+        report("StudyCatalog.studies()", *time_calls(catalog.studies, args.repeat))
+        if args.match:
+            def before_match():
+                return match_studies(SAMPLE_PARTICIPANT, [StudyRecord(normalize_study(s)) for s in before()])
+
+            report("json.load + match_studies", *time_calls(before_match, args.repeat))
+            snapshot = catalog.snapshot()
+            report("catalog + match_studies", *time_calls(
+                lambda: match_studies(SAMPLE_PARTICIPANT, snapshot.records, index=snapshot.index), args.repeat))
+
+def random_participant_coords(rng):
+    _, _, lat, lng = rng.choice(CITIES)
+    return lat + rng.uniform(-1, 1), lng + rng.uniform(-1, 1)
+
+def bench_spatial(args):
+    rng = random.Random(11)
+    queries = [random_participant_coords(rng) for _ in range(args.repeat)]
+    print("📊 'Studies with a site within 100 miles' throughput")
+    for total_sites in (1000, 10000, 100000):
+        studies = make_catalog(total_sites // 3, sites_per_study=3)
+        for s in studies:
+            normalize_study(s)
+
+        def brute(coords):
+            return {
+                idx for idx, s in enumerate(studies)
+                if any(is_site_nearby(site, coords) for site in s["site_locations_and_contacts"])
+            }
+
+        start = time.perf_counter()
+        locator = StudyLocator(studies)
+        build_ms = (time.perf_counter() - start) * 1000
+        print(f"  {total_sites} sites (index build {build_ms:.0f} ms)")
+        for label, fn in [
+            ("geodesic per site", brute),
+            ("grid + vectorized haversine", lambda c: locator.measure(c, 100)),
+            ("grid + haversine + geodesic pass", lambda c: locator.measure(c, 100, exact=True)),
+        ]:
+            rounds = queries if label != "geodesic per site" or total_sites <= 10000 else queries[:3]
+            start = time.perf_counter()
+            for coords in rounds:
+                fn(coords)
+            elapsed = time.perf_counter() - start
+            print(f"    {label:<30} {len(rounds) / elapsed:10.1f} queries/s")
+
+def bench_topk(args):
+    import matcher
+    from matcher import rank_studies
+
+    # The early exit belongs to the per-study loop; ScoringMatrix always ranks every candidate
+    matcher.VECTORIZED_SCORING = False
+    # Every study is near the participant and mentions their condition, so all are candidates
+    rng = random.Random(19)
+    studies = make_catalog(args.studies)
+    for study in studies:
+        study["coordinates"] = [37.77 + rng.uniform(-0.5, 0.5), -122.42 + rng.uniform(-0.5, 0.5)]
+        study["states"] = []
+        study["summary"] += " Participants with depression, anxiety or PTSD are welcome."
+        normalize_study(study)
+    records = [StudyRecord(s) for s in studies]
+    index = CatalogIndex(records, synonym_vocabulary())
+    participant = dict(SAMPLE_PARTICIPANT, diagnosis_history="depression, anxiety, ptsd")
+
+    full = match_studies(participant, records, index=index)
+    print(f"📊 Ranking {len(full)} matched of {args.studies} candidate studies")
+    report("full sort (all match dicts)", *time_calls(lambda: match_studies(participant, records, index=index), args.repeat))
+    for k in (10, 100):
+        top = match_studies(participant, records, index=index, limit=k)
+        assert top == full[:k]
+        ranking = rank_studies(participant, records, index=index)
+        ranking.page(0, k)
+        report(f"top-{k} ({ranking.scanned} scanned)", *time_calls(
+            lambda: match_studies(participant, records, index=index, limit=k), args.repeat))
+    ranking = rank_studies(participant, records, index=index).finish()
+    report("next page from cursor", *time_calls(lambda: ranking.page(10, 10), args.repeat))
+
+CRITERIA_LINES = [
+    "Diagnosis of {condition} confirmed by a structured clinical interview",
+    "Stable dose of antidepressant medication for at least 4 weeks",
+    "Able to provide written informed consent and attend weekly study visits",
+    "History of bipolar disorder, schizophrenia or other psychotic disorder",
+    "Current substance use disorder within the past 6 months",
+    "Pregnant or breastfeeding, or planning pregnancy during the study",
+    "Clinically significant medical illness that would interfere with participation",
+    "Active suicidal ideation with intent or plan",
+]
+
+def bench_scoring(args):
+    import matcher
+
+    studies = [normalize_study(s) for s in make_catalog(args.studies)]
+    for study in studies:
+        # Telehealth everywhere so most of the catalog survives candidate pruning
+        study["tags"].append("include_telehealth")
+    records = [StudyRecord(s) for s in studies]
+    index = CatalogIndex(records, synonym_vocabulary())
+    rng = random.Random(31)
+    participants = [
+        dict(SAMPLE_PARTICIPANT, coordinates=random_participant_coords(rng), gender=rng.choice(["female", "male"]),
+             diagnosis_history=rng.choice(["depression", "anxiety, ptsd", "depression, anxiety"]))
+        for _ in range(args.repeat)
+    ]
+    print(f"📊 Scoring {args.studies} studies per participant, {args.repeat} participants")
+    results = {}
+    for label, vectorized in (("per-study loop", False), ("ScoringMatrix", True)):
+        matcher.VECTORIZED_SCORING = vectorized
+        for limit in (10, None):
+            results[label, limit] = [match_studies(p, records, index=index, limit=limit) for p in participants]
+            report(f"{label}, {'top 10' if limit else 'all matches'}", *time_calls(
+                lambda: match_studies(participants[0], records, index=index, limit=limit), args.repeat))
+    mismatches = sum(a != b for limit in (10, None)
+                     for a, b in zip(results["per-study loop", limit], results["ScoringMatrix", limit]))
+    matched = statistics.mean(len(r) for r in results["ScoringMatrix", None])
+    print(f"  {matched:.0f} matches per participant on average, {mismatches} differences "
+          f"in scores, reasons or order between the two engines")
+
+def make_criteria(rng, condition):
+    inclusion = rng.sample(CRITERIA_LINES[:3], 3) * rng.randint(2, 6)
+    exclusion = rng.sample(CRITERIA_LINES[3:], rng.randint(2, 5)) * rng.randint(2, 6)
+    return ("Inclusion Criteria:\n - Adults aged 18-65\n - " + "\n - ".join(inclusion).format(condition=condition)
+            + "\nExclusion Criteria:\n - " + "\n - ".join(exclusion))
+
+def bench_eligibility(args):
+    from eligibility_features import FEMALE_FOCUSED_TERMS, extract_eligibility_features
+    from matcher import rank_studies
+
+    rng = random.Random(23)
+    studies = make_catalog(args.studies)
+    for study in studies:
+        study["eligibility_text"] = make_criteria(rng, rng.choice(CONDITIONS))
+        normalize_study(study)
+    start = time.perf_counter()
+    for study in studies:
+        study["eligibility_features"] = extract_eligibility_features(study["eligibility_text"])
+    extract_ms = (time.perf_counter() - start) * 1000
+    records = [StudyRecord(s) for s in studies]
+    index = CatalogIndex(records, synonym_vocabulary())
+    participant = dict(SAMPLE_PARTICIPANT, gender="male")
+    candidates = rank_studies(participant, records, index=index).finish().scanned
+
+    def legacy_scan():
+        # What match_studies did per candidate (as many studies) for every male participant
+        for record in records[:candidates]:
+            text = (record.study.get("eligibility_text") or "").lower()
+            any(term in text for term in FEMALE_FOCUSED_TERMS)
+
+    def precomputed():
+        for record in records[:candidates]:
+            record.female_focused
+
+    size = statistics.mean(len(s["eligibility_text"]) for s in studies)
+    print(f"📊 Eligibility checks for a male participant, {args.studies} studies, "
+          f"{candidates} candidates, criteria ~{size:.0f} chars")
+    print(f"  index-time feature extraction: {extract_ms / len(studies):.3f} ms per study (once per index run)")
+    report("per-request text scan (legacy)", *time_calls(legacy_scan, args.repeat))
+    report("precomputed flags", *time_calls(precomputed, args.repeat))
+    legacy_p50, _ = time_calls(legacy_scan, args.repeat)
+    match_p50, worst = time_calls(lambda: match_studies(participant, records, index=index, limit=10), args.repeat)
+    report("match_studies now (top 10)", match_p50, worst)
+    print(f"  the text scan alone would add {legacy_p50:.2f} ms ({legacy_p50 / match_p50:.0%}) to every match")
+
+def bench_tagging(args):
+    import study_tagger
+
+    rng = random.Random(29)
+    studies = make_catalog(args.studies)
+    for study in studies:
+        study["eligibility_text"] = make_criteria(rng, rng.choice(CONDITIONS))
+        study["tags"] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "studies.jsonl")
+        write_studies(path, studies)
+        size = os.path.getsize(path) / 1e6
+        print(f"📊 Rule-based tagging of {args.studies} studies ({size:.0f} MB JSONL), "
+              f"{len(study_tagger.TEXT_RULES)} text rules in one automaton")
+        runs = [("serial, cold", 1, True), (f"{args.workers} workers, cold", args.workers, True),
+                ("incremental, nothing changed", args.workers, False)]
+        for label, workers, force in runs:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                counts = study_tagger.tag_file(path, workers=workers, force=force)
+            elapsed = time.perf_counter() - start
+            print(f"  {label:<30} {args.studies / elapsed:9.0f} studies/s  "
+                  f"({counts['tagged']} tagged, {counts['unchanged']} unchanged)")
+        # Edit 1% of the studies and re-run
+        edited = []
+        for i, study in enumerate(iter_studies(path)):
+            if i % 100 == 0:
+                study["summary"] += " Now also enrolling veterans with insomnia."
+            edited.append(study)
+        write_studies(path, edited)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts = study_tagger.tag_file(path, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print(f"  {'incremental, 1% edited':<30} {args.studies / elapsed:9.0f} studies/s  "
+              f"({counts['tagged']} tagged, {counts['unchanged']} unchanged)")
+        tags = Counter(tag for study in iter_studies(path) for tag in study["generated_tags"])
+        print("  " + ", ".join(f"{tag} {count}" for tag, count in tags.most_common()))
+
+def make_profile_participant(rng, zips=40):
+    # Participants geocode to their ZIP centroid, so a ZIP is a shared coordinate
+    zip_rng = random.Random(rng.randrange(zips))
+    _, state, lat, lng = zip_rng.choice(CITIES)
+    return {
+        "coordinates": (round(lat + zip_rng.uniform(-0.5, 0.5), 4), round(lng + zip_rng.uniform(-0.5, 0.5), 4)),
+        "state": state,
+        "age": rng.randint(25, 40),
+        "gender": rng.choice(["female", "male"]),
+        "diagnosis_history": ", ".join(rng.sample(["depression", "anxiety", "ptsd"], rng.randint(1, 2))),
+    }
+
+def bench_batch(args):
+    from batch_matching import compact_match, match_many, match_pool
+    from match_cache import profile_fingerprint
+
+    rng = random.Random(37)
+    participants = [dict(make_profile_participant(rng, zips=2000), id=f"lead-{i}") for i in range(args.participants)]
+    sample = participants[:min(len(participants), 2000)]
+    with tempfile.TemporaryDirectory() as tmp:
+        # Pool workers load the catalog from this file, so keep it until the end
+        path = os.path.join(tmp, "catalog.json")
+        write_catalog(make_catalog(args.studies), path)
+        catalog = StudyCatalog(path, auto_refresh=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            snapshot = catalog.load()
+        print(f"📊 Re-matching {len(participants)} participants against {args.studies} studies")
+
+        start = time.perf_counter()
+        expected = [[compact_match(m) for m in match_studies(p, snapshot.records, index=snapshot.index, limit=10)]
+                    for p in sample]
+        loop_rate = len(sample) / (time.perf_counter() - start)
+        print(f"  per-participant match_studies: {loop_rate:,.0f} participants/s "
+              f"(on {len(sample)}; ~{len(participants) / loop_rate:,.0f}s for all)")
+
+        # A second pooled run reuses workers that already loaded the catalog
+        runs = [(1, "")] + ([(args.workers, ""), (args.workers, ", warm pool")] if args.workers > 1 else [])
+        for workers, note in runs:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                rows = list(match_many(participants, catalog, limit=10, workers=workers))
+            elapsed = time.perf_counter() - start
+            print(f"  match_many, {workers} worker{'s' if workers != 1 else ''}{note}: "
+                  f"{len(rows) / elapsed:,.0f} participants/s ({elapsed:,.1f}s for all)")
+        match_pool.shutdown()
+        by_index = {row["index"]: row["matches"] for row in rows}
+        mismatches = sum(by_index[i] != matches for i, matches in enumerate(expected))
+        profiles = len({profile_fingerprint(p) for p in participants})
+        print(f"  {profiles} distinct profiles, {mismatches} differences from match_studies on the sample")
+
+def bench_standing(args):
+    from matcher import rank_studies
+    from standing_queries import ProfileStore, StandingQueries, matching_profile, study_digest
+
+    rng = random.Random(41)
+    profiles = [(f"lead-{i}", matching_profile(make_profile_participant(rng, zips=2000)))
+                for i in range(args.participants)]
+    sample = [profile for _, profile in profiles[:200]]
+    print(f"📊 Standing queries: {len(profiles)} stored profiles, {args.changed} studies added or changed per refresh")
+    for studies in sorted({max(args.studies // 4, args.changed), args.studies}):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ProfileStore(os.path.join(tmp, "standing.sqlite3"))
+            with store._conn() as db:
+                db.executemany("INSERT INTO profiles (participant_id, profile, updated_at) VALUES (?, ?, 0)",
+                               [(pid, json.dumps(profile)) for pid, profile in profiles])
+            catalog_studies = make_catalog(studies)
+            for study in catalog_studies:
+                # The indexer stamps each record with its XML file's hash
+                study["source_sha256"] = f"{study['nct_id']}:0"
+            path = os.path.join(tmp, "catalog.json")
+            write_catalog(catalog_studies, path)
+            catalog = StudyCatalog(path, auto_refresh=False)
+            with contextlib.redirect_stdout(io.StringIO()):
+                snapshot = catalog.load()
+            # Start from "every stored lead has seen this catalog"
+            store.record_refresh(None, snapshot.version, snapshot.mtime,
+                                 {s["nct_id"]: study_digest(s) for s in snapshot.studies}, [], [], [])
+            start = time.perf_counter()
+            for profile in sample:
+                rank_studies(profile, snapshot.records, index=snapshot.index).page()
+            full = (time.perf_counter() - start) / len(sample) * len(profiles)
+
+            # Half new studies, half edits to existing ones
+            edit_rng = random.Random(43)
+            for study in edit_rng.sample(catalog_studies, args.changed // 2):
+                study["summary"] += " Enrollment was extended."
+                study["source_sha256"] = f"{study['nct_id']}:1"
+            added = make_catalog(studies + args.changed - args.changed // 2, seed=44)[studies:]
+            for study in added:
+                study["source_sha256"] = f"{study['nct_id']}:0"
+            catalog_studies += added
+            write_catalog(catalog_studies, path)
+            standing = StandingQueries(store)
+            with contextlib.redirect_stdout(io.StringIO()):
+                snapshot = catalog.load()
+                start = time.perf_counter()
+                delta = standing.refresh(snapshot)
+                incremental = time.perf_counter() - start
+            refresh = standing.last_refresh
+            print(f"  {studies:>7} studies: re-match everyone ~{full:7.1f}s, incremental {incremental:6.2f}s "
+                  f"({refresh['changed_studies']} changed, {refresh['profiles_evaluated']} profile groups "
+                  f"evaluated, {len(delta)} new pairs)")
+
+def bench_match_cache(args):
+    from match_cache import MatchCache
+    from matcher import rank_studies
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.json")
+        write_catalog(make_catalog(args.studies), path)
+        catalog = StudyCatalog(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            snapshot = catalog.load()
+
+    def match(participant, exclude_river):
+        return rank_studies(participant, snapshot.records, exclude_river=exclude_river, index=snapshot.index).finish()
+
+    # One intake match per participant, then the follow-ups that used to re-match from scratch
+    rng = random.Random(17)
+    calls = []
+    for _ in range(args.repeat * 50):
+        participant = make_profile_participant(rng)
+        calls.append((participant, False, "intake"))
+        roll = rng.random()
+        if roll < 0.5:
+            calls.append((participant, True, "other_options"))
+        elif roll < 0.7:
+            calls.append((participant, True, "river_declined"))
+
+    start = time.perf_counter()
+    expected = [match(p, exclude_river) for p, exclude_river, _ in calls]
+    uncached = time.perf_counter() - start
+
+    cache = MatchCache()
+    start = time.perf_counter()
+    results = [cache.get_or_match(snapshot, p, exclude_river, match, path=path) for p, exclude_river, path in calls]
+    cached = time.perf_counter() - start
+    mismatches = sum(a.page() != b.page() for a, b in zip(expected, results))
+
+    stats = cache.stats()
+    print(f"📊 Match cache, {len(calls)} match calls over {args.studies} studies")
+    print(f"  uncached {uncached * 1000 / len(calls):7.2f} ms per call, cached {cached * 1000 / len(calls):7.2f} ms "
+          f"per call ({uncached / cached:.1f}x), {stats['entries']} entries, {mismatches} mismatches")
+    for name, counts in sorted(stats["paths"].items()):
+        print(f"  {name:<16} hit rate {counts['hit_rate']:6.1%} ({counts['hits']} hits, {counts['misses']} misses)")
+
+def traced(fn):
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    result = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    end = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in end.compare_to(start, "filename"))
+    return result, retained / 1e6, peak / 1e6
+
+def legacy_per_request_fields(studies):
+    # What match_studies/passes_basic_filters used to derive for every study on every request
+    return [
+        (
+            [t.lower().strip() for t in s.get("tags", [])],
+            [x.upper() for x in s.get("states", []) if isinstance(x, str)],
+            s.get("study_title", "").lower().strip(),
+            normalize((s.get("summary") or "") + " " + (s.get("study_title") or "")),
+        )
+        for s in studies
+    ]
+
+def bench_memory(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.json")
+        write_catalog(make_catalog(args.studies), path)
+        print(f"📊 Memory footprint, {args.studies} studies")
+
+        def load():
+            with open(path, "r") as f:
+                return json.load(f)
+
+        studies, dict_mb, json_peak = traced(load)
+        print(f"  {'list-of-dicts json.load':<36} {dict_mb:8.1f} MB retained, {json_peak:8.1f} MB peak")
+        jsonl_path = os.path.join(tmp, "catalog.jsonl")
+        write_studies(jsonl_path, studies)
+        _, _, stream_peak = traced(lambda: sum(1 for _ in iter_studies(jsonl_path)))
+        print(f"  {'streamed JSONL iter_studies':<36} {'':>11} {stream_peak:8.2f} MB peak")
+        records, record_mb, _ = traced(lambda: [StudyRecord(normalize_study(s)) for s in studies])
+        print(f"  {'StudyRecord compact form (added)':<36} {record_mb:8.1f} MB retained")
+        _, _, legacy_peak = traced(lambda: legacy_per_request_fields(studies))
+        print(f"  {'per-request normalization (legacy)':<36} {legacy_peak:8.1f} MB allocated per request")
+        report("legacy per-request normalization", *time_calls(lambda: legacy_per_request_fields(studies), args.repeat))
+        report("precomputed StudyRecord fields", *time_calls(
+            lambda: [(r.tags, r.states, r.is_river, r.summary_norm) for r in records], args.repeat))
+
+STUB_PARTICIPANT = {
+    "Name": "Load Test",
+    "Email": "load@example.com",
+    "Phone number": "(555) 123-4567",
+    "Date of birth": "March 10, 1990",
+    "Gender": "Female",
+    "ZIP code": "94110",
+    "Conditions": ["Depression", "Anxiety"],
+}
+
+STUB_QUESTION = (
+    "Thanks for reaching out, I'm glad you're here. To find studies that fit you, "
+    "could you share your name, email, phone number, date of birth, gender, ZIP code "
+    "and the conditions you've been diagnosed with?"
+)
+
+def start_stub_servers(latency, monday_fail_rate=0.0, reply=None):
+    """
+    Local stand-ins for the OpenAI and Monday.com APIs, each answering after
+    `latency` seconds. The Monday stub answers every aliased mutation in a
+    batch with a fresh item id and fails whole requests at monday_fail_rate.
+    Streamed completions send the first token after a tenth of `latency`
+    and spread the rest over the remainder, like a model generating text.
+    """
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    content = reply or json.dumps(STUB_PARTICIPANT)
+
+    async def stream_chunks():
+        pieces = re.findall(r"\S+\s*", content)
+        await asyncio.sleep(latency / 10)
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(latency * 0.9 / len(pieces))
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4",
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    async def chat_completions(request):
+        if (await request.json()).get("stream"):
+            return StreamingResponse(stream_chunks(), media_type="text/event-stream")
+        await asyncio.sleep(latency)
+        return JSONResponse({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": "gpt-4",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    item_ids = iter(range(1, 10 ** 9))
+    fail_rng = random.Random(5)
+
+    async def monday(request):
+        await asyncio.sleep(latency)
+        if fail_rng.random() < monday_fail_rate:
+            return JSONResponse({"error_message": "stub outage"}, status_code=503)
+        query = (await request.json())["query"]
+        fields = re.findall(r"(?:(\w+): )?(create_item|change_multiple_column_values) \(", query)
+        data = {alias or name: {"id": str(next(item_ids))} for alias, name in fields}
+        return JSONResponse({"data": data, "stub_requests": len(fields)})
+
+    stub_app = Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/monday", monday, methods=["POST"]),
+    ])
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(stub_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}", server
+
+def configure_app(tmp, base_url, studies):
+    """Point main.app at a synthetic catalog, temp stores and the stub upstreams."""
+    import openai
+    import main
+    import push_to_monday
+    import utils
+    from crm_queue import CRMQueue
+    from geocache import GeocodeCache, ZipCentroids
+    from standing_queries import ProfileStore, StandingQueries
+
+    path = os.path.join(tmp, "catalog.json")
+    write_catalog(make_catalog(studies), path)
+    zips = os.path.join(tmp, "zips.csv")
+    with open(zips, "w") as f:
+        f.write("zip,lat,lng,city,state\n94110,37.75,-122.41,San Francisco,CA\n")
+
+    openai.api_base = base_url + "/v1"
+    openai.api_key = "stub"
+    push_to_monday.MONDAY_API_URL = base_url + "/monday"
+    utils.geocode_cache = GeocodeCache(path=os.path.join(tmp, "geocode.sqlite3"), centroids=ZipCentroids(zips))
+    main.catalog = StudyCatalog(path, auto_refresh=False)
+    main.catalog.load()
+    main.crm_queue = CRMQueue(os.path.join(tmp, "crm.sqlite3"))
+    # Every intake saves a matching profile; keep them out of the working directory
+    main.standing_queries = StandingQueries(ProfileStore(os.path.join(tmp, "standing.sqlite3")))
+    return main
+
+def bench_concurrency(args):
+    import httpx
+    import main
+    import push_to_monday
+
+    base_url, server = start_stub_servers(args.latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_app(tmp, base_url, args.studies)
+
+        async def run():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+                print(f"📊 /chat throughput, stub upstream latency {args.latency * 1000:.0f} ms, {args.studies} studies")
+                for concurrency in (1, 10, 50, 100, 250):
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        responses = await asyncio.gather(*[
+                            client.post("/chat", json={"session_id": f"load-{concurrency}-{i}", "message": "hi"})
+                            for i in range(concurrency)
+                        ])
+                    elapsed = time.perf_counter() - start
+                    failed = sum(r.status_code != 200 for r in responses)
+                    print(f"  concurrency {concurrency:>4}: {concurrency / elapsed:8.1f} req/s, "
+                          f"wall {elapsed * 1000:8.0f} ms, failed {failed}")
+            await push_to_monday.close_async_client()
+
+        asyncio.run(run())
+    server.should_exit = True
+
+async def first_byte(client, path, payload):
+    """Seconds until the first body bytes arrive and until the response is complete."""
+    start = time.perf_counter()
+    ttfb = None
+    async with client.stream("POST", path, json=payload) as response:
+        async for _ in response.aiter_bytes():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+    return ttfb, time.perf_counter() - start
+
+def bench_streaming(args):
+    import httpx
+    import uvicorn
+    import main
+    import push_to_monday
+
+    base_url, stub = start_stub_servers(args.latency, reply=STUB_QUESTION)
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_app(tmp, base_url, args.studies)
+        # A real socket, so buffering anywhere in the stack would show up in the timings
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.01)
+
+        async def run():
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+                results = {}
+                for path in ("/chat", "/chat/stream"):
+                    timings = []
+                    for i in range(args.repeat):
+                        payload = {"session_id": f"ttfb-{path}-{i}", "message": "hi, I'd like to find a study"}
+                        timings.append(await first_byte(client, path, payload))
+                    results[path] = timings
+            await push_to_monday.close_async_client()
+            return results
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(run())
+        server.should_exit = True
+    stub.should_exit = True
+    print(f"📊 Time to first byte, stub model latency {args.latency * 1000:.0f} ms, {args.repeat} turns each")
+    for path, timings in results.items():
+        ttfb = statistics.median(t for t, _ in timings) * 1000
+        total = statistics.median(t for _, t in timings) * 1000
+        print(f"  {path:<14} first byte p50 {ttfb:7.1f} ms, complete p50 {total:7.1f} ms")
+
+def bench_crm(args):
+    import crm_queue
+    import push_to_monday
+
+    base_url, server = start_stub_servers(args.latency, monday_fail_rate=0.2)
+    push_to_monday.MONDAY_API_URL = base_url + "/monday"
+    crm_queue.CRM_MIN_INTERVAL = 0.05
+    crm_queue.CRM_BASE_BACKOFF = 0.1
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = crm_queue.CRMQueue(os.path.join(tmp, "crm.sqlite3"))
+        sessions = args.pushes // 2
+
+        async def run():
+            worker = asyncio.create_task(queue.run_worker())
+            start = time.perf_counter()
+            for i in range(args.pushes):
+                # Every session is pushed twice, the second time with an update
+                session = i % sessions
+                participant = {"name": f"Lead {session}", "email": f"lead{session}@example.com",
+                               "rivers_match": i >= sessions}
+                await asyncio.to_thread(queue.enqueue, participant, f"s{session}:lead{session}@example.com")
+            enqueue_ms = (time.perf_counter() - start) * 1000
+            while set(queue.depth()) & {"pending", "in_flight"}:
+                await asyncio.sleep(0.05)
+            drain = time.perf_counter() - start
+            worker.cancel()
+            await push_to_monday.close_async_client()
+            return enqueue_ms, drain
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            enqueue_ms, drain = asyncio.run(run())
+        stats = queue.stats()
+        print(f"📊 CRM queue: {args.pushes} pushes for {sessions} sessions, stub latency "
+              f"{args.latency * 1000:.0f} ms, 20% injected 503s")
+        print(f"  enqueue (what /chat waits for): {enqueue_ms / args.pushes:.2f} ms per push")
+        print(f"  drained in {drain:.2f} s over {stats.get('batches', 0)} GraphQL requests")
+        print(f"  sent {stats.get('sent', 0)}, deduplicated {stats.get('deduplicated', 0)}, "
+              f"retries {stats.get('retries', 0)}, failed {stats['failed']}")
+        print(f"  push latency p50 {stats.get('push_latency_p50_s')} s, max {stats.get('push_latency_max_s')} s")
+    server.should_exit = True
+
+STUDY_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<clinical_study rank="{i}">
+  <id_info><nct_id>NCT{i:08d}</nct_id></id_info>
+  <brief_title>A Study of {condition} Treatment {i}</brief_title>
+  <brief_summary><textblock>
+    This trial evaluates a new treatment for {condition}
+    in adults. {filler}
+  </textblock></brief_summary>
+  <overall_status>Recruiting</overall_status>
+  <eligibility><criteria><textblock>
+    Inclusion Criteria: adults 18 to 65 years. Exclusion Criteria: pregnancy.
+  </textblock></criteria></eligibility>
+  <overall_official><last_name>Dr. Example</last_name></overall_official>
+  <location>
+    <facility><name>Site {i}</name><address><city>{city}</city><state>{state}</state>
+    <zip>00000</zip><country>{country}</country></address></facility>
+    <contact><last_name>Coordinator</last_name><phone>555-0100</phone><email>site{i}@example.com</email></contact>
+  </location>
+  <location_countries>
+    <country>{country}</country>
+  </location_countries>
+  <clinical_results>{results}</clinical_results>
+</clinical_study>
+"""
+
+def write_xml_corpus(directory, files, seed=13):
+    rng = random.Random(seed)
+    for i in range(files):
+        shard = os.path.join(directory, f"NCT{i // 10000:04d}xxxx")
+        if i % 10000 == 0:
+            os.makedirs(shard, exist_ok=True)
+        city, state, _, _ = rng.choice(CITIES)
+        xml = STUDY_XML.format(
+            i=i,
+            condition=rng.choice(CONDITIONS),
+            filler="Participants attend weekly visits. " * rng.randint(1, 20),
+            city=city,
+            state=state,
+            country="United States" if rng.random() < 0.35 else "Canada",
+            results="<outcome><measure>result</measure></outcome>" * rng.randint(0, 200),
+        )
+        with open(os.path.join(shard, f"NCT{i:08d}.xml"), "w", encoding="utf-8") as f:
+            f.write(xml)
+
+def start_resp_stub():
+    """
+    In-process stand-in for a Redis server: GET, SET [EX], DEL, DBSIZE, PING
+    over RESP with lazy expiry, enough for session_store.RedisBackend.
+    """
+    import socketserver
+
+    data = {}
+    lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def read_command(self):
+            line = self.rfile.readline()
+            if not line:
+                return None
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2])
+            return args
+
+        def handle(self):
+            while True:
+                args = self.read_command()
+                if args is None:
+                    return
+                name = args[0].upper()
+                with lock:
+                    if name == b"GET":
+                        value, expires = data.get(args[1], (None, None))
+                        if value is not None and expires is not None and expires <= time.time():
+                            del data[args[1]]
+                            value = None
+                        reply = b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+                    elif name == b"SET":
+                        expires = time.time() + int(args[4]) if len(args) > 4 and args[3].upper() == b"EX" else None
+                        data[args[1]] = (args[2], expires)
+                        reply = b"+OK\r\n"
+                    elif name == b"DEL":
+                        reply = b":%d\r\n" % sum(data.pop(k, None) is not None for k in args[1:])
+                    elif name == b"DBSIZE":
+                        reply = b":%d\r\n" % len(data)
+                    elif name == b"PING":
+                        reply = b"+PONG\r\n"
+                    else:
+                        reply = b"-ERR unknown command\r\n"
+                self.wfile.write(reply)
+
+    class Server(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{server.server_address[1]}/0", server
+
+def bench_sessions(args):
+    from session_store import MemoryBackend, RedisBackend, SQLiteBackend, SessionStore
+
+    turn = {"role": "assistant", "content": "Thanks! " + "Could you share your ZIP code? " * 8}
+    participant = dict(STUB_PARTICIPANT, coordinates=[37.77, -122.42], age=34)
+    redis_url, redis_server = start_resp_stub()
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [
+            ("memory (LRU, 4 MB cap)", MemoryBackend(max_entries=args.sessions, max_bytes=4 * 1024 * 1024)),
+            ("sqlite (WAL)", SQLiteBackend(os.path.join(tmp, "sessions.sqlite3"), max_entries=args.sessions)),
+            ("redis protocol (local stub)", RedisBackend(redis_url)),
+        ]
+        print(f"📊 Session store: {args.pushes * 10} turns over {args.pushes} sessions (load + save per turn)")
+        for label, backend in backends:
+            store = SessionStore(backend, ttl=3600)
+            samples = []
+            for n in range(args.pushes * 10):
+                session_id = f"s{n % args.pushes}"
+                start = time.perf_counter()
+                session = store.load(session_id) or {"history": [], "river_pending": None,
+                                                     "last_participant": participant, "selection": None}
+                session["history"].append(turn)
+                store.save(session_id, session)
+                samples.append((time.perf_counter() - start) * 1000)
+            stats = store.stats()
+            size = f"{stats['bytes'] / 1e6:6.2f} MB" if "bytes" in stats else "   n/a   "
+            print(f"  {label:<30} p50 {statistics.median(samples):6.3f} ms  max {max(samples):7.2f} ms  "
+                  f"{stats['entries']:5d} sessions  {size}  {stats.get('evictions', 0)} evicted")
+    redis_server.shutdown()
+
+FOLLOW_UPS = [
+    ("Have you been diagnosed with bipolar disorder?", "bipolar", ["No", "No, never", "Not that I know of"]),
+    ("Are you currently pregnant or breastfeeding?", "pregnant", ["No", "No I'm not"]),
+    ("Are you taking an SSRI right now?", "ssri_use", ["Yes, sertraline 50mg", "No"]),
+    ("Do you have uncontrolled high blood pressure?", "blood_pressure", ["No", "It's controlled with meds"]),
+    ("Would you be open to telehealth visits?", "remote_ok", ["Yes", "Prefer in person but yes"]),
+    ("What's the best time to reach you?", "best_time", ["Evenings after 6", "Weekday mornings"]),
+    ("Are you currently seeing a therapist or psychiatrist?", "current_mental_care", ["Yes, weekly therapy", "No"]),
+]
+
+def make_transcript(rng, turns):
+    """A synthetic intake conversation shaped like the /chat flow."""
+    fields = {}
+    messages = [
+        {"role": "user", "content": "Hi, I've been dealing with depression and anxiety for years and want to find a study."},
+        {"role": "assistant", "content": "Thanks! Could you share your name, email and phone number?"},
+        {"role": "user", "content": "Jane Doe, jane.doe@example.com, (555) 123-4567"},
+    ]
+    fields.update({"Name": "Jane Doe", "Email": "jane.doe@example.com", "Phone number": "(555) 123-4567"})
+    messages.append({"role": "assistant", "content": json.dumps(fields, indent=2)})
+    messages.append({"role": "user", "content": "I was born March 10, 1990, female, ZIP is 94110."})
+    fields.update({"Date of birth": "March 10, 1990", "Gender": "Female", "ZIP code": "94110",
+                   "Conditions": ["Depression", "Anxiety"]})
+    messages.append({"role": "assistant", "content": json.dumps(fields, indent=2)})
+    while len(messages) < turns * 2:
+        question, key, answers = rng.choice(FOLLOW_UPS)
+        messages.append({"role": "user", "content": rng.choice(["Sure.", "Okay, what else?", "Go ahead."])})
+        messages.append({"role": "assistant", "content": "Got it! " + question})
+        answer = rng.choice(answers)
+        messages.append({"role": "user", "content": answer + ". " + "I also wanted to mention my sleep has been rough lately. " * rng.randint(0, 3)})
+        fields[key] = answer
+        messages.append({"role": "assistant", "content": json.dumps(fields, indent=2)})
+    return messages
+
+def load_transcripts(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                data = json.loads(line)
+                yield data["messages"] if isinstance(data, dict) else data
+
+def bench_history(args):
+    from chat_history import build_messages, prompt_tokens, trim_history
+    from main import SYSTEM_PROMPT
+
+    if args.transcripts:
+        transcripts = list(load_transcripts(args.transcripts))
+        source = args.transcripts
+    else:
+        rng = random.Random(3)
+        transcripts = [make_transcript(rng, args.turns) for _ in range(20)]
+        source = f"20 synthetic transcripts of {args.turns} turns"
+    before = defaultdict(list)
+    after = defaultdict(list)
+    for messages in transcripts:
+        session = {"history": [], "known_fields": {}}
+        turn = 0
+        for position, message in enumerate(messages):
+            if message["role"] == "user":
+                turn += 1
+                session["history"].append(message)
+                full = [{"role": "system", "content": SYSTEM_PROMPT}] + messages[:position + 1]
+                before[turn].append(prompt_tokens(full))
+                after[turn].append(prompt_tokens(build_messages(SYSTEM_PROMPT, session, budget=args.history_budget)))
+            elif message["role"] == "assistant":
+                session["history"].append(message)
+                trim_history(session)
+    print(f"📊 Prompt tokens per turn, replaying {source} (history budget {args.history_budget} tokens)")
+    print(f"  {'turn':>5} {'full history':>14} {'windowed':>10}")
+    for turn in sorted(before):
+        if turn in (1, 2, 5) or turn % 10 == 0 or turn == max(before):
+            print(f"  {turn:5d} {statistics.mean(before[turn]):14.0f} {statistics.mean(after[turn]):10.0f}")
+    total_before = sum(sum(v) for v in before.values())
+    total_after = sum(sum(v) for v in after.values())
+    print(f"  total prompt tokens: {total_before} → {total_after} ({100 * (1 - total_after / total_before):.0f}% fewer)")
+
+INTAKE_PEOPLE = [
+    ("Jane Doe", "jane.doe@example.com", "(555) 123-4567", "March 10, 1990", "Female", "94110", ["Depression", "PTSD"]),
+    ("Marcus Lee", "mlee@example.org", "415-555-0199", "July 4, 1985", "Male", "94103", ["Anxiety"]),
+    ("Ana Souza", "ana.souza@example.net", "+1 212 555 0147", "December 1, 1978", "Female", "10001", ["Depression"]),
+    ("Tom O'Neil", "tom.oneil@example.com", "(312) 555-0110", "May 22, 2001", "Male", "60601", ["PTSD", "Anxiety"]),
+]
+
+CONDITION_PHRASES = {"Depression": "depression", "Anxiety": "generalized anxiety disorder",
+                     "PTSD": "post-traumatic stress"}
+
+def make_intake_conversation(rng):
+    """User turns for one intake plus the fields they contain, in one of several styles."""
+    name, email, phone, dob, gender, zip_code, conditions = rng.choice(INTAKE_PEOPLE)
+    expected = {"Name": name, "Email": email, "Phone number": phone, "Date of birth": dob,
+                "Gender": gender, "ZIP code": zip_code, "Conditions": conditions}
+    conds = " and ".join(CONDITION_PHRASES[c] for c in conditions)
+    style = rng.choice(["one_shot", "list", "piecemeal", "vague", "lowercase", "negated", "other_condition"])
+    if style == "one_shot":
+        turns = [f"Hi, my name is {name}. Email {email}, phone {phone}. I was born {dob}, I'm {gender.lower()}, "
+                 f"ZIP {zip_code}. I've been struggling with {conds}."]
+    elif style == "list":
+        turns = [f"{name}, {email}, {phone}, {dob}, {gender.lower()}, {zip_code}, {conds}"]
+    elif style == "piecemeal":
+        turns = [f"Hi, I'm looking for help with {conds}.",
+                 f"Sure - I'm {name}, {email}, {phone}.",
+                 f"Born {dob}, gender: {gender.lower()}, zip code {zip_code}."]
+    elif style == "vague":
+        turns = ["hi, I've been feeling down a lot lately", "what kind of studies do you have?",
+                 f"ok, {name.split()[0].lower()} here, you can reach me by email"]
+        expected = None
+    elif style == "lowercase":
+        turns = [f"{name.lower()}, {email}, {phone}, born {dob}, {gender.lower()}, {zip_code}, {conds}"]
+        expected = None
+    elif style == "negated":
+        # Local extraction must not report the negated condition; the model gets this one
+        turns = [f"{name}, {email}, {phone}, {dob}, {gender.lower()}, {zip_code}, {conds}, but no PTSD"]
+        expected = None
+    else:
+        turns = [f"Hi, my name is {name}. Email {email}, phone {phone}. I was born {dob}, I'm {gender.lower()}, "
+                 f"ZIP {zip_code}. I have {conds} and bipolar disorder."]
+        expected = None
+    return style, turns, expected
+
+def bench_extraction(args):
+    import httpx
+    import field_extraction
+    import main
+    import push_to_monday
+
+    rng = random.Random(11)
+    corpus = [make_intake_conversation(rng) for _ in range(args.pushes)]
+
+    # Offline replay: how often the fast path fires and whether what it sends is right
+    field_extraction.fast_path_stats.clear()
+    correct = wrong = 0
+    for style, turns, expected in corpus:
+        session = {"history": [], "known_fields": {}, "last_participant": None, "river_pending": None}
+        for text in turns:
+            session["history"].append({"role": "user", "content": text})
+            fields = field_extraction.fast_path_fields(session, text)
+            if fields:
+                correct += fields == expected
+                wrong += fields != expected
+                break
+    offline = field_extraction.fast_path_report()
+    total_turns = sum(len(t) for _, t, _ in corpus)
+    print(f"📊 Fast-path extraction, {len(corpus)} synthetic intakes ({total_turns} user turns)")
+    print(f"  turns answered locally: {offline.get('bypassed', 0)}/{offline.get('turns', 0)} "
+          f"({100 * offline['bypass_rate']:.0f}%), fields exact {correct}, mismatched {wrong}")
+
+    base_url, server = start_stub_servers(args.latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_app(tmp, base_url, args.studies)
+
+        async def replay(enabled):
+            field_extraction.FAST_PATH_EXTRACTION = enabled
+            samples = []
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+                for n, (_, turns, _) in enumerate(corpus):
+                    for text in turns:
+                        start = time.perf_counter()
+                        await client.post("/chat", json={"session_id": f"x-{enabled}-{n}", "message": text})
+                        samples.append((time.perf_counter() - start) * 1000)
+            return samples
+
+        async def run():
+            results = {}
+            for enabled in (False, True):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results[enabled] = await replay(enabled)
+            await push_to_monday.close_async_client()
+            return results
+
+        results = asyncio.run(run())
+    server.should_exit = True
+    print(f"  /chat replay with {args.latency * 1000:.0f} ms stub LLM latency:")
+    for enabled, label in ((False, "LLM for every turn"), (True, "fast path first")):
+        samples = results[enabled]
+        print(f"  {label:<22} mean {statistics.mean(samples):7.1f} ms/turn, total {sum(samples) / 1000:6.1f} s")
+
+def write_centroids(path):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("zip,lat,lng,city,state\n")
+        for n, (city, state, lat, lng) in enumerate(CITIES):
+            f.write(f"{90000 + n},{lat},{lng},{city},{state}\n")
+
+def bench_geocode(args):
+    import batch_geocode
+    from geocache import GeocodeCache, ZipCentroids
+
+    rng = random.Random(5)
+    unique = min(args.studies // 4, 1000)
+    places = [(f"{10000 + n}", city, state) for n, (city, state, _, _) in
+              ((n, rng.choice(CITIES)) for n in range(unique))]
+
+    def study(i):
+        sites = [{"facility": f"Site {i}-{k}", "zip": zip_code, "city": city, "state": state,
+                  "country": "United States"}
+                 for k, (zip_code, city, state) in enumerate(rng.sample(places, rng.randint(1, 9)))]
+        return {"nct_id": f"NCT{i:08d}", "location": f"{sites[0]['city']}, {sites[0]['state']}",
+                "site_locations_and_contacts": sites}
+    with tempfile.TemporaryDirectory() as tmp:
+        centroids_path = os.path.join(tmp, "zips.csv")
+        write_centroids(centroids_path)
+        input_path = os.path.join(tmp, "studies.jsonl")
+        output_path = os.path.join(tmp, "geocoded.jsonl")
+        write_studies(input_path, (study(i) for i in range(args.studies)))
+        sites = sum(len(s["site_locations_and_contacts"]) for s in iter_studies(input_path))
+        provider = batch_geocode.OfflineProvider(ZipCentroids(centroids_path), rate=args.rate,
+                                                 concurrency=20, latency=args.latency)
+        print(f"📊 Batch geocoding {args.studies} studies with {sites} sites in {unique} unique ZIPs, "
+              f"stub latency {args.latency * 1000:.0f} ms, limit {args.rate:.0f} req/s")
+        legacy = sites * (args.latency + 0.05)
+        print(f"  {'per-site sequential, 0.05s sleep':<34} ~{legacy:7.1f} s (estimated, no dedup or cache)")
+
+        def run(label, cache_path, interrupt_after=None, resume=True):
+            cache = GeocodeCache(os.path.join(tmp, cache_path))
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    counters = asyncio.run(asyncio.wait_for(batch_geocode.geocode_file(
+                        input_path, output_path, provider, cache, batch_size=100, resume=resume), interrupt_after))
+                except asyncio.TimeoutError:
+                    counters = None
+            elapsed = time.perf_counter() - start
+            if counters is None:
+                print(f"  {label:<34} {elapsed:8.1f} s (interrupted)")
+            else:
+                resumed = f", resumed after {counters['resumed_after']}" if counters["resumed_after"] else ""
+                print(f"  {label:<34} {elapsed:8.1f} s  {counters['provider_calls']:6d} provider calls, "
+                      f"{counters['cache_hits']:6d} cache hits{resumed}")
+
+        run("batch, cold cache", "cold.sqlite3")
+        os.remove(output_path)
+        run("batch, warm persistent cache", "cold.sqlite3")
+        os.remove(output_path)
+        run("batch, killed mid-run", "resume.sqlite3", interrupt_after=unique / args.rate / 2)
+        run("batch, resumed from checkpoint", "resume.sqlite3")
+
+def legacy_index(paths, keywords):
+    # The original loop: ET.parse every file, extract everything, then filter
+    import xml.etree.ElementTree as ET
+    from index_studies_general import extract_contact_info, extract_location, extract_summary, matches_keywords
+    kept = 0
+    for path in paths:
+        root = ET.parse(path).getroot()
+        title = root.findtext("brief_title") or ""
+        summary = extract_summary(root)
+        eligibility = root.findtext("eligibility/criteria/textblock") or ""
+        _, _, _, country = extract_contact_info(root)
+        extract_location(root)
+        if matches_keywords(" ".join([title, summary, eligibility]), keywords) and country == "United States":
+            kept += 1
+    return kept
+
+def bench_ingest(args):
+    import index_studies_general
+
+    keywords = ["depression", "anxiety"]
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_dir = os.path.join(tmp, "xml")
+        start = time.perf_counter()
+        write_xml_corpus(xml_dir, args.files)
+        print(f"📊 Ingestion of {args.files} synthetic XML files (generated in {time.perf_counter() - start:.0f}s), "
+              f"keywords {keywords}")
+        paths = index_studies_general.list_xml_files(xml_dir)
+
+        start = time.perf_counter()
+        kept = legacy_index(paths, keywords)
+        elapsed = time.perf_counter() - start
+        print(f"  {'serial ET.parse (original)':<32} {len(paths) / elapsed:9.0f} files/s  ({kept} studies)")
+
+        for workers in sorted({1, args.workers}):
+            output = os.path.join(tmp, f"out-{workers}.jsonl")
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                kept = index_studies_general.index_studies(keywords, xml_dir, output, workers=workers,
+                                                           incremental=False)
+            elapsed = time.perf_counter() - start
+            label = f"prefilter + iterparse, {workers} worker{'s' if workers != 1 else ''}"
+            print(f"  {label:<32} {len(paths) / elapsed:9.0f} files/s  ({kept} studies)")
+
+        # Simulate a re-download: every file touched, 1% edited, 0.5% withdrawn
+        rng = random.Random(7)
+        for path in paths:
+            os.utime(path)
+        for path in rng.sample(paths, len(paths) // 100):
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("<!-- updated -->\n")
+        for path in rng.sample(paths, len(paths) // 200):
+            os.remove(path)
+        for label in ("incremental, all files touched", "incremental, nothing changed"):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                kept = index_studies_general.index_studies(keywords, xml_dir, output, workers=args.workers)
+            elapsed = time.perf_counter() - start
+            print(f"  {label:<32} {len(paths) / elapsed:9.0f} files/s  ({kept} studies)")
+
+BENCHMARKS = {
+    "catalog": bench_catalog,
+    "spatial": bench_spatial,
+    "memory": bench_memory,
+    "concurrency": bench_concurrency,
+    "scoring": bench_scoring,
+    "tagging": bench_tagging,
+    "eligibility": bench_eligibility,
+    "matchcache": bench_match_cache,
+    "batch": bench_batch,
+    "standing": bench_standing,
+    "topk": bench_topk,
+    "crm": bench_crm,
+    "ingest": bench_ingest,
+    "geocode": bench_geocode,
+    "sessions": bench_sessions,
+    "history": bench_history,
+    "extraction": bench_extraction,
+    "streaming": bench_streaming,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Hey Hope matching benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--studies", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--match", action="store_true", help="include match_studies in the timing")
+    parser.add_argument("--pushes", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=10000, help="session store entry cap")
+    parser.add_argument("--turns", type=int, default=40, help="synthetic transcript length for history")
+    parser.add_argument("--history-budget", type=int, default=HISTORY_TOKEN_BUDGET,
+                        help="token budget for the history window; lower it to see short transcripts windowed")
+    parser.add_argument("--transcripts", help="JSONL of recorded transcripts (lists of chat messages) to replay")
+    parser.add_argument("--files", type=int, default=500000, help="synthetic XML corpus size for ingest")
+    parser.add_argument("--participants", type=int, default=100000, help="stored leads to re-match for batch")
+    parser.add_argument("--changed", type=int, default=100, help="studies added or changed per refresh for standing")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub upstream latency in seconds")
+    parser.add_argument("--rate", type=float, default=100, help="geocoding provider rate limit (req/s)")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == "__main__":
+    main()
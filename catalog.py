@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+import time
+
+from matcher import synonym_vocabulary
+from study_index import CatalogIndex
+from study_records import StudyRecord, normalize_tags, normalize_states
+from study_store import iter_studies
+
+DEFAULT_INDEX_PATH = os.getenv("STUDY_INDEX_PATH", "indexed_heyhope_filtered_geocoded.json")
+RELOAD_CHECK_INTERVAL = float(os.getenv("STUDY_INDEX_RELOAD_INTERVAL", "5"))
+
+def normalize_coordinates(value):
+    # Geocoders have written coordinates as [lat, lng], (lat, lng) and {"lat", "lng"}
+    if isinstance(value, dict):
+        lat, lng = value.get("lat"), value.get("lng")
+    elif isinstance(value, (list, tuple)) and len(value) == 2:
+        lat, lng = value
+    else:
+        return None
+    try:
+        return {"lat": float(lat), "lng": float(lng)}
+    except (TypeError, ValueError):
+        return None
+
+def normalize_study(study):
+    study["tags"] = normalize_tags(study.get("tags"))
+    study["states"] = normalize_states(study.get("states"))
+    study["coordinates"] = normalize_coordinates(study.get("coordinates"))
+    study["site_locations_and_contacts"] = study.get("site_locations_and_contacts") or []
+    return study
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class CatalogSnapshot:
+    """An immutable, fully loaded view of the study index."""
+
+    def __init__(self, studies, path, mtime, size, sha256):
+        self.studies = studies
+        self.records = [StudyRecord(s) for s in studies]
+        self.by_nct_id = {s.get("nct_id"): s for s in studies}
+        self.index = CatalogIndex(self.records, synonym_vocabulary())
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.sha256 = sha256
+        self.version = sha256[:12]
+        self.loaded_at = time.time()
+
+class StudyCatalog:
+    """
+    Process-wide holder for the study index.
+
+    The file is parsed once and swapped atomically when its mtime/size and
+    content hash change, so request handlers never re-read it.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, check_interval=RELOAD_CHECK_INTERVAL, auto_refresh=True):
+        # auto_refresh=False leaves change detection to the caller (e.g. a
+        # background task), so snapshot() never touches the file itself
+        self.path = path
+        self.check_interval = check_interval
+        self.auto_refresh = auto_refresh
+        self._snapshot = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _build(self, stat, digest):
+        studies = [normalize_study(s) for s in iter_studies(self.path)]
+        return CatalogSnapshot(studies, self.path, stat.st_mtime, stat.st_size, digest)
+
+    def load(self):
+        with self._lock:
+            stat = os.stat(self.path)
+            snapshot = self._build(stat, file_sha256(self.path))
+            self._snapshot = snapshot
+            self._last_check = time.monotonic()
+        print(f"📚 Loaded {len(snapshot.studies)} studies from {self.path} (version {snapshot.version})")
+        return snapshot
+
+    def refresh_if_changed(self):
+        current = self._snapshot
+        if current is None:
+            return self.load()
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                print("⚠️ Study index unavailable, keeping current catalog:", e)
+                return current
+            if stat.st_mtime == current.mtime and stat.st_size == current.size:
+                return current
+            digest = file_sha256(self.path)
+            if digest == current.sha256:
+                current.mtime, current.size = stat.st_mtime, stat.st_size
+                return current
+            try:
+                snapshot = self._build(stat, digest)
+            except Exception as e:
+                print("⚠️ Failed to reload study index, keeping current catalog:", e)
+                return current
+            self._snapshot = snapshot
+        print(f"🔄 Reloaded {len(snapshot.studies)} studies from {self.path} (version {snapshot.version})")
+        return snapshot
+
+    def snapshot(self):
+        if self._snapshot is None:
+            return self.load()
+        if self.auto_refresh and time.monotonic() - self._last_check >= self.check_interval:
+            return self.refresh_if_changed()
+        return self._snapshot
+
+    def studies(self):
+        return self.snapshot().studies
+
+    def stats(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"loaded": False, "path": self.path}
+        return {
+            "loaded": True,
+            "path": snapshot.path,
+            "version": snapshot.version,
+            "studies": len(snapshot.studies),
+            "loaded_at": snapshot.loaded_at,
+        }
@@ -0,0 +1,99 @@
+import json
+import os
+import re
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+HISTORY_MIN_MESSAGES = int(os.getenv("HISTORY_MIN_MESSAGES", "4"))
+HISTORY_MAX_STORED = int(os.getenv("HISTORY_MAX_STORED", "40"))
+# Per-message framing overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+try:
+    import tiktoken
+    _encoding = tiktoken.encoding_for_model("gpt-4")
+except Exception:
+    _encoding = None
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text):
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # Without tiktoken: words and punctuation, long words as ~4 chars per token
+    return sum(max(1, len(piece) // 4) for piece in _WORD_RE.findall(text))
+
+def message_tokens(message):
+    return count_tokens(message.get("content")) + MESSAGE_OVERHEAD_TOKENS
+
+def prompt_tokens(messages):
+    return sum(message_tokens(m) for m in messages)
+
+def fields_from_message(message):
+    """Participant fields the assistant already returned as JSON in this message."""
+    if message.get("role") != "assistant":
+        return {}
+    match = re.search(r"{[\s\S]*}", message.get("content") or "")
+    if not match:
+        return {}
+    try:
+        data = json.loads(match.group())
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: v for k, v in data.items() if v not in (None, "", [], {})}
+
+def collect_fields(messages, fields=None):
+    fields = dict(fields or {})
+    for message in messages:
+        fields.update(fields_from_message(message))
+    return fields
+
+def summary_message(fields):
+    return {
+        "role": "system",
+        "content": "Participant details already collected earlier in this conversation "
+                   "(do not ask for them again): " + json.dumps(fields, separators=(",", ":")),
+    }
+
+def window_start(history, budget=HISTORY_TOKEN_BUDGET, min_messages=HISTORY_MIN_MESSAGES):
+    """
+    Index of the oldest message that fits the token budget, counting back
+    from the newest. The window starts on a user message, so a reply is
+    never kept without the question it answers.
+    """
+    used = 0
+    start = len(history)
+    for idx in range(len(history) - 1, -1, -1):
+        used += message_tokens(history[idx])
+        if used > budget and len(history) - start >= min_messages:
+            break
+        if idx == 0 or history[idx].get("role") == "user":
+            start = idx
+    return start
+
+def build_messages(system_prompt, session, budget=HISTORY_TOKEN_BUDGET, min_messages=HISTORY_MIN_MESSAGES):
+    """
+    System prompt, then a summary of fields from turns that fell out of the
+    window, then the most recent turns that fit the token budget.
+    """
+    history = session["history"]
+    start = window_start(history, budget, min_messages)
+    fields = collect_fields(history[:start], session.get("known_fields"))
+    messages = [{"role": "system", "content": system_prompt}]
+    if fields:
+        messages.append(summary_message(fields))
+    messages.extend(history[start:])
+    return messages
+
+def trim_history(session, max_stored=HISTORY_MAX_STORED):
+    """Fold the oldest stored turns into known_fields so sessions stay bounded."""
+    history = session["history"]
+    if len(history) > max_stored:
+        cut = len(history) - max_stored
+        while cut < len(history) - 1 and history[cut].get("role") != "user":
+            cut += 1
+        session["known_fields"] = collect_fields(history[:cut], session.get("known_fields"))
+        del history[:cut]
@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from collections import Counter, deque
+
+import push_to_monday
+from push_to_monday import build_mutation, create_item_mutation, update_item_mutation, monday_headers
+
+CRM_QUEUE_PATH = os.getenv("CRM_QUEUE_PATH", "crm_queue.sqlite3")
+CRM_BATCH_SIZE = int(os.getenv("CRM_BATCH_SIZE", "10"))
+CRM_MAX_ATTEMPTS = int(os.getenv("CRM_MAX_ATTEMPTS", "8"))
+CRM_BASE_BACKOFF = float(os.getenv("CRM_BASE_BACKOFF", "2"))
+CRM_MAX_BACKOFF = float(os.getenv("CRM_MAX_BACKOFF", "300"))
+# Minimum spacing between Monday.com requests (their API is complexity rate limited)
+CRM_MIN_INTERVAL = float(os.getenv("CRM_MIN_INTERVAL", "1"))
+CRM_POLL_INTERVAL = float(os.getenv("CRM_POLL_INTERVAL", "0.5"))
+# A claimed row is invisible to other workers until sent, failed or this long has passed
+CRM_LEASE_SECONDS = float(os.getenv("CRM_LEASE_SECONDS", "60"))
+
+def payload_hash(payload):
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def backoff_seconds(attempts):
+    return min(CRM_MAX_BACKOFF, CRM_BASE_BACKOFF * (2 ** max(0, attempts - 1)))
+
+class CRMQueue:
+    """
+    Durable SQLite outbox for Monday.com pushes.
+
+    One pending row per dedup key (a later push of the same session replaces
+    the queued payload). Once a key has been created on the board, its item
+    id is remembered so further pushes become column updates instead of
+    duplicate items, and identical payloads are dropped.
+
+    The file is shared by every worker process, so due_batch claims the rows
+    it returns (status 'in_flight' with a lease) in the same transaction that
+    selects them. A worker that dies mid-push leaves its lease to expire and
+    another worker picks the rows up again.
+    """
+
+    def __init__(self, path=CRM_QUEUE_PATH):
+        self.path = path
+        self.counters = Counter()
+        self.push_latencies = deque(maxlen=500)
+        self.request_latencies = deque(maxlen=500)
+        self._db = None
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._loop = None
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._db.executescript("""
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    dedup_key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    last_error TEXT,
+                    lease_expires_at REAL
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS outbox_pending_key
+                    ON outbox (dedup_key) WHERE status = 'pending';
+                CREATE TABLE IF NOT EXISTS pushed (
+                    dedup_key TEXT PRIMARY KEY,
+                    item_id TEXT NOT NULL,
+                    payload_hash TEXT NOT NULL,
+                    pushed_at REAL NOT NULL
+                );
+            """)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(outbox)")}
+            if "lease_expires_at" not in columns:
+                self._db.execute("ALTER TABLE outbox ADD COLUMN lease_expires_at REAL")
+                self._db.commit()
+        return self._db
+
+    def enqueue(self, participant_data, dedup_key):
+        payload = json.dumps(participant_data, sort_keys=True, default=str)
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            pushed = db.execute(
+                "SELECT payload_hash FROM pushed WHERE dedup_key = ?", (dedup_key,)
+            ).fetchone()
+            if pushed and pushed[0] == payload_hash(payload):
+                self.counters["deduplicated"] += 1
+                return False
+            replaced = db.execute(
+                "UPDATE outbox SET payload = ?, enqueued_at = ? WHERE dedup_key = ? AND status = 'pending'",
+                (payload, now, dedup_key),
+            ).rowcount
+            if replaced:
+                self.counters["deduplicated"] += 1
+            else:
+                db.execute(
+                    "INSERT INTO outbox (dedup_key, payload, next_attempt_at, enqueued_at) VALUES (?, ?, ?, ?)",
+                    (dedup_key, payload, now, now),
+                )
+                self.counters["enqueued"] += 1
+            db.commit()
+        if self._wakeup is not None:
+            # enqueue runs in worker threads; asyncio.Event is not thread-safe
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def due_batch(self, limit=CRM_BATCH_SIZE):
+        """Claim up to limit due rows for this worker, at most one per dedup key."""
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Rows whose key is already in flight wait, so a key is never
+                # created on the board twice by two workers
+                rows = db.execute(
+                    """SELECT o.id, o.dedup_key, o.payload, o.attempts, o.enqueued_at, p.item_id
+                       FROM outbox o LEFT JOIN pushed p ON p.dedup_key = o.dedup_key
+                       WHERE ((o.status = 'pending' AND o.next_attempt_at <= ?)
+                              OR (o.status = 'in_flight' AND o.lease_expires_at <= ?))
+                         AND NOT EXISTS (
+                             SELECT 1 FROM outbox f
+                             WHERE f.dedup_key = o.dedup_key AND f.status = 'in_flight' AND f.lease_expires_at > ?)
+                       ORDER BY o.id LIMIT ?""",
+                    (now, now, now, limit),
+                ).fetchall()
+                claimed, keys = [], set()
+                for row in rows:
+                    if row[1] not in keys:
+                        keys.add(row[1])
+                        claimed.append(row)
+                db.executemany(
+                    "UPDATE outbox SET status = 'in_flight', lease_expires_at = ? WHERE id = ?",
+                    [(now + CRM_LEASE_SECONDS, row[0]) for row in claimed],
+                )
+            except BaseException:
+                db.rollback()
+                raise
+            db.commit()
+        return claimed
+
+    def mark_sent(self, row_id, dedup_key, payload, item_id, enqueued_at):
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            # A push for the same key that arrived while this one was in
+            # flight is its own pending row and goes out as an update
+            db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+            db.execute(
+                "INSERT OR REPLACE INTO pushed (dedup_key, item_id, payload_hash, pushed_at) VALUES (?, ?, ?, ?)",
+                (dedup_key, str(item_id), payload_hash(payload), now),
+            )
+            db.commit()
+        self.counters["sent"] += 1
+        self.push_latencies.append(now - enqueued_at)
+
+    def mark_failed(self, row_id, attempts, error, retry_after=None):
+        attempts += 1
+        status = "failed" if attempts >= CRM_MAX_ATTEMPTS else "pending"
+        delay = retry_after if retry_after is not None else backoff_seconds(attempts)
+        with self._lock:
+            db = self._conn()
+            superseded = db.execute(
+                """SELECT 1 FROM outbox o JOIN outbox n ON n.dedup_key = o.dedup_key AND n.status = 'pending'
+                   WHERE o.id = ?""",
+                (row_id,),
+            ).fetchone()
+            if superseded and status == "pending":
+                # A newer payload for the same key is already queued; retry that one instead
+                db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+            else:
+                db.execute(
+                    """UPDATE outbox SET attempts = ?, status = ?, next_attempt_at = ?, last_error = ?,
+                       lease_expires_at = NULL WHERE id = ?""",
+                    (attempts, status, time.time() + delay, str(error)[:500], row_id),
+                )
+            db.commit()
+        self.counters["gave_up" if status == "failed" else "retries"] += 1
+        if status == "failed":
+            print(f"❌ Giving up on Monday.com push {row_id} after {attempts} attempts:", error)
+
+    def depth(self):
+        with self._lock:
+            rows = self._conn().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return dict(rows)
+
+    def stats(self):
+        depth = self.depth()
+        stats = dict(self.counters)
+        stats["pending"] = depth.get("pending", 0)
+        stats["in_flight"] = depth.get("in_flight", 0)
+        stats["failed"] = depth.get("failed", 0)
+        for name, samples in (("push_latency", self.push_latencies), ("request_latency", self.request_latencies)):
+            if samples:
+                stats[f"{name}_p50_s"] = round(statistics.median(samples), 3)
+                stats[f"{name}_max_s"] = round(max(samples), 3)
+        return stats
+
+    async def send_batch(self, rows):
+        """Send one aliased GraphQL mutation for rows; returns a Retry-After hint or None."""
+        fields = []
+        for n, (row_id, dedup_key, payload, attempts, enqueued_at, item_id) in enumerate(rows):
+            participant_data = json.loads(payload)
+            if item_id:
+                fields.append(update_item_mutation(item_id, participant_data, alias=f"m{n}"))
+            else:
+                fields.append(create_item_mutation(participant_data, alias=f"m{n}"))
+        start = time.monotonic()
+        try:
+            response = await push_to_monday.get_async_client().post(
+                push_to_monday.MONDAY_API_URL, headers=monday_headers(), json={"query": build_mutation(fields)}
+            )
+        except Exception as e:
+            for row_id, _, _, attempts, _, _ in rows:
+                await asyncio.to_thread(self.mark_failed, row_id, attempts, e)
+            return None
+        self.request_latencies.append(time.monotonic() - start)
+        self.counters["batches"] += 1
+
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get("retry-after")
+            retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+            for row_id, _, _, attempts, _, _ in rows:
+                await asyncio.to_thread(self.mark_failed, row_id, attempts, f"HTTP {response.status_code}", retry_after)
+            return retry_after
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"errors": [{"message": f"HTTP {response.status_code}: non-JSON response"}]}
+        data = body.get("data") or {}
+        errors_by_alias = {}
+        for error in body.get("errors") or []:
+            path = error.get("path") or []
+            errors_by_alias[path[0] if path else None] = error.get("message")
+
+        for n, (row_id, dedup_key, payload, attempts, enqueued_at, item_id) in enumerate(rows):
+            result = data.get(f"m{n}")
+            if result and result.get("id"):
+                await asyncio.to_thread(self.mark_sent, row_id, dedup_key, payload, result["id"], enqueued_at)
+            else:
+                error = errors_by_alias.get(f"m{n}") or errors_by_alias.get(None) or "no item id returned"
+                await asyncio.to_thread(self.mark_failed, row_id, attempts, error)
+        return None
+
+    async def run_worker(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        last_request = 0.0
+        while True:
+            rows = await asyncio.to_thread(self.due_batch)
+            if not rows:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=CRM_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            wait = CRM_MIN_INTERVAL - (time.monotonic() - last_request)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            last_request = time.monotonic()
+            try:
+                retry_after = await self.send_batch(rows)
+            except Exception as e:
+                print("⚠️ CRM worker error:", e)
+                retry_after = CRM_BASE_BACKOFF
+            if retry_after:
+                await asyncio.sleep(retry_after)
@@ -0,0 +1,118 @@
+import re
+
+# Phrases that mark a study as aimed at women (pregnancy, mothers, ...);
+# match_studies skips these for male participants unless they are River studies
+FEMALE_FOCUSED_TERMS = [
+    "pregnant women", "pregnancy", "currently pregnant", "women aged",
+    "female only", "females only", "breastfeeding women", "mothers"
+]
+
+EXCLUSION_HEADER_RE = re.compile(r"\bexclusion\s+criteria\b|\bexclusions?\s*:", re.I)
+INCLUSION_HEADER_RE = re.compile(r"\binclusion\s+criteria\b|\binclusions?\s*:", re.I)
+PREGNANCY_RE = re.compile(r"\bpregnan\w*|\bbreast[- ]?feeding\b|\blactating\b|\bnursing mothers?\b", re.I)
+BIPOLAR_RE = re.compile(r"\bbipolar\b|\bmanic episodes?\b|\bmania\b", re.I)
+VETERAN_RE = re.compile(r"\bveterans?\b|\bservice members?\b|\bactive[- ]duty\b", re.I)
+# Only phrases that name remote care: the include_telehealth tag derived
+# from this lifts the 100-mile location gate, so "from home" is not enough
+TELEHEALTH_RE = re.compile(
+    r"\btele[- ]?health\b|\btele[- ]?medicine\b|\btele[- ]?psychiatry\b|\bvirtual visits?\b|\bvideo visits?\b|\bonline therapy\b",
+    re.I,
+)
+AGE_UNITS = {"year": 1.0, "month": 1 / 12, "week": 1 / 52, "day": 1 / 365}
+AGE_FIELD_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(year|month|week|day)s?", re.I)
+YEARS = r"(?:years?|yrs?)(?:\s+(?:of\s+age|old))?"
+AGE_RANGE_RES = [
+    re.compile(rf"\b(?:aged?|ages)\s+(?:between\s+)?(\d{{1,2}})\s*(?:to|-|–|and)\s*(\d{{1,3}})\b", re.I),
+    re.compile(rf"\bbetween\s+(?:the\s+ages\s+of\s+)?(\d{{1,2}})\s*(?:and|-|–)\s*(\d{{1,3}})\s*{YEARS}", re.I),
+    re.compile(rf"\b(\d{{1,2}})\s*(?:to|-|–)\s*(\d{{1,3}})\s*{YEARS}", re.I),
+]
+AGE_MIN_RES = [
+    re.compile(rf"\b(\d{{1,2}})\s*{YEARS}\s*(?:of\s+age\s*)?(?:or|and)\s+(?:older|over|above)", re.I),
+    re.compile(rf"(?:≥|>=|\bat\s+least|\bminimum(?:\s+age)?(?:\s+of)?|\bover\s+the\s+age\s+of|\baged?\s+over)\s*(\d{{1,2}})\b", re.I),
+]
+AGE_MAX_RES = [
+    re.compile(rf"\b(\d{{1,3}})\s*{YEARS}\s*(?:of\s+age\s*)?(?:or|and)\s+(?:younger|under|below)", re.I),
+    re.compile(rf"(?:≤|<=|\bno\s+older\s+than|\bup\s+to(?:\s+age)?|\bmaximum(?:\s+age)?(?:\s+of)?|\bunder\s+the\s+age\s+of)\s*(\d{{1,3}})\s*{YEARS}", re.I),
+]
+
+def split_criteria(text):
+    """(inclusion, exclusion) sections of a criteria textblock; without headers it is all inclusion."""
+    text = text or ""
+    exclusion = EXCLUSION_HEADER_RE.search(text)
+    if not exclusion:
+        return text, ""
+    inclusion, rest = text[:exclusion.start()], text[exclusion.end():]
+    # Some records list exclusions first
+    later_inclusion = INCLUSION_HEADER_RE.search(rest)
+    if later_inclusion:
+        inclusion += " " + rest[later_inclusion.end():]
+        rest = rest[:later_inclusion.start()]
+    return inclusion, rest
+
+def parse_age_field(value):
+    """Years from a registry age field such as "18 Years" or "6 Months"; "N/A" is None."""
+    match = AGE_FIELD_RE.search(value or "")
+    if not match:
+        return None
+    years = float(match.group(1)) * AGE_UNITS[match.group(2).lower()]
+    return int(years) if years == int(years) else round(years, 2)
+
+def _first_age(patterns, text):
+    for pattern in patterns:
+        for match in pattern.finditer(text):
+            values = [int(v) for v in match.groups()]
+            if all(0 <= v <= 120 for v in values):
+                return values
+    return None
+
+def ages_from_text(text):
+    """Age bounds stated in the inclusion criteria, e.g. "aged 18-65" or "18 years or older"."""
+    text = text or ""
+    bounds = _first_age(AGE_RANGE_RES, text)
+    if bounds and bounds[0] <= bounds[1]:
+        return bounds[0], bounds[1]
+    low = _first_age(AGE_MIN_RES, text)
+    high = _first_age(AGE_MAX_RES, text)
+    return (low[0] if low else None), (high[0] if high else None)
+
+def normalize_sex(value):
+    value = (value or "").strip().lower()
+    return value if value in ("female", "male") else "all"
+
+def extract_eligibility_features(eligibility_text, sex=None, minimum_age=None, maximum_age=None, description=""):
+    """
+    Structured eligibility for one study, computed once at index time.
+    sex/minimum_age/maximum_age are the registry's eligibility fields;
+    the criteria text fills in an age bound only when its field is absent.
+    """
+    text = eligibility_text or ""
+    inclusion, exclusion = split_criteria(text)
+    text_min = text_max = None
+    if minimum_age is None or maximum_age is None:
+        text_min, text_max = ages_from_text(inclusion)
+    # A registry field that is present wins, even "N/A" (no limit)
+    min_age = parse_age_field(minimum_age) if minimum_age is not None else text_min
+    max_age = parse_age_field(maximum_age) if maximum_age is not None else text_max
+    lowered = text.lower()
+    return {
+        "sex": normalize_sex(sex),
+        "female_focused": any(term in lowered for term in FEMALE_FOCUSED_TERMS),
+        "excludes_pregnancy": bool(PREGNANCY_RE.search(exclusion)),
+        "excludes_bipolar": bool(BIPOLAR_RE.search(exclusion)),
+        "requires_veteran": bool(VETERAN_RE.search(inclusion)),
+        # Not the exclusion criteria: "no telehealth visits" is not a telehealth study
+        "telehealth": bool(TELEHEALTH_RE.search(inclusion) or TELEHEALTH_RE.search(description or "")),
+        "min_age_years": min_age,
+        "max_age_years": max_age,
+    }
+
+def study_features(study):
+    """Features stored by the indexer, or derived from the study's own fields for older index files."""
+    features = study.get("eligibility_features")
+    if isinstance(features, dict):
+        return features
+    return extract_eligibility_features(
+        study.get("eligibility_text"),
+        sex=study.get("sex"),
+        description=(study.get("summary") or "") + " " + (study.get("study_title") or ""),
+    )
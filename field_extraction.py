@@ -0,0 +1,197 @@
+import os
+import re
+from collections import Counter
+from datetime import datetime
+
+from dateutil import parser as date_parser
+
+from chat_history import collect_fields
+from matcher import SYNONYMS
+from utils import normalize_gender
+
+FAST_PATH_EXTRACTION = os.getenv("FAST_PATH_EXTRACTION", "1") == "1"
+
+# The intake fields SYSTEM_PROMPT asks the model to return, in its key spelling
+REQUIRED_FIELDS = ["Name", "Email", "Phone number", "Date of birth", "Gender", "ZIP code", "Conditions"]
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)*\.[A-Za-z]{2,}")
+PHONE_RE = re.compile(r"(?<![\w+])(?:\+?1[\s.-]?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}(?!\d)")
+ZIP_RE = re.compile(r"(?<![\d-])\d{5}(?:-\d{4})?(?![\d-])")
+MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+DATE_RE = re.compile(
+    rf"\b{MONTHS}\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}\b"
+    rf"|\b\d{{1,2}}(?:st|nd|rd|th)?\s+{MONTHS},?\s+\d{{4}}\b"
+    r"|\b\d{1,2}/\d{1,2}/\d{4}\b"
+    r"|\b\d{4}-\d{2}-\d{2}\b",
+    re.I,
+)
+GENDER_WORDS = {
+    "female": "female", "woman": "female", "f": "female",
+    "male": "male", "man": "male", "m": "male",
+    "non-binary": "non-binary", "nonbinary": "non-binary",
+}
+GENDER_RE = re.compile(r"\b(non-binary|nonbinary|female|male|woman|man)\b", re.I)
+GENDER_LABEL_RE = re.compile(r"\b(?:gender|sex)\s*(?:is|:|-)?\s*(f|m|female|male)\b", re.I)
+NAME_WORD = r"[A-Z][a-z]*(?:['’-][A-Z]?[a-z]+)*"
+NAME_INTRO_RE = re.compile(rf"(?i:\bmy name is|\bname\s*:|\bi am|\bi'm|\bthis is)\s+({NAME_WORD}(?:\s+{NAME_WORD}){{1,2}})")
+NAME_SEGMENT_RE = re.compile(rf"^\s*({NAME_WORD}(?:\s+{NAME_WORD}){{1,2}})\s*$")
+NOT_NAME_WORDS = {"female", "male", "woman", "man", "hi", "hello", "hey", "zip", "depression", "anxiety",
+                  "ptsd", "born", "my", "i", "the", "phone", "email", "thanks", "yes", "no", "not", "so",
+                  "feeling", "looking", "interested", "here", "really", "very", "just", "struggling",
+                  "depressed", "anxious", "tired", "okay", "ok", "sure", "from", "in", "a", "an"}
+# A condition is treated as negated when one of these is within NEGATION_WINDOW words before it
+NEGATION_CUES = {"no", "not", "never", "without", "deny", "denies", "denied", "nor", "negative"}
+NEGATION_WINDOW = 4
+# A negation does not reach past a clause break ("|" marks punctuation)
+CLAUSE_BREAKS = {"|", "but", "only", "except"}
+# Condition-like words the synonym table does not cover; any left over means the model decides
+CONDITION_HINTS = {
+    "disorder", "disease", "syndrome", "illness", "bipolar", "manic", "mania", "schizophrenia",
+    "schizoaffective", "psychosis", "psychotic", "ocd", "adhd", "autism", "autistic", "insomnia", "panic",
+    "phobia", "anorexia", "bulimia", "bpd", "borderline", "dementia", "alzheimer", "alzheimers",
+    "postpartum", "addiction", "alcoholism", "dysthymia", "trauma", "depressed", "depressive", "anxious",
+}
+
+fast_path_stats = Counter()
+
+def _single(values):
+    distinct = list(dict.fromkeys(values))
+    return distinct[0] if len(distinct) == 1 else None
+
+def extract_email(text):
+    return _single(m.lower() for m in EMAIL_RE.findall(text))
+
+def extract_phone(text):
+    matches = PHONE_RE.findall(text)
+    digits = _single(re.sub(r"\D", "", m)[-10:] for m in matches)
+    if not digits:
+        return None
+    return next(m.strip() for m in matches if re.sub(r"\D", "", m)[-10:] == digits)
+
+def extract_dob(text):
+    dates = []
+    for candidate in DATE_RE.findall(text):
+        try:
+            dob = date_parser.parse(candidate, fuzzy=False)
+        except (ValueError, OverflowError):
+            continue
+        age = (datetime.today() - dob).days / 365.25
+        if 0 < age < 120:
+            dates.append(dob.strftime("%B %d, %Y").replace(" 0", " "))
+    return _single(dates)
+
+def extract_zip(text):
+    # ZIP digits must not be part of a phone number, date or email
+    for pattern in (EMAIL_RE, PHONE_RE, DATE_RE):
+        text = pattern.sub(" ", text)
+    return _single(ZIP_RE.findall(text))
+
+def extract_gender(text):
+    labelled = GENDER_LABEL_RE.findall(text)
+    words = labelled or GENDER_RE.findall(text)
+    return _single(normalize_gender(GENDER_WORDS[w.lower()]) for w in words)
+
+def _words(text):
+    text = re.sub(r"n['’]t\b", " not", text.lower())
+    text = re.sub(r"[,;.!?()]+", " | ", text)
+    return re.sub(r"[^a-z0-9|]+", " ", text).split()
+
+def condition_mentions(words):
+    """(position, length, condition, negated) for each SYNONYMS term in words."""
+    mentions = []
+    for condition, terms in SYNONYMS.items():
+        for term in terms:
+            term_words = _words(term)
+            for i in range(len(words) - len(term_words) + 1):
+                if words[i:i + len(term_words)] == term_words:
+                    start = max(0, i - NEGATION_WINDOW)
+                    breaks = [n for n in range(start, i) if words[n] in CLAUSE_BREAKS]
+                    window = words[(breaks[-1] + 1 if breaks else start):i]
+                    negated = any(w in NEGATION_CUES for w in window)
+                    mentions.append((i, len(term_words), condition, negated))
+    return mentions
+
+def extract_conditions(text):
+    mentions = condition_mentions(_words(text))
+    negated = {condition for _, _, condition, is_negated in mentions if is_negated}
+    found = {}
+    for position, _, condition, _ in mentions:
+        if condition not in negated:
+            found[condition] = min(position, found.get(condition, position))
+    # In the order the user mentioned them
+    return ["PTSD" if c == "ptsd" else c.title() for c in sorted(found, key=found.get)] or None
+
+def conditions_uncertain(text):
+    """True when a condition is negated or condition-like words remain that SYNONYMS does not cover."""
+    words = _words(text)
+    mentions = condition_mentions(words)
+    if any(negated for _, _, _, negated in mentions):
+        return True
+    covered = {i for position, length, _, _ in mentions for i in range(position, position + length)}
+    return any(w in CONDITION_HINTS for i, w in enumerate(words) if i not in covered)
+
+def extract_name(text):
+    names = NAME_INTRO_RE.findall(text)
+    if not names:
+        # "Jane Doe, jane@example.com, ..." style: a bare name as the first segment
+        first = re.split(r"[,;\n]", text, maxsplit=1)[0]
+        match = NAME_SEGMENT_RE.match(first)
+        names = [match.group(1)] if match else []
+    names = [n for n in names if not any(w.lower() in NOT_NAME_WORDS for w in n.split())]
+    return _single(names)
+
+EXTRACTORS = {
+    "Name": extract_name,
+    "Email": extract_email,
+    "Phone number": extract_phone,
+    "Date of birth": extract_dob,
+    "Gender": extract_gender,
+    "ZIP code": extract_zip,
+    "Conditions": extract_conditions,
+}
+
+def extract_fields(text):
+    """Fields found unambiguously in one user message; anything uncertain is left out."""
+    fields = {}
+    for key, extractor in EXTRACTORS.items():
+        value = extractor(text or "")
+        if value:
+            fields[key] = value
+    if fields.get("Gender"):
+        fields["Gender"] = fields["Gender"].title()
+    return fields
+
+def missing_fields(fields):
+    return [key for key in REQUIRED_FIELDS if not fields.get(key)]
+
+def fast_path_fields(session, user_input):
+    """
+    The full intake JSON for this turn when every required field is known
+    from this and earlier messages, so the model call can be skipped.
+    Only applies before the first match; follow-up turns still go to GPT.
+    Once the user negates a condition or mentions one the local extractor
+    does not know, the rest of the intake goes to GPT so none is dropped.
+    """
+    if not FAST_PATH_EXTRACTION or session.get("last_participant") or session.get("river_pending"):
+        return None
+    fast_path_stats["turns"] += 1
+    if conditions_uncertain(user_input):
+        session["conditions_uncertain"] = True
+    if session.get("conditions_uncertain"):
+        fast_path_stats["uncertain"] += 1
+        return None
+    extracted = session.setdefault("extracted_fields", {})
+    extracted.update(extract_fields(user_input))
+    # Fields the model already returned, with unambiguous local values on top
+    fields = collect_fields(session["history"], session.get("known_fields"))
+    fields.update(extracted)
+    if missing_fields(fields):
+        return None
+    fast_path_stats["bypassed"] += 1
+    return {key: fields[key] for key in REQUIRED_FIELDS}
+
+def fast_path_report():
+    stats = dict(fast_path_stats)
+    turns = stats.get("turns", 0)
+    stats["bypass_rate"] = round(stats.get("bypassed", 0) / turns, 4) if turns else 0.0
+    return stats
@@ -0,0 +1,155 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+from geopy.distance import geodesic
+
+EARTH_RADIUS_MILES = 3958.7613
+# Haversine on a sphere and geodesic on the WGS-84 ellipsoid differ by up to
+# ~0.56%, so candidates inside this slack are re-checked when an exact pass is requested.
+HAVERSINE_SLACK = 1.01
+
+def haversine_miles(lat, lng, lat_rad, lng_rad, cos_lat):
+    """Distances from one (lat, lng) in degrees to arrays of points in radians."""
+    phi = math.radians(lat)
+    lam = math.radians(lng)
+    a = np.sin((lat_rad - phi) / 2) ** 2 + math.cos(phi) * cos_lat * np.sin((lng_rad - lam) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def valid_point(lat, lng):
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+class SpatialIndex:
+    """
+    Grid-bucket index over (key, sub, lat, lng) points.
+
+    Coordinates live in contiguous float64 arrays; a radius query gathers the
+    point ids of the cells overlapping the query's bounding box and runs one
+    vectorized haversine pass over them.
+    """
+
+    def __init__(self, points, cell_degrees=1.0):
+        self.cell_degrees = cell_degrees
+        self.columns = int(round(360 / cell_degrees))
+        keys, subs, lats, lngs = [], [], [], []
+        cells = defaultdict(list)
+        for key, sub, lat, lng in points:
+            cells[self._cell(lat, lng)].append(len(keys))
+            keys.append(key)
+            subs.append(sub)
+            lats.append(lat)
+            lngs.append(lng)
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.subs = np.asarray(subs, dtype=np.int64)
+        self.lat = np.asarray(lats, dtype=np.float64)
+        self.lng = np.asarray(lngs, dtype=np.float64)
+        self.lat_rad = np.radians(self.lat)
+        self.lng_rad = np.radians(self.lng)
+        self.cos_lat = np.cos(self.lat_rad)
+        self.cells = {cell: np.asarray(ids, dtype=np.int64) for cell, ids in cells.items()}
+        self.size = len(keys)
+
+    def _wrap(self, column):
+        half = self.columns // 2
+        return (column + half) % self.columns - half
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_degrees), self._wrap(math.floor(lng / self.cell_degrees))
+
+    def candidates(self, lat, lng, radius_miles):
+        # Bounding box of the circle on the haversine sphere
+        angle = radius_miles / EARTH_RADIUS_MILES
+        dlat = math.degrees(angle)
+        if abs(lat) + dlat >= 90:
+            # The circle covers a pole, so it reaches every longitude
+            dlng = 180
+        else:
+            dlng = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat)))))
+        rows = range(math.floor((lat - dlat) / self.cell_degrees), math.floor((lat + dlat) / self.cell_degrees) + 1)
+        columns = {
+            self._wrap(c)
+            for c in range(math.floor((lng - dlng) / self.cell_degrees), math.floor((lng + dlng) / self.cell_degrees) + 1)
+        }
+        found = [self.cells[(row, column)] for row in rows for column in columns if (row, column) in self.cells]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def within(self, coords, radius_miles, exact=False):
+        """Return (point ids, miles) for every point within radius_miles of coords."""
+        point = valid_point(*coords) if coords else None
+        if point is None or not self.size:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        lat, lng = point
+        limit = radius_miles * HAVERSINE_SLACK if exact else radius_miles
+        ids = self.candidates(lat, lng, limit)
+        miles = haversine_miles(lat, lng, self.lat_rad[ids], self.lng_rad[ids], self.cos_lat[ids])
+        keep = miles <= limit
+        ids, miles = ids[keep], miles[keep]
+        if exact and len(ids):
+            miles = np.array([geodesic((lat, lng), (self.lat[i], self.lng[i])).miles for i in ids], dtype=np.float64)
+            keep = miles <= radius_miles
+            ids, miles = ids[keep], miles[keep]
+        return ids, miles
+
+    def nearest_per_key(self, coords, radius_miles, key_count, exact=False):
+        """
+        Per-key minimum distance (inf when nothing is in range) and the sub
+        index of the point that achieved it (-1 when nothing is in range).
+        """
+        best = np.full(key_count, np.inf)
+        nearest = np.full(key_count, -1, dtype=np.int64)
+        ids, miles = self.within(coords, radius_miles, exact)
+        if not len(ids):
+            return best, nearest
+        keys = self.keys[ids]
+        np.minimum.at(best, keys, miles)
+        # First point per key that hits the minimum, in index order
+        hits = np.flatnonzero(miles == best[keys])
+        # Candidates come back grouped by cell, so restore index order for ties
+        hits = hits[np.argsort(ids[hits], kind="stable")]
+        hit_keys, first = np.unique(keys[hits], return_index=True)
+        nearest[hit_keys] = self.subs[ids[hits[first]]]
+        return best, nearest
+
+def site_points(studies):
+    for idx, study in enumerate(studies):
+        for pos, site in enumerate(study.get("site_locations_and_contacts") or []):
+            point = valid_point(site.get("latitude"), site.get("longitude"))
+            if point:
+                yield idx, pos, point[0], point[1]
+
+def center_points(studies):
+    for idx, study in enumerate(studies):
+        study_coords = study.get("coordinates")
+        if study_coords:
+            point = valid_point(study_coords.get("lat"), study_coords.get("lng"))
+            if point:
+                yield idx, -1, point[0], point[1]
+
+class Proximity:
+    """Per-study distances from one participant, aligned with the catalog list."""
+
+    __slots__ = ("site_miles", "nearest_site", "center_miles")
+
+    def __init__(self, site_miles, nearest_site, center_miles):
+        self.site_miles = site_miles
+        self.nearest_site = nearest_site
+        self.center_miles = center_miles
+
+class StudyLocator:
+    """Site and study-center indexes for one list of catalog records, keyed by position."""
+
+    def __init__(self, studies, cell_degrees=1.0):
+        self.study_count = len(studies)
+        self.sites = SpatialIndex(site_points(studies), cell_degrees)
+        self.centers = SpatialIndex(center_points(studies), cell_degrees)
+
+    def measure(self, coords, radius_miles=100, exact=False):
+        site_miles, nearest_site = self.sites.nearest_per_key(coords, radius_miles, self.study_count, exact)
+        center_miles, _ = self.centers.nearest_per_key(coords, radius_miles, self.study_count, exact)
+        return Proximity(site_miles, nearest_site, center_miles)
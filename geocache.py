@@ -0,0 +1,198 @@
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.sqlite3")
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+# Misses (None) expire sooner so a transient provider miss is retried
+GEOCODE_NEGATIVE_TTL = float(os.getenv("GEOCODE_NEGATIVE_TTL", "900"))
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "10000"))
+ZIP_CENTROIDS_PATH = os.getenv("ZIP_CENTROIDS_PATH", "us_zip_centroids.csv")
+
+US_STATES = {
+    "alabama": "AL", "alaska": "AK", "arizona": "AZ", "arkansas": "AR",
+    "california": "CA", "colorado": "CO", "connecticut": "CT", "delaware": "DE",
+    "florida": "FL", "georgia": "GA", "hawaii": "HI", "idaho": "ID",
+    "illinois": "IL", "indiana": "IN", "iowa": "IA", "kansas": "KS",
+    "kentucky": "KY", "louisiana": "LA", "maine": "ME", "maryland": "MD",
+    "massachusetts": "MA", "michigan": "MI", "minnesota": "MN", "mississippi": "MS",
+    "missouri": "MO", "montana": "MT", "nebraska": "NE", "nevada": "NV",
+    "new hampshire": "NH", "new jersey": "NJ", "new mexico": "NM", "new york": "NY",
+    "north carolina": "NC", "north dakota": "ND", "ohio": "OH", "oklahoma": "OK",
+    "oregon": "OR", "pennsylvania": "PA", "rhode island": "RI", "south carolina": "SC",
+    "south dakota": "SD", "tennessee": "TN", "texas": "TX", "utah": "UT",
+    "vermont": "VT", "virginia": "VA", "washington": "WA", "west virginia": "WV",
+    "wisconsin": "WI", "wyoming": "WY", "district of columbia": "DC"
+}
+
+def normalize_zip(zip_code):
+    match = re.match(r"\s*(\d{5})", str(zip_code or ""))
+    return match.group(1) if match else ""
+
+def cache_key(zip_code="", city="", state=""):
+    zip5 = normalize_zip(zip_code)
+    if zip5:
+        return f"zip:{zip5}"
+    city = re.sub(r"\s+", " ", (city or "").strip().lower())
+    state = (state or "").strip().upper()
+    if city and city != "unknown" and state and state != "UNKNOWN":
+        return f"city:{city}|{state}"
+    if state and state != "UNKNOWN":
+        return f"state:{state}"
+    return ""
+
+class ZipCentroids:
+    """
+    Offline ZIP -> {lat, lng, city, state} table.
+
+    Reads a CSV with zip,lat,lng,city,state columns (e.g. built from the
+    Census ZCTA gazetteer). A missing file simply disables the table.
+    """
+
+    def __init__(self, path=ZIP_CENTROIDS_PATH):
+        self.path = path
+        self._table = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        table = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    zip5 = normalize_zip(row.get("zip"))
+                    try:
+                        table[zip5] = {
+                            "lat": float(row["lat"]),
+                            "lng": float(row["lng"]),
+                            "city": (row.get("city") or "").strip(),
+                            "state": (row.get("state") or "").strip().upper(),
+                        }
+                    except (KeyError, TypeError, ValueError):
+                        continue
+            print(f"📮 Loaded {len(table)} ZIP centroids from {self.path}")
+        return table
+
+    def table(self):
+        if self._table is None:
+            with self._lock:
+                if self._table is None:
+                    self._table = self._load()
+        return self._table
+
+    def get(self, zip_code):
+        return self.table().get(normalize_zip(zip_code))
+
+class GeocodeCache:
+    """
+    Two-level geocode cache: an in-memory LRU with TTL in front of an
+    on-disk SQLite store, optionally answered by an offline ZIP table
+    before any provider call. Values are {lat, lng, city, state} dicts;
+    None records a provider miss so it is not retried until negative_ttl
+    has passed.
+    """
+
+    def __init__(self, path=GEOCODE_CACHE_PATH, ttl=GEOCODE_CACHE_TTL, max_entries=GEOCODE_CACHE_SIZE, centroids=None,
+                 negative_ttl=GEOCODE_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.centroids = centroids if centroids is not None else ZipCentroids()
+        self.counters = Counter()
+        self._memory = OrderedDict()
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS geocodes (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)"
+            )
+        return self._db
+
+    def _remember(self, key, value, stored_at):
+        self._memory[key] = (value, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _fresh(self, value, stored_at, now):
+        return now - stored_at < (self.ttl if value is not None else self.negative_ttl)
+
+    def get(self, key):
+        """Return (found, value)."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and self._fresh(entry[0], entry[1], now):
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return True, entry[0]
+            try:
+                row = self._conn().execute(
+                    "SELECT value, stored_at FROM geocodes WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print("⚠️ Geocode cache read failed:", e)
+                row = None
+            value = json.loads(row[0]) if row else None
+            if row and self._fresh(value, row[1], now):
+                self._remember(key, value, row[1])
+                self.counters["disk_hits"] += 1
+                return True, value
+        return False, None
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            try:
+                self._conn().execute(
+                    "INSERT OR REPLACE INTO geocodes (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), now),
+                )
+                self._conn().commit()
+            except sqlite3.Error as e:
+                print("⚠️ Geocode cache write failed:", e)
+
+    def lookup(self, fetch, zip_code="", city="", state=""):
+        """
+        Resolve a location, calling fetch() (the provider) only when the
+        caches and the offline ZIP table cannot answer.
+        """
+        key = cache_key(zip_code, city, state)
+        if not key:
+            return None
+        found, value = self.get(key)
+        if found:
+            return value
+        if key.startswith("zip:"):
+            value = self.centroids.get(zip_code)
+            if value:
+                self.counters["offline_hits"] += 1
+                self.put(key, value)
+                return value
+        self.counters["misses"] += 1
+        self.counters["provider_calls"] += 1
+        try:
+            value = fetch()
+        except Exception as e:
+            self.counters["provider_errors"] += 1
+            print("⚠️ Geocoding provider failed:", key, "→", str(e))
+            return None
+        self.put(key, value)
+        return value
+
+    def stats(self):
+        counters = dict(self.counters)
+        hits = sum(counters.get(k, 0) for k in ("memory_hits", "disk_hits", "offline_hits"))
+        lookups = hits + counters.get("misses", 0)
+        counters["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        counters["memory_entries"] = len(self._memory)
+        return counters
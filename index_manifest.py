@@ -0,0 +1,147 @@
+import json
+import mmap
+import os
+
+from study_store import iter_studies, read_span, write_studies
+
+# Bump whenever extraction changes so cached records are rebuilt
+MANIFEST_VERSION = 6
+
+def manifest_path(output_path):
+    return output_path + ".manifest.json"
+
+def output_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+class IndexManifest:
+    """
+    Per-file record of what the indexer last saw and where its study sits in
+    the output: relative path -> {size, mtime, sha256, span}, span being the
+    (offset, length) of the study in the output file, or None if the file
+    produced no study.
+
+    A rerun only hashes files whose size/mtime changed and only re-parses
+    files whose hash changed; the other studies are read back one at a time
+    from the previous output, so memory does not grow with the catalog.
+    Deleted files drop out of the output.
+    """
+
+    def __init__(self, xml_dir, settings, output_path, files=None):
+        self.xml_dir = xml_dir
+        self.settings = settings
+        self.output_path = output_path
+        self.files = files or {}
+
+    @classmethod
+    def load(cls, path, xml_dir, settings, output_path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls(xml_dir, settings, output_path)
+        if data.get("version") != MANIFEST_VERSION or data.get("settings") != settings:
+            # Different keywords/filters extract different records; start over
+            print("♻️ Index settings changed, rebuilding from scratch")
+            return cls(xml_dir, settings, output_path)
+        if data.get("output") != output_stat(output_path):
+            # The spans point into the output as it was written last time
+            print("♻️ Index output changed since the last run, rebuilding from scratch")
+            return cls(xml_dir, settings, output_path)
+        return cls(xml_dir, settings, output_path, data.get("files"))
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "settings": self.settings,
+                       "output": output_stat(self.output_path), "files": self.files}, f)
+        os.replace(tmp_path, path)
+
+    def key(self, path):
+        return os.path.relpath(path, self.xml_dir)
+
+    def stale(self, paths):
+        """Yield (path, stat, known sha256 or None) for files that are new or whose size/mtime changed."""
+        for path in paths:
+            stat = os.stat(path)
+            entry = self.files.get(self.key(path))
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                continue
+            yield path, stat, entry["sha256"] if entry else None
+
+    def record(self, path, stat, sha256):
+        self.files[self.key(path)] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": sha256,
+            "span": None,
+        }
+
+    def known(self, path):
+        return self.key(path) in self.files
+
+    def touch(self, path, stat):
+        entry = self.files[self.key(path)]
+        entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+
+    def prune(self, paths):
+        present = {self.key(p) for p in paths}
+        removed = [k for k in self.files if k not in present]
+        for k in removed:
+            del self.files[k]
+        return len(removed)
+
+    def write(self, items):
+        """
+        Write (path, study or None) items to the output in order; None means
+        the file is unchanged and its study is copied from the previous output.
+        Returns how many studies were written.
+        """
+        keys, spans = [], []
+        with open(self.output_path, "a+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            previous = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+            try:
+                def studies():
+                    for path, study in items:
+                        key = self.key(path)
+                        if study is None:
+                            span = self.files[key]["span"]
+                            if span is None:
+                                continue
+                            study = read_span(previous, span)
+                        keys.append(key)
+                        yield study
+                # write_studies swaps in a new file; this mmap keeps reading the old one
+                written = write_studies(self.output_path, studies(), spans)
+            finally:
+                if previous is not None:
+                    previous.close()
+        for key, span in zip(keys, spans):
+            self.files[key]["span"] = span
+        return written
+
+def previous_coordinates(path):
+    """nct_id -> (location, coordinates) from a previous geocoded output, if any."""
+    previous = {}
+    try:
+        for study in iter_studies(path):
+            if study.get("coordinates"):
+                previous[study.get("nct_id")] = (study.get("location") or "", study["coordinates"])
+    except (OSError, ValueError):
+        return {}
+    return previous
+
+def reuse_coordinates(study, previous):
+    """
+    Copy coordinates from a previous geocoded output when the study's
+    location text is unchanged, so geocoders only resolve new/changed ones.
+    """
+    old = previous.get(study.get("nct_id"))
+    if old and old[0] == (study.get("location") or ""):
+        study["coordinates"] = old[1]
+        return True
+    return False
@@ -1,24 +1,24 @@
+import argparse
+import hashlib
 import os
-import json
+import time
 import xml.etree.ElementTree as ET
 import re
-import sys
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from functools import partial
+from eligibility_features import extract_eligibility_features
+from index_manifest import IndexManifest, manifest_path
+from study_records import precompute_fields
+from study_store import write_studies
+from study_tagger import automaton, tag_study
 
 INPUT_DIR = "ctg-public-xml"  # Folder where XML files are extracted
-OUTPUT_FILE = "indexed_studies.json"
+OUTPUT_FILE = "indexed_studies.jsonl"
 INCLUDE_ONLY_US = True
 
 US_ALIASES = {"united states", "usa", "us", "u.s.", "u.s.a.", "UN"}
 
-def extract_age_range(text):
-    matches = re.findall(r'(\d{1,2})\s*(?:to|-|–|and)\s*(\d{1,2})\s*(?:years|yrs)?', text, re.I)
-    if matches:
-        try:
-            return int(matches[0][0]), int(matches[0][1])
-        except:
-            return None, None
-    return None, None
-
 def extract_contact_info(xml_root):
     name = email = phone = None
 
@@ -59,6 +59,25 @@ def extract_location(xml_root):
             return city
     return None
 
+def extract_sites(xml_root):
+    sites = []
+    for loc in xml_root.findall("location"):
+        address = loc.find("facility/address")
+        if address is None:
+            continue
+        sites.append({
+            "facility": loc.findtext("facility/name") or "",
+            "city": address.findtext("city") or "",
+            "state": address.findtext("state") or "",
+            "zip": address.findtext("zip") or "",
+            "country": address.findtext("country") or "",
+            "status": loc.findtext("status") or "",
+            "contact_name": loc.findtext("contact/last_name") or loc.findtext("contact_backup/last_name") or "",
+            "contact_email": loc.findtext("contact/email") or loc.findtext("contact_backup/email") or "",
+            "contact_phone": loc.findtext("contact/phone") or loc.findtext("contact_backup/phone") or "",
+        })
+    return sites
+
 def extract_summary(xml_root):
     brief = xml_root.findtext("brief_summary/textblock")
     if not brief:
@@ -68,63 +87,209 @@ def extract_summary(xml_root):
 def matches_keywords(text, keywords):
     return True if not keywords else any(k.lower() in text.lower() for k in keywords)
 
-def index_studies(keywords=None, xml_dir=INPUT_DIR, output_path=OUTPUT_FILE):
-    studies = []
+# Top-level elements the indexer reads; everything else (results, references,
+# browse trees, ...) is cleared as soon as it has been parsed
+INDEXED_ELEMENTS = {
+    "id_info", "brief_title", "overall_status", "brief_summary", "detailed_description",
+    "eligibility", "overall_official", "location", "location_countries",
+}
+COUNTRIES_RE = re.compile(rb"<location_countries>\s*<country>([^<]*)</country>", re.S)
+WHITESPACE_RE = re.compile(r"\s+")
 
-    for root_dir, _, files in os.walk(xml_dir):
-        for file in files:
-            if not file.endswith(".xml"):
-                continue
+def prefilter(raw, keywords):
+    """
+    Cheap byte-level rejection before any XML parsing. Exact for the country
+    check; for keywords it only rejects files that do not contain any keyword
+    anywhere (whitespace-insensitive), which is a superset of the real check.
+    """
+    if INCLUDE_ONLY_US:
+        match = COUNTRIES_RE.search(raw)
+        if not match or match.group(1).decode("utf-8", "ignore").strip().lower() not in US_ALIASES:
+            return False
+    if keywords and not any(ch in k for k in keywords for ch in "&<>'\""):
+        text = WHITESPACE_RE.sub(" ", raw.decode("utf-8", "ignore").lower())
+        if not any(WHITESPACE_RE.sub(" ", k.lower()) in text for k in keywords):
+            return False
+    return True
+
+def parse_study_xml(raw, chunk_size=65536):
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    depth = 0
+
+    def drain():
+        nonlocal root, depth
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 1 and elem.tag not in INDEXED_ELEMENTS:
+                    elem.clear()
+
+    for offset in range(0, len(raw), chunk_size):
+        parser.feed(raw[offset:offset + chunk_size])
+        drain()
+    parser.close()
+    drain()
+    return root
+
+def extract_study(raw, keywords=None):
+    """Return the indexed study dict for one XML document, or None if it is filtered out."""
+    if not prefilter(raw, keywords):
+        return None
 
-            try:
-                tree = ET.parse(os.path.join(root_dir, file))
-                root = tree.getroot()
+    root = parse_study_xml(raw)
 
-                nct_id = root.findtext("id_info/nct_id")
-                title = root.findtext("brief_title") or ""
-                status = root.findtext("overall_status") or ""
-                summary = extract_summary(root)
-                eligibility = root.findtext("eligibility/criteria/textblock") or ""
-                contact_name, contact_email, contact_phone, country = extract_contact_info(root)
-                location = extract_location(root)
-                study_link = f"https://clinicaltrials.gov/study/{nct_id}"
-                full_text = " ".join([title, summary, eligibility])
+    nct_id = root.findtext("id_info/nct_id")
+    title = root.findtext("brief_title") or ""
+    status = root.findtext("overall_status") or ""
+    summary = extract_summary(root)
+    eligibility = root.findtext("eligibility/criteria/textblock") or ""
+    contact_name, contact_email, contact_phone, country = extract_contact_info(root)
+    location = extract_location(root)
+    sites = extract_sites(root)
+    study_link = f"https://clinicaltrials.gov/study/{nct_id}"
+    full_text = " ".join([title, summary, eligibility])
 
-                if not matches_keywords(full_text, keywords):
-                    continue
+    if not matches_keywords(full_text, keywords):
+        return None
 
-                if INCLUDE_ONLY_US and (not country or country.strip().lower() not in US_ALIASES):
-                    continue
+    if INCLUDE_ONLY_US and (not country or country.strip().lower() not in US_ALIASES):
+        return None
 
-                min_age, max_age = extract_age_range(eligibility)
+    features = extract_eligibility_features(
+        eligibility,
+        sex=root.findtext("eligibility/gender"),
+        minimum_age=root.findtext("eligibility/minimum_age"),
+        maximum_age=root.findtext("eligibility/maximum_age"),
+        description=f"{title} {summary}",
+    )
 
-                study = {
-                    "nct_id": nct_id,
-                    "study_title": title,
-                    "recruitment_status": status,
-                    "summary": summary,
-                    "study_link": study_link,
-                    "location": location,
-                    "contact_name": contact_name,
-                    "contact_email": contact_email,
-                    "contact_phone": contact_phone,
-                    "eligibility_text": eligibility,
-                    "min_age_years": min_age,
-                    "max_age_years": max_age
-                }
+    study = {
+        "nct_id": nct_id,
+        "study_title": title,
+        "recruitment_status": status,
+        "summary": summary,
+        "study_link": study_link,
+        "location": location,
+        "site_locations_and_contacts": sites,
+        "contact_name": contact_name,
+        "contact_email": contact_email,
+        "contact_phone": contact_phone,
+        "eligibility_text": eligibility,
+        "min_age_years": features["min_age_years"],
+        "max_age_years": features["max_age_years"],
+        "eligibility_features": features,
+    }
+    tag_study(study)
+    study.update(precompute_fields(study))
+    return study
 
-                studies.append(study)
+def process_file(path, keywords=None):
+    try:
+        with open(path, "rb") as f:
+            return extract_study(f.read(), keywords)
+    except Exception as e:
+        print(f"❌ Failed to process {os.path.basename(path)}: {e}")
+        return None
 
-            except Exception as e:
-                print(f"❌ Failed to process {file}: {e}")
+def refresh_file(path, known_hash=None, keywords=None):
+    """
+    Hash one file and re-extract it only if the content changed.
+    Returns (sha256, study, status) with status unchanged/parsed/failed.
+    """
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest == known_hash:
+            return digest, None, "unchanged"
+        study = extract_study(raw, keywords)
+        if study is not None:
+            # Lets later stages (standing_queries) tell changed records apart without re-hashing them
+            study["source_sha256"] = digest
+        return digest, study, "parsed"
+    except Exception as e:
+        print(f"❌ Failed to process {os.path.basename(path)}: {e}")
+        return None, None, "failed"
+
+def list_xml_files(xml_dir):
+    paths = []
+    for root_dir, _, files in os.walk(xml_dir):
+        paths.extend(os.path.join(root_dir, file) for file in files if file.endswith(".xml"))
+    # Sorted so serial and parallel runs produce the same output order
+    paths.sort()
+    return paths
+
+def iter_refresh(paths, known_hashes, keywords=None, workers=1):
+    if workers <= 1:
+        for path, known_hash in zip(paths, known_hashes):
+            yield refresh_file(path, known_hash, keywords)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() yields in submission order, so the merge is stable
+        yield from executor.map(partial(refresh_file, keywords=keywords), paths, known_hashes, chunksize=256)
+
+def index_studies(keywords=None, xml_dir=INPUT_DIR, output_path=OUTPUT_FILE, workers=1, incremental=True):
+    start = time.perf_counter()
+    paths = list_xml_files(xml_dir)
+    # The output holds tagged studies, so a new rule set must invalidate the manifest
+    settings = {"keywords": sorted(keywords or []), "include_only_us": INCLUDE_ONLY_US, "tag_rules": automaton().version}
+    manifest_file = manifest_path(output_path)
+    if incremental:
+        manifest = IndexManifest.load(manifest_file, xml_dir, settings, output_path)
+    else:
+        manifest = IndexManifest(xml_dir, settings, output_path)
+
+    stale = list(manifest.stale(paths))
+    results = iter_refresh([p for p, _, _ in stale], [h for _, _, h in stale], keywords, workers)
+    counts = Counter()
+
+    def merged():
+        # stale is in path order, so refreshed files merge into one ordered pass
+        refreshed = zip(stale, results)
+        upcoming = next(refreshed, None)
+        for path in paths:
+            if upcoming is None or upcoming[0][0] != path:
+                yield path, None
+                continue
+            (_, stat, _), (digest, study, status) = upcoming
+            upcoming = next(refreshed, None)
+            counts[status] += 1
+            if status == "unchanged":
+                manifest.touch(path, stat)
+                yield path, None
+            elif status == "parsed":
+                manifest.record(path, stat, digest)
+                yield path, study
+            elif manifest.known(path):
+                # Keep last run's study through a read error; the stale size/mtime retries the file next run
+                yield path, None
 
-    with open(output_path, "w") as f:
-        json.dump(studies, f, indent=2)
+    removed = manifest.prune(paths)
+    written = manifest.write(merged())
+    manifest.save(manifest_file)
 
-    print(f"✅ Indexed {len(studies)} studies to {output_path}")
+    elapsed = time.perf_counter() - start
+    rate = len(paths) / elapsed if elapsed else 0
+    print(f"✅ Indexed {written} studies from {len(paths)} files to {output_path} "
+          f"in {elapsed:.1f}s ({rate:.0f} files/s, {workers} worker{'s' if workers != 1 else ''})")
+    print(f"   {len(paths) - len(stale)} untouched, {counts['unchanged']} re-hashed unchanged, "
+          f"{counts['parsed']} parsed, {counts['failed']} failed, {removed} removed")
+    return written
 
 
 if __name__ == "__main__":
-    keywords = sys.argv[1:]
-    print(f"🔍 Filtering for keywords: {keywords or 'None (all US studies)'}")
-    index_studies(keywords=keywords)
+    arg_parser = argparse.ArgumentParser(description="Index ClinicalTrials.gov XML into a study JSON file")
+    arg_parser.add_argument("keywords", nargs="*")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    arg_parser.add_argument("--xml-dir", default=INPUT_DIR)
+    arg_parser.add_argument("--output", default=OUTPUT_FILE)
+    arg_parser.add_argument("--full", action="store_true", help="ignore the manifest and reprocess every file")
+    args = arg_parser.parse_args()
+    print(f"🔍 Filtering for keywords: {args.keywords or 'None (all US studies)'}")
+    index_studies(keywords=args.keywords, xml_dir=args.xml_dir, output_path=args.output,
+                  workers=args.workers, incremental=not args.full)
@@ -1,12 +1,22 @@
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse
+import asyncio
 import openai
 import os
 import json
 import re
-from matcher import match_studies
-from utils import flatten_dict, normalize_gender, format_matches_for_gpt, normalize_participant_data
-from push_to_monday import push_to_monday
+from matcher import rank_studies
+from catalog import StudyCatalog, RELOAD_CHECK_INTERVAL
+from utils import flatten_dict, normalize_gender, format_match_card, normalize_participant_data, geocode_cache, NO_MATCHES_MESSAGE
+from push_to_monday import close_async_client
+from crm_queue import CRMQueue
+from session_store import make_session_store
+from match_cache import MatchCache
+from batch_matching import match_many, match_pool, MATCH_BATCH_WORKERS
+from standing_queries import StandingQueries, append_new_matches
+from chat_history import build_messages, trim_history
+from field_extraction import fast_path_fields, fast_path_report
 from datetime import datetime
 from geopy.geocoders import GoogleV3
 
@@ -23,6 +33,171 @@ app.add_middleware(
 
 geolocator = GoogleV3(api_key=os.getenv("GOOGLE_MAPS_API_KEY"))
 
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Change detection runs in watch_catalog, off the event loop
+catalog = StudyCatalog(auto_refresh=False)
+background_tasks = set()
+crm_queue = CRMQueue()
+sessions = make_session_store()
+match_cache = MatchCache()
+standing_queries = StandingQueries()
+MATCH_PAGE_SIZE = int(os.getenv("MATCH_PAGE_SIZE", "10"))
+
+async def notify_new_matches(snapshot):
+    # Only studies added or changed since the last run are evaluated
+    try:
+        pairs = await asyncio.to_thread(standing_queries.refresh, snapshot)
+        await asyncio.to_thread(append_new_matches, pairs)
+    except Exception as e:
+        print("⚠️ Standing query refresh failed:", e)
+
+async def watch_catalog():
+    while True:
+        await asyncio.sleep(RELOAD_CHECK_INTERVAL)
+        previous = catalog.stats().get("version")
+        try:
+            snapshot = await asyncio.to_thread(catalog.refresh_if_changed)
+        except Exception as e:
+            print("⚠️ Study index refresh failed:", e)
+            continue
+        if snapshot.version != previous:
+            await notify_new_matches(snapshot)
+
+@app.on_event("startup")
+async def load_catalog():
+    try:
+        snapshot = await asyncio.to_thread(catalog.load)
+    except Exception as e:
+        print("⚠️ Study index not loaded at startup, will retry on first request:", e)
+    else:
+        # Re-matching every stored profile can take a while; serve requests meanwhile
+        start_background(notify_new_matches(snapshot))
+    for coro in (watch_catalog(), crm_queue.run_worker()):
+        start_background(coro)
+
+def start_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    match_pool.shutdown()
+    await close_async_client()
+
+def require_admin(request):
+    if not ADMIN_TOKEN or request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.post("/admin/catalog/reload")
+async def reload_catalog(request: Request):
+    require_admin(request)
+    previous = catalog.stats().get("version")
+    snapshot = await asyncio.to_thread(catalog.load)
+    if snapshot.version != previous:
+        await notify_new_matches(snapshot)
+    return catalog.stats()
+
+@app.get("/admin/crm/stats")
+async def crm_stats(request: Request):
+    require_admin(request)
+    return await asyncio.to_thread(crm_queue.stats)
+
+@app.get("/admin/geocode/stats")
+async def geocode_stats(request: Request):
+    require_admin(request)
+    return geocode_cache.stats()
+
+@app.get("/admin/extraction/stats")
+async def extraction_stats(request: Request):
+    require_admin(request)
+    return fast_path_report()
+
+@app.get("/admin/match-cache/stats")
+async def match_cache_stats(request: Request):
+    require_admin(request)
+    return match_cache.stats()
+
+@app.post("/match/batch")
+async def match_batch(request: Request, limit: int = 10, exclude_river: bool = False):
+    """
+    Re-match many stored participants at once. The body is JSONL, one
+    normalized participant per line (coordinates already geocoded); the
+    response is JSONL, one {"index", "id", "total", "matches"} per line.
+    If the catalog file changes under the batch, the response is a 409
+    when nothing was matched yet, otherwise a final {"error", "detail"} row.
+    """
+    require_admin(request)
+    body = (await request.body()).decode("utf-8")
+    try:
+        participants = [json.loads(line) for line in body.splitlines() if line.strip()]
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSONL: {e}")
+    # Fail fast here rather than mid-stream if no catalog is loaded
+    await asyncio.to_thread(catalog.snapshot)
+
+    rows = match_many(participants, catalog, limit=limit, exclude_river=exclude_river, workers=MATCH_BATCH_WORKERS)
+    first = await asyncio.to_thread(next, rows, None)
+    if first is not None and "error" in first:
+        raise HTTPException(status_code=409 if first["error"] == "catalog_changed" else 503, detail=first["detail"])
+
+    def lines():
+        if first is not None:
+            yield json.dumps(first) + "\n"
+        for row in rows:
+            yield json.dumps(row) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/admin/standing-queries/stats")
+async def standing_query_stats(request: Request):
+    require_admin(request)
+    return await asyncio.to_thread(standing_queries.stats)
+
+@app.get("/admin/sessions/stats")
+async def session_stats(request: Request):
+    require_admin(request)
+    return await asyncio.to_thread(sessions.stats)
+
+async def enqueue_crm_push(session_id, participant_data, ranking=None):
+    # Returns immediately; crm_queue.run_worker delivers to Monday.com
+    contact = participant_data.get("email") or participant_data.get("phone") or participant_data.get("name") or ""
+    await asyncio.to_thread(crm_queue.enqueue, participant_data, f"{session_id}:{contact}")
+    await remember_profile(session_id, participant_data, ranking)
+
+async def remember_profile(session_id, participant_data, ranking=None):
+    # Saved leads are re-checked against studies added later (standing_queries);
+    # what they were just shown is recorded so it is not reported again
+    participant_id = participant_data.get("email") or participant_data.get("phone") or session_id
+
+    def save():
+        snapshot = catalog.snapshot()
+        shown = ranking if ranking is not None else match_ranking(participant_data, path="profile")
+        standing_queries.remember(participant_id, participant_data, shown.scores(), snapshot.version)
+
+    try:
+        await asyncio.to_thread(save)
+    except Exception as e:
+        print("⚠️ Could not save matching profile:", e)
+
+def match_ranking(participant, exclude_river=False, path="intake"):
+    snapshot = catalog.snapshot()
+
+    def match(participant, exclude_river):
+        return rank_studies(participant, snapshot.records, exclude_river=exclude_river, index=snapshot.index).finish()
+
+    ranking = match_cache.get_or_match(snapshot, participant, exclude_river, match, path=path)
+    # The "more studies" cursor is only valid against the catalog it paged through
+    ranking.catalog_version = snapshot.version
+    return ranking
+
+async def run_match(participant, exclude_river=False, path="intake"):
+    # Ranking is CPU-bound; keep it off the event loop so other chats keep moving
+    return await asyncio.to_thread(match_ranking, participant, exclude_river, path)
+
 SYSTEM_PROMPT = """You are a clinical trial assistant named Hey Hope.
 Your goal is to assist individuals that suffer from depression, anxiety, PTSD or a combination of these conditions find clinical research trials that could assist them.
 
@@ -74,10 +249,23 @@ Important: Do NOT include any introductory or summary text in your replies. Only
 Always return only a JSON object with participant answers. Do NOT return any lists of study titles or commentary.
 """
 
-chat_histories = {}
-river_pending_confirmation = {}
-last_participant_data = {}
-study_selection_stage = {}
+def new_session():
+    # The system prompt is prepended per call instead of stored in every session
+    return {"history": [], "known_fields": {}, "river_pending": None, "last_participant": None, "selection": None,
+            "match_cursor": None}
+
+def compact_matches(matches):
+    # Sessions keep study ids only; hydrate_matches looks the studies up again
+    return [dict({k: v for k, v in m.items() if k != "study"}, nct_id=m["study"].get("nct_id")) for m in matches]
+
+def hydrate_matches(refs):
+    snapshot = catalog.snapshot()
+    matches = []
+    for ref in refs:
+        study = snapshot.by_nct_id.get(ref.get("nct_id"))
+        if study is not None:
+            matches.append(dict(ref, study=study))
+    return matches
 
 def calculate_age(dob_str):
     if not dob_str.strip():
@@ -90,6 +278,8 @@ def calculate_age(dob_str):
         print("⚠️ Error parsing date of birth:", dob_str, "→", str(e))
         return None
 
+CRISIS_REPLY = "🚨 If you’re in immediate danger, call 911 or contact the 988 Suicide & Crisis Lifeline."
+
 def contains_red_flag(text):
     text = text.lower()
     red_flags = ["kill myself", "end my life", "can’t do this anymore", "suicidal", "want to die"]
@@ -126,41 +316,142 @@ async def chat_handler(request: Request):
     user_input = body.get("message")
 
     if contains_red_flag(user_input):
-        return {"reply": "🚨 If you’re in immediate danger, call 911 or contact the 988 Suicide & Crisis Lifeline."}
+        return {"reply": CRISIS_REPLY}
+
+    session = await load_session(session_id)
+    parts = []
+    try:
+        async for kind, text in chat_events(session_id, session, user_input):
+            if kind != "token":
+                parts.append(text)
+    finally:
+        # Saving on every turn also slides the session's expiry forward
+        await asyncio.to_thread(sessions.save, session_id, session)
+    return {"reply": "\n\n".join(parts)}
+
+def sse_event(kind, data):
+    return f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_handler(request: Request):
+    """
+    Same turn as /chat as Server-Sent Events: "token" events while the
+    model writes, then "message"/"card" events (one per match), then
+    "done" with the full reply /chat would have returned.
+    """
+    body = await request.json()
+    session_id = body.get("session_id", "default")
+    user_input = body.get("message")
+
+    async def events():
+        if contains_red_flag(user_input):
+            yield sse_event("done", {"reply": CRISIS_REPLY})
+            return
+        session = await load_session(session_id)
+        parts = []
+        streamed = False
+        try:
+            async for kind, text in chat_events(session_id, session, user_input, stream=True):
+                if kind == "token":
+                    streamed = True
+                    yield sse_event("token", {"text": text})
+                    continue
+                parts.append(text)
+                if kind == "model_reply":
+                    if streamed:
+                        continue
+                    kind = "message"
+                yield sse_event(kind, {"text": text})
+        finally:
+            await asyncio.to_thread(sessions.save, session_id, session)
+        yield sse_event("done", {"reply": "\n\n".join(parts)})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def load_session(session_id):
+    session = await asyncio.to_thread(sessions.load, session_id)
+    if session is None:
+        print("🆕 New session started:", session_id)
+        session = new_session()
+    return session
+
+def match_page(session, ranking, exclude_river, offset=0):
+    """
+    Yields one page of a ranking, each card as soon as its match is built;
+    the session cursor lets "more studies" continue from it.
+    """
+    total = len(ranking)
+    end = min(offset + MATCH_PAGE_SIZE, total)
+    session["match_cursor"] = {"exclude_river": exclude_river, "offset": max(end, offset),
+                               "version": ranking.catalog_version}
+    if end <= offset:
+        yield ("message", NO_MATCHES_MESSAGE)
+        return
+    selection = session["selection"] = []
+    for position in range(offset, end):
+        match = ranking.page(position, 1)[0]
+        selection.extend(compact_matches([match]))
+        yield ("card", format_match_card(len(selection), match))
+    if end < total:
+        yield ("message", f"Showing {offset + 1}–{end} of {total}. Type **'more studies'** to see more.")
+
+async def chat_events(session_id, session, user_input, stream=False):
+    """
+    Yields (kind, text) for one turn: "token" (streamed model text),
+    "model_reply" (the complete model text), "message" and "card" (one
+    formatted match). The JSON reply is the non-token texts joined.
+    """
+    cursor = session.get("match_cursor")
+    if user_input.strip().lower() == "more studies" and cursor and session["last_participant"]:
+        ranking = await run_match(session["last_participant"], exclude_river=cursor["exclude_river"], path="more_studies")
+        if cursor.get("version") != ranking.catalog_version:
+            # Offsets into the old catalog's ranking would skip or repeat studies
+            yield ("message", "The study list was updated since your last page, so here are your matches from the top:")
+            for event in match_page(session, ranking, cursor["exclude_river"]):
+                yield event
+            return
+        if cursor["offset"] >= len(ranking):
+            yield ("message", "That’s every study I found for you for now. Type **'other options'** to start the list again.")
+            return
+        for event in match_page(session, ranking, cursor["exclude_river"], cursor["offset"]):
+            yield event
+        return
 
     if user_input.strip().lower() in ["other options", "other studies", "more studies"]:
-        if session_id in last_participant_data:
-            with open("indexed_heyhope_filtered_geocoded.json", "r") as f:
-                all_studies = json.load(f)
-            other_matches = match_studies(last_participant_data[session_id], all_studies, exclude_river=True)
-            return {"reply": format_matches_for_gpt(other_matches)}
+        if session["last_participant"]:
+            ranking = await run_match(session["last_participant"], exclude_river=True, path="other_options")
+            for event in match_page(session, ranking, exclude_river=True):
+                yield event
+            return
         else:
-            return {"reply": "I don’t have your previous info handy. Please start again to explore more study options."}
+            yield ("message", "I don’t have your previous info handy. Please start again to explore more study options.")
+            return
 
     # ✅ RIVER: Confirm interest
-    if session_id in river_pending_confirmation:
+    if session["river_pending"] is not None:
         if user_input.strip().lower() in ["yes", "y", "yeah", "sure"]:
-            return {
-                "reply": (
-                    "🌊 Great! To confirm your eligibility for the River Program, please answer the following:\n\n"
-                    "- Have you been diagnosed with bipolar II disorder?\n"
-                    "- Do you have uncontrolled high blood pressure?\n"
-                    "- Have you used ketamine recreationally in the past?"
-                )
-            }
+            yield ("message", (
+                "🌊 Great! To confirm your eligibility for the River Program, please answer the following:\n\n"
+                "- Have you been diagnosed with bipolar II disorder?\n"
+                "- Do you have uncontrolled high blood pressure?\n"
+                "- Have you used ketamine recreationally in the past?"
+            ))
+            return
 
         elif user_input.strip().lower() in ["no", "n", "not interested"]:
-            participant_data = river_pending_confirmation.pop(session_id)
-            push_to_monday(participant_data)
-            last_participant_data[session_id] = participant_data
-            with open("indexed_heyhope_filtered_geocoded.json", "r") as f:
-                all_studies = json.load(f)
-            other_matches = match_studies(participant_data, all_studies, exclude_river=True)
-            return {"reply": format_matches_for_gpt(other_matches)}
+            participant_data = session["river_pending"]
+            session["river_pending"] = None
+            session["last_participant"] = participant_data
+            ranking = await run_match(participant_data, exclude_river=True, path="river_declined")
+            await enqueue_crm_push(session_id, participant_data, ranking)
+            for event in match_page(session, ranking, exclude_river=True):
+                yield event
+            return
 
     # ✅ RIVER: Handle follow-up responses
-    if session_id in river_pending_confirmation:
-        participant_data = river_pending_confirmation[session_id]
+    if session["river_pending"] is not None:
+        participant_data = session["river_pending"]
         input_text = user_input.lower()
 
         # Extract answers
@@ -177,25 +468,27 @@ async def chat_handler(request: Request):
         if all(participant_data.get(field) for field in ["bipolar", "blood_pressure", "ketamine_use"]):
             eligible = is_eligible_for_river(participant_data)
             participant_data["rivers_match"] = eligible
-            push_to_monday(participant_data)
-            last_participant_data[session_id] = participant_data
-            river_pending_confirmation.pop(session_id, None)
+            session["last_participant"] = participant_data
+            session["river_pending"] = None
 
             if eligible:
-                return {"reply": "✅ Great! You’ve been submitted to the River Program. You’ll be contacted shortly.\n\nType **'other options'** to explore more studies."}
+                await enqueue_crm_push(session_id, participant_data)
+                yield ("message", "✅ Great! You’ve been submitted to the River Program. You’ll be contacted shortly.\n\nType **'other options'** to explore more studies.")
+                return
             else:
-                with open("indexed_heyhope_filtered_geocoded.json", "r") as f:
-                    all_studies = json.load(f)
-                other_matches = match_studies(participant_data, all_studies, exclude_river=True)
-                return {
-                    "reply": "⚠️ Based on your answers, you may not qualify for the River Program. Here are other studies that may be a better fit:\n\n" + format_matches_for_gpt(other_matches)
-                }
+                ranking = await run_match(participant_data, exclude_river=True, path="river_ineligible")
+                await enqueue_crm_push(session_id, participant_data, ranking)
+                yield ("message", "⚠️ Based on your answers, you may not qualify for the River Program. Here are other studies that may be a better fit:")
+                for event in match_page(session, ranking, exclude_river=True):
+                    yield event
+                return
 
-        return {"reply": "Thanks! Please answer all 3 follow-up questions so we can confirm your eligibility."}
+        yield ("message", "Thanks! Please answer all 3 follow-up questions so we can confirm your eligibility.")
+        return
 
     # ✅ Handle user selecting studies by number
-    if session_id in study_selection_stage and "matches" in study_selection_stage[session_id]:
-        matches = study_selection_stage[session_id]["matches"]
+    if session["selection"]:
+        matches = hydrate_matches(session["selection"])
         input_text = user_input.strip().lower()
         selected = []
         for i, m in enumerate(matches, 1):
@@ -203,7 +496,8 @@ async def chat_handler(request: Request):
                 selected.append(m)
 
         if not selected:
-            return {"reply": "❓ I didn’t catch which study you meant. Can you tell me the number or name again?"}
+            yield ("message", "❓ I didn’t catch which study you meant. Can you tell me the number or name again?")
+            return
 
         tag_question_map = {
             "require_female": "Are you female?",
@@ -226,81 +520,105 @@ async def chat_handler(request: Request):
                 questions.append(f"📝 For **{title}**:\n- " + "\n- ".join(q_list))
 
         if questions:
-            return {"reply": "\n\n".join(questions)}
-
-    if session_id not in chat_histories:
-        print("🆕 New session started:", session_id)
-        chat_histories[session_id] = [{"role": "system", "content": SYSTEM_PROMPT}]
-        river_pending_confirmation.pop(session_id, None)
-        last_participant_data.pop(session_id, None)
-        study_selection_stage.pop(session_id, None)
-
-    response = openai.ChatCompletion.create(
-        model="gpt-4",
-        messages=chat_histories[session_id],
-        temperature=0.5
-    )
-
-    gpt_message = response.choices[0].message["content"]
-    chat_histories[session_id].append({"role": "assistant", "content": gpt_message})
+            yield ("message", "\n\n".join(questions))
+            return
+
+    session["history"].append({"role": "user", "content": user_input})
+    fields = fast_path_fields(session, user_input)
+    held_back = ""
+    if fields:
+        # Everything the intake needs is already known; answer as the model would
+        gpt_message = json.dumps(fields, indent=2)
+    elif stream:
+        pieces = []
+        response = await openai.ChatCompletion.acreate(
+            model="gpt-4",
+            messages=build_messages(SYSTEM_PROMPT, session),
+            temperature=0.5,
+            stream=True
+        )
+        in_json = False
+        sent = 0
+        async for chunk in response:
+            delta = chunk.choices[0].delta.get("content") or ""
+            pieces.append(delta)
+            if in_json:
+                continue
+            # Once the participant JSON starts, the rest is for the matcher, not the user
+            brace = delta.find("{")
+            if brace >= 0:
+                in_json = True
+                delta = delta[:brace]
+            if delta:
+                sent += len(delta)
+                yield ("token", delta)
+        gpt_message = "".join(pieces)
+        held_back = gpt_message[sent:]
+    else:
+        response = await openai.ChatCompletion.acreate(
+            model="gpt-4",
+            messages=build_messages(SYSTEM_PROMPT, session),
+            temperature=0.5
+        )
+        gpt_message = response.choices[0].message["content"]
+    session["history"].append({"role": "assistant", "content": gpt_message})
+    trim_history(session)
 
     match = re.search(r'{[\s\S]*}', gpt_message)
+    raw_json = None
     if match:
         try:
+            json.loads(match.group())
             raw_json = match.group()
+        except ValueError:
+            # Braces in prose, not the participant JSON; the reply is for the user
+            print("💬 GPT reply has braces but no participant JSON")
+    if raw_json:
+        try:
             print("🔍 Raw JSON extracted:", raw_json)
-            participant_data = json.loads(raw_json)
 
             # === Normalize and enrich participant data ===
-            participant_data = normalize_participant_data(json.loads(raw_json))
+            # Geocoding (GoogleV3 + cache) is blocking, keep it off the event loop
+            participant_data = await asyncio.to_thread(normalize_participant_data, json.loads(raw_json))
             print("📊 Final participant data before match:", participant_data)
 
-            # === Step 1: Load studies ===
-            with open("indexed_heyhope_filtered_geocoded.json", "r") as f:
-                all_studies = json.load(f)
-
-            # === Step 2: Match studies ===
-            matches = match_studies(participant_data, all_studies)
+            # === Step 1+2: Match studies against the loaded catalog ===
+            ranking = await run_match(participant_data)
 
             # === Step 3: Handle River match logic ===
-            river_matches = [
-                m for m in matches
-                if "custom_river_program" in m["study"].get("tags", []) and is_eligible_for_river(participant_data)
-            ]
-
-            if river_matches:
-                river_pending_confirmation[session_id] = {
-                    "participant_data": participant_data,
-                    "matches": matches
-                }
-                study_selection_stage[session_id] = {}  # Ensure fresh
-                return {
-                    "reply": (
-                        "🌊 You've been matched to our **River Program** for affordable at-home ketamine therapy.\n\n"
-                        "Would you like to continue with this one? (Yes or No)"
-                    )
-                }
+            river_matched = any("custom_river_program" in study.get("tags", []) for study in ranking.studies())
+
+            if river_matched and is_eligible_for_river(participant_data):
+                session["river_pending"] = participant_data
+                session["selection"] = None  # Ensure fresh
+                yield ("message", (
+                    "🌊 You've been matched to our **River Program** for affordable at-home ketamine therapy.\n\n"
+                    "Would you like to continue with this one? (Yes or No)"
+                ))
+                return
 
             # === Step 4: If no River or not eligible, show other matches immediately ===
-            if not matches:
-                push_to_monday(participant_data)
-                last_participant_data[session_id] = participant_data
+            if not len(ranking):
+                await enqueue_crm_push(session_id, participant_data, ranking)
+                session["last_participant"] = participant_data
                 print("❌ Could not find JSON in GPT reply:", gpt_message)
-                return {"reply": "😕 No matches found, but your info has been saved for future studies."}
+                yield ("message", "😕 No matches found, but your info has been saved for future studies.")
+                return
 
-            # Store data and show top 10 matches
-            last_participant_data[session_id] = participant_data
-            study_selection_stage[session_id] = {
-                "matches": matches[:10]
-            }
-            push_to_monday(participant_data)
-            return {"reply": format_matches_for_gpt(matches[:10])}
+            # Store data and show the first page of matches
+            session["last_participant"] = participant_data
+            await enqueue_crm_push(session_id, participant_data, ranking)
+            for event in match_page(session, ranking, exclude_river=False):
+                yield event
+            return
 
         except Exception as e:
             print("❌ Exception while processing GPT match JSON:", str(e))
             print("📨 GPT message was:", gpt_message)
-            return {
-                "reply": "We encountered an error processing your info. Please try again or contact support."
-            }
+            yield ("message", "We encountered an error processing your info. Please try again or contact support.")
+            return
 
-    return {"reply": gpt_message}
+    if held_back:
+        # Held back in case it was the participant JSON; it turned out to be reply text
+        yield ("token", held_back)
+    yield ("model_reply", gpt_message)
@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+from collections import Counter, OrderedDict
+
+from matcher import expand_terms
+from utils import normalize_gender
+
+MATCH_CACHE_SIZE = int(os.getenv("MATCH_CACHE_SIZE", "2048"))
+MATCH_CACHE_MAX_BYTES = int(os.getenv("MATCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+def profile_fingerprint(participant):
+    """
+    Everything match_studies reads from a participant, in canonical form.
+    Participants in the same ZIP share geocoded coordinates, so people with
+    the same ZIP, age, gender and conditions share one cache entry.
+    """
+    coords = participant.get("coordinates")
+    if coords:
+        coords = [round(float(c), 6) for c in coords]
+    diagnosis = participant.get("diagnosis_history") or ""
+    # The tags scoring sees and the terms candidate pruning sees; an empty
+    # part ("depression,") adds the "" term, which every study contains
+    conditions = sorted({c.strip().lower() for c in diagnosis.split(",") if c.strip()})
+    return json.dumps([
+        coords,
+        participant.get("age"),
+        normalize_gender(participant.get("gender")),
+        (participant.get("gender") or "").lower(),
+        (participant.get("state") or "").upper(),
+        conditions,
+        sorted(expand_terms(diagnosis)),
+    ], separators=(",", ":"))
+
+def without_river(ranking):
+    return ranking.filtered(lambda study: "custom_river_program" not in study.get("tags", []))
+
+class MatchCache:
+    """
+    LRU of matcher.MatchRanking objects keyed on (catalog version, profile
+    fingerprint, exclude_river), bounded by entry count and by the rankings'
+    total nbytes. Entries for an older catalog are dropped as soon as a
+    lookup sees a new version, so a reload never serves stale matches.
+    """
+
+    def __init__(self, max_entries=MATCH_CACHE_SIZE, max_bytes=MATCH_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.version = None
+        self.counters = Counter()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        ranking = self._entries.get(key)
+        if ranking is not None:
+            self._entries.move_to_end(key)
+        return ranking
+
+    def _put(self, key, ranking):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous.nbytes
+        self._entries[key] = ranking
+        self.bytes += ranking.nbytes
+        while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.counters["evictions"] += 1
+
+    def get_or_match(self, snapshot, participant, exclude_river, match, path="default"):
+        """
+        Cached ranking for this profile, or match(participant, exclude_river)
+        on a miss. Rankings are shared, so match() should return them finished.
+        """
+        fingerprint = profile_fingerprint(participant)
+        key = (fingerprint, exclude_river)
+        with self._lock:
+            if self.version != snapshot.version:
+                if self._entries:
+                    self.counters["invalidations"] += 1
+                self._entries.clear()
+                self.bytes = 0
+                self.version = snapshot.version
+            ranking = self._get(key)
+            if ranking is None and exclude_river:
+                # exclude_river only drops River studies; the ranking is otherwise identical
+                full = self._get((fingerprint, False))
+                if full is not None:
+                    ranking = without_river(full)
+                    self._put(key, ranking)
+            self.counters[f"{path}:{'hits' if ranking is not None else 'misses'}"] += 1
+        if ranking is None:
+            ranking = match(participant, exclude_river)
+            with self._lock:
+                if self.version == snapshot.version:
+                    self._put(key, ranking)
+        return ranking
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            entries = len(self._entries)
+            size = self.bytes
+        paths = {}
+        for name, count in counters.items():
+            if ":" in name:
+                path, outcome = name.split(":", 1)
+                paths.setdefault(path, {"hits": 0, "misses": 0})[outcome] = count
+        for path, counts in paths.items():
+            total = counts["hits"] + counts["misses"]
+            counts["hit_rate"] = round(counts["hits"] / total, 4) if total else 0.0
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "catalog_version": self.version,
+            "evictions": counters.get("evictions", 0),
+            "invalidations": counters.get("invalidations", 0),
+            "paths": paths,
+        }
@@ -1,66 +1,64 @@
-import math
-import re
+import os
+import threading
+import numpy as np
 from geopy.distance import geodesic
 from utils import normalize_gender
-
-from geopy.distance import geodesic
-
-def passes_basic_filters(study, participant_tags, age, gender, coords, participant_state=""):
-    tags = [tag.lower().strip() for tag in study.get("tags", [])]
-
-    if study.get("min_age_years") is not None and age is not None:
-        if age < study["min_age_years"]:
+from study_index import CatalogIndex
+from study_records import (
+    normalize, rank_bucket, BASE_SCORE, MIN_SCORE, MAX_SCORE, RIVER_TAG_BOOST, RANK_BUCKETS,
+)
+
+NEARBY_RADIUS_MILES = 100
+KM_PER_MILE = 1.609344
+# Re-check index candidates with an ellipsoidal geodesic instead of haversine alone
+EXACT_GEODESIC = os.getenv("MATCH_EXACT_GEODESIC", "0") == "1"
+# Filter, score and rank all candidates with ScoringMatrix array operations;
+# "0" falls back to the per-study loop with top-k early exit
+VECTORIZED_SCORING = os.getenv("MATCH_VECTORIZED", "1") == "1"
+
+def passes_basic_filters(record, participant_tags, age, gender, coords, participant_state="", center_near=None):
+    # record is a study_records.StudyRecord
+    if record.min_age is not None and age is not None:
+        if age < record.min_age:
             return False
 
-    if study.get("max_age_years") is not None and age is not None:
-        if age > study["max_age_years"]:
+    if record.max_age is not None and age is not None:
+        if age > record.max_age:
             return False
 
-    if "exclude_female" in tags and gender == "female":
+    if "exclude_female" in record.tags and gender == "female":
+        return False
+
+    if "exclude_male" in record.tags and gender == "male":
         return False
 
-    if "exclude_male" in tags and gender == "male":
+    # Registry sex restriction (eligibility/gender)
+    if record.sex != "all" and gender in ("female", "male") and gender != record.sex:
         return False
 
     # River Program state match
-    title = study.get("study_title", "").lower().strip()
-    if title == "river nonprofit ketamine trial":
+    if record.is_river_trial:
         if participant_state.upper() not in ["CA", "MT"]:
             return False
 
     # State-specific matching
-    allowed_states = [s.upper() for s in study.get("states", []) if isinstance(s, str)]
-    if allowed_states and participant_state.upper() not in allowed_states:
+    if record.states and participant_state.upper() not in record.states:
         return False
 
-    # Location fallback using coordinates
-    study_coords = study.get("coordinates")
-    if isinstance(study_coords, dict) and coords:
-        lat = study_coords.get("lat")
-        lng = study_coords.get("lng")
-        if lat and lng:
+    # Location fallback using the study center; a study with located sites
+    # is near when any site is, which location_candidates already checked
+    if record.has_coordinates and not record.has_sites and coords:
+        if center_near is None:
+            study_coords = record.study["coordinates"]
             try:
-                if geodesic(coords, (lat, lng)).miles > 100:
-                    if "include_telehealth" not in tags:
-                        return False
+                center_near = geodesic(coords, (study_coords["lat"], study_coords["lng"])).miles <= NEARBY_RADIUS_MILES
             except:
                 return False
+        if not center_near and not record.is_telehealth:
+            return False
 
     return True
 
-def haversine_distance(coord1, coord2):
-    # Calculate distance in kilometers between two coordinate tuples
-    lat1, lon1 = coord1
-    lat2, lon2 = coord2
-    R = 6371  # Earth radius in km
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    a = math.sin(delta_phi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(delta_lambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
-
 def is_site_nearby(site, participant_coords, radius_miles=100):
     if not site or not participant_coords:
         return False
@@ -80,9 +78,6 @@ SYNONYMS = {
     "ptsd": ["ptsd", "post traumatic stress disorder", "post-traumatic stress"]
 }
 
-def normalize(text):
-    return re.sub(r"[^\w\s]", "", text.lower()).strip()
-
 def expand_terms(diagnosis_text):
     terms = set()
     for diag in diagnosis_text.split(","):
@@ -95,157 +90,264 @@ def expand_terms(diagnosis_text):
             terms.add(norm)
     return terms
 
-def match_studies(participant, all_studies, exclude_river=False):
-    coords = participant.get("coordinates")
-    age = participant.get("age")
-    gender = normalize_gender(participant.get("gender"))
-    state = participant.get("state", "").upper()
+def synonym_vocabulary():
+    return [term for values in SYNONYMS.values() for term in values]
 
-    conds = participant.get("diagnosis_history", "").split(",")
-    participant_tags = set(normalize_gender(gender).lower().strip() if gender else "")
-    participant_tags.update([c.strip().lower() for c in conds if c.strip()])
-
-    matched = []
-
-    for study in all_studies:
-        title = study.get("study_title", "")
-        tags = [t.lower().strip() for t in study.get("tags", [])]
-
-        if exclude_river and "custom_river_program" in tags:
-            continue
-
-        # Handle sites
-        sites = study.get("site_locations_and_contacts", [])
-        matching_sites = [s for s in sites if is_site_nearby(s, coords)]
-
-        has_near_site = bool(matching_sites)
-        is_telehealth = "include_telehealth" in tags
-
-        if not has_near_site and not is_telehealth:
-            study_coords = study.get("coordinates")
-            if study_coords:
-                try:
-                    loc_tuple = (study_coords.get("lat"), study_coords.get("lng"))
-                    if geodesic(coords, loc_tuple).miles <= 100:
-                        has_near_site = True
-                except Exception:
-                    pass
-
-        if not has_near_site and not is_telehealth:
-            study_states = [s.upper() for s in study.get("states", [])]
-            if state in study_states:
-                has_near_site = True
-
-        if not has_near_site and not is_telehealth:
-            continue
-        
-        if not passes_basic_filters(study, participant_tags, age, gender, coords, state):
-            continue
-
-        score = 5
-        reasons = []
-        matched_includes = []
-        missing_required = []
-        excluded_flags = []
-
-        for tag in tags:
-            base = tag.split("_")[-1]
-            if tag.startswith("include_") and base in participant_tags:
-                score += 1
-                matched_includes.append(base)
+def score_record(record, participant_tags, reasons=None):
+    """Clamped match score for one study; appends the rationale to reasons if given."""
+    score = BASE_SCORE
+    for kind, base in record.tag_rules:
+        if kind == "include" and base in participant_tags:
+            score += 1
+            if reasons is not None:
                 reasons.append(f"✅ Matches include: {base}")
-            elif tag.startswith("exclude_") and base in participant_tags:
-                score -= 2
-                excluded_flags.append(base)
+        elif kind == "exclude" and base in participant_tags:
+            score -= 2
+            if reasons is not None:
                 reasons.append(f"❌ Excluded due to: {base}")
-            elif tag.startswith("require_") and base not in participant_tags:
-                score -= 2
-                missing_required.append(base)
+        elif kind == "require" and base not in participant_tags:
+            score -= 2
+            if reasons is not None:
                 reasons.append(f"⚠️ Missing required: {base}")
- 
 
-        if "custom_river_program" in tags:
-            score += 3
+    if "custom_river_program" in record.tags:
+        score += RIVER_TAG_BOOST
+        if reasons is not None:
             reasons.append("🌊 Prioritized River Program")
+    return max(MIN_SCORE, min(score, MAX_SCORE))
+
+def build_match(record, participant_tags, distance_km, nearest_site):
+    reasons = []
+    score = score_record(record, participant_tags, reasons)
+    # ✅ Location rationale (catalog records are shared, so the distance
+    # lives on the match record rather than on the study)
+    if distance_km is not None and distance_km <= 160:
+        reasons.append(f"📍 Located near you (~{int(distance_km)} km)")
+    return {
+        "study": record.study,
+        "match_score": score,
+        "match_reason": reasons,
+        "distance_km": distance_km,
+        "nearest_site": nearest_site,
+        "is_river": record.is_river,
+    }
+
+def distance_entry(miles, nearest_site):
+    distance_km = None if miles == float("inf") else round(miles * KM_PER_MILE, 1)
+    return distance_km, nearest_site if nearest_site >= 0 else None
+
+class MatchRanking:
+    """
+    One participant's matches in display order: score, then River first,
+    then catalog order.
+
+    Candidates are visited best reachable score first (CatalogIndex.rank_position),
+    so a page is final as soon as no unvisited study could outrank its last
+    row and the rest of the scan is skipped. Match dicts are only built for
+    the rows a page returns; later pages continue the same scan.
+    """
+
+    def __init__(self, records, participant_tags, order=(), best_buckets=None, evaluate=None):
+        self.records = records
+        self.participant_tags = participant_tags
+        self.scanned = 0
+        self._order = order
+        self._best = best_buckets
+        self._evaluate = evaluate
+        self._buckets = [[] for _ in range(RANK_BUCKETS)]
+        self._sealed = 0
+        self._ranked = []
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self):
+        return self._evaluate is None
+
+    @property
+    def nbytes(self):
+        # A ranked row is a 3-tuple of small Python objects, roughly 120 bytes
+        return 120 * len(self._ranked)
+
+    def _advance(self, wanted=None):
+        order, best = self._order, self._best
+        while self._evaluate is not None:
+            reach = best[order[self.scanned]] if self.scanned < len(order) else RANK_BUCKETS
+            # Buckets better than anything still unvisited can no longer change
+            while self._sealed < reach:
+                self._ranked.extend(sorted(self._buckets[self._sealed]))
+                self._buckets[self._sealed] = None
+                self._sealed += 1
+            if self.scanned >= len(order):
+                # Everything is ranked; drop the per-request scan state
+                self._order = self._best = self._evaluate = self._buckets = None
+                break
+            if wanted is not None and len(self._ranked) >= wanted:
+                break
+            idx = order[self.scanned]
+            self.scanned += 1
+            entry = self._evaluate(idx)
+            if entry is not None:
+                bucket, distance_km, nearest_site = entry
+                self._buckets[bucket].append((idx, distance_km, nearest_site))
+
+    def _match(self, entry):
+        idx, distance_km, nearest_site = entry
+        return build_match(self.records[idx], self.participant_tags, distance_km, nearest_site)
+
+    def finish(self):
+        """Scan every candidate now, e.g. before caching, so no per-request scan state is kept."""
+        with self._lock:
+            self._advance()
+        return self
+
+    def page(self, offset=0, limit=None):
+        """Matches [offset, offset + limit) as match dicts; limit=None means all of the rest."""
+        with self._lock:
+            self._advance(None if limit is None else offset + limit)
+            entries = self._ranked[offset:] if limit is None else self._ranked[offset:offset + limit]
+        return [self._match(entry) for entry in entries]
+
+    def __len__(self):
+        with self._lock:
+            self._advance()
+            return len(self._ranked)
+
+    def studies(self):
+        with self._lock:
+            self._advance()
+            return [self.records[idx].study for idx, _, _ in self._ranked]
+
+    def scores(self):
+        """(nct_id, match_score) for every match, without building match dicts."""
+        with self._lock:
+            self._advance()
+            indexes = [idx for idx, _, _ in self._ranked]
+        return [(self.records[idx].study.get("nct_id"), score_record(self.records[idx], self.participant_tags))
+                for idx in indexes]
+
+    def filtered(self, keep):
+        """A complete ranking of only the matched studies for which keep(study) is true."""
+        with self._lock:
+            self._advance()
+            ranking = MatchRanking(self.records, self.participant_tags)
+            ranking._ranked = [e for e in self._ranked if keep(self.records[e[0]].study)]
+        return ranking
+
+class VectorRanking:
+    """
+    A MatchRanking computed in bulk by study_index.CatalogIndex.scoring:
+    every candidate is filtered, scored and ordered with array operations,
+    and only the rows a page returns become match dicts. The ranking stays
+    as NumPy arrays (24 bytes a row), which keeps cached rankings small.
+    """
+
+    def __init__(self, records, participant_tags, order, miles, nearest):
+        self.records = records
+        self.participant_tags = participant_tags
+        self.scanned = len(order)
+        self.complete = True
+        self._order = order
+        self._miles = miles
+        self._nearest = nearest
+
+    @property
+    def nbytes(self):
+        return self._order.nbytes + self._miles.nbytes + self._nearest.nbytes
+
+    def finish(self):
+        return self
+
+    def _rows(self, start=0, end=None):
+        return zip(self._order[start:end].tolist(), self._miles[start:end].tolist(), self._nearest[start:end].tolist())
+
+    def page(self, offset=0, limit=None):
+        end = None if limit is None else offset + limit
+        return [
+            build_match(self.records[idx], self.participant_tags, *distance_entry(miles, nearest))
+            for idx, miles, nearest in self._rows(offset, end)
+        ]
+
+    def __len__(self):
+        return len(self._order)
+
+    def studies(self):
+        return [self.records[idx].study for idx in self._order.tolist()]
+
+    def scores(self):
+        return [(self.records[idx].study.get("nct_id"), score_record(self.records[idx], self.participant_tags))
+                for idx in self._order.tolist()]
+
+    def filtered(self, keep):
+        ranking = MatchRanking(self.records, self.participant_tags)
+        ranking._ranked = [
+            (idx, *distance_entry(miles, nearest))
+            for idx, miles, nearest in self._rows()
+            if keep(self.records[idx].study)
+        ]
+        return ranking
+
+def rank_studies(participant, records, exclude_river=False, index=None, proximity=None):
+    # records are study_records.StudyRecord objects (CatalogSnapshot.records);
+    # index is the study_index.CatalogIndex built over the same list.
+    # proximity may be passed in when several participants share coordinates.
+    coords = participant.get("coordinates")
+    age = participant.get("age")
+    gender = normalize_gender(participant.get("gender"))
+    state = participant.get("state", "").upper()
 
-        match_record = {
-            "study": study,
-            "match_score": max(1, min(score, 10)),
-            "match_reason": reasons,
-        }
-        
-        # 🚫 Gender-based exclusion logic
-        participant_gender = (participant.get("gender") or "").lower()
-        eligibility_text = (study.get("eligibility_text") or "").lower()
-        if participant_gender == "male":
-            if any(term in eligibility_text for term in [
-                "pregnant women", "pregnancy", "currently pregnant", "women aged",
-                "female only", "females only", "breastfeeding women", "mothers"
-            ]):
-                if "river" not in title:
-                    continue  # skip non-River studies not relevant for males
-
-        # 🚫 Skip irrelevant studies that do not mention required condition terms
-        summary_text = (study.get("summary") or "") + " " + (study.get("study_title") or "")
-        summary_text = normalize(summary_text)
-        if not any(term in summary_text for term in expanded_terms):
-            if "river" not in title:
-                continue
-
-        score = 0
-        reasons = []
-
-        # ✅ Age-based matching (null-safe)
-        age_min = study.get("min_age_years")
-        age_max = study.get("max_age_years")
-        if age is not None and (age_min is not None or age_max is not None):
-            if (age_min is not None and age < age_min) or (age_max is not None and age > age_max):
-                if "river" not in title:
-                    continue  # disqualify non-River matches
-            else:
-                score += 1
-                reasons.append("Matches your age range")
-
-        # ✅ Diagnosis match (already confirmed above, reward it)
-        if any(term in summary_text for term in expanded_terms):
-            score += 2
-            reasons.append("Relevant condition match")
-
-        # ✅ Location matching
-        loc_score = "Unknown"
-        if location and study.get("coordinates"):
-            dist = haversine_distance(location, study["coordinates"])
-            study["distance_km"] = round(dist, 1)
-            if dist <= 160:
-                loc_score = "Near You"
-                score += 2
-                reasons.append(f"Located near you (~{int(dist)} km)")
-            else:
-                loc_score = "Other"
-        else:
-            loc_score = "Other"
-
-        # 📞 Contact info
-        contact_parts = []
-        for key in ["contact_name", "contact_email", "contact_phone"]:
-            val = study.get(key)
-            if val:
-                contact_parts.append(val)
-        contact_info = " | ".join(contact_parts) if contact_parts else "Not provided"
-
-        matches.append({
-            "study_title": study.get("study_title"),
-            "summary": study.get("summary", ""),
-            "conditions": summary_text,
-            "locations": study.get("location", "Not specified"),
-            "contacts": contact_info,
-            "link": study.get("study_link", ""),
-            "distance_km": study.get("distance_km", None),
-            "match_confidence": score,
-            "match_rationale": "; ".join(reasons),
-            "location_tag": loc_score,
-            "eligibility": study.get("eligibility_text", ""),
-        })
-
-    # Sort by score and River priority
-    return sorted(matched, key=lambda m: (-m["match_score"], "river" not in m["study"]["study_title"].lower()))
+    diagnosis = participant.get("diagnosis_history") or ""
+    participant_tags = {gender} if gender else set()
+    participant_tags.update([c.strip().lower() for c in diagnosis.split(",") if c.strip()])
+    expanded_terms = expand_terms(diagnosis)
+
+    if index is None:
+        index = CatalogIndex(records, synonym_vocabulary())
+    # One vectorized pass per participant; per-study nearest site / center miles
+    if proximity is None:
+        proximity = index.locator.measure(coords, NEARBY_RADIUS_MILES, exact=EXACT_GEODESIC)
+
+    # Candidate pruning: near (or telehealth / same state) AND mentions a
+    # requested condition (River is exempt from the condition check) AND
+    # the participant's age falls inside the study's inclusive age range
+    candidates = index.location_candidates(proximity, state, NEARBY_RADIUS_MILES)
+    candidates &= index.condition_candidates(expanded_terms)
+    candidates &= index.age_candidates(age)
+
+    # 🚫 Gender-based exclusion logic
+    participant_gender = (participant.get("gender") or "").lower()
+
+    if VECTORIZED_SCORING:
+        scoring = index.scoring
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        center_near = proximity.center_miles <= NEARBY_RADIUS_MILES
+        ids = ids[scoring.passes(ids, age, gender, coords, state, center_near, exclude_river, participant_gender)]
+        order = scoring.rank(ids, participant_tags)
+        miles = np.minimum(proximity.site_miles[order], proximity.center_miles[order])
+        return VectorRanking(records, participant_tags, order, miles, proximity.nearest_site[order])
+
+    site_miles = proximity.site_miles.tolist()
+    nearest_site = proximity.nearest_site.tolist()
+    center_miles = proximity.center_miles.tolist()
+
+    def evaluate(idx):
+        record = records[idx]
+        if exclude_river and "custom_river_program" in record.tags:
+            return None
+
+        center_near = center_miles[idx] <= NEARBY_RADIUS_MILES
+        if not passes_basic_filters(record, participant_tags, age, gender, coords, state, center_near=center_near):
+            return None
+
+        if participant_gender == "male" and record.female_focused and not record.is_river:
+            return None  # skip non-River studies not relevant for males
+
+        score = score_record(record, participant_tags)
+        return (rank_bucket(score, record.is_river),
+                *distance_entry(min(site_miles[idx], center_miles[idx]), nearest_site[idx]))
+
+    order = sorted(candidates, key=index.rank_position.__getitem__)
+    return MatchRanking(records, participant_tags, order, index.best_buckets, evaluate)
+
+def match_studies(participant, records, exclude_river=False, index=None, limit=None):
+    """Ranked match dicts (score, then River first); only the top `limit` if given."""
+    return rank_studies(participant, records, exclude_river, index).page(0, limit)
@@ -1,18 +1,22 @@
 import os
+import httpx
 import requests
 import json
 
 MONDAY_API_KEY = os.getenv("MONDAY_API_KEY")
+MONDAY_API_URL = os.getenv("MONDAY_API_URL", "https://api.monday.com/v2")
 BOARD_ID = 2003358867  # Hey Hope board
 GROUP_ID = "topics"
 
-def push_to_monday(participant_data):
-    url = "https://api.monday.com/v2"
-    headers = {
-        "Authorization": MONDAY_API_KEY,
+_async_client = None
+
+def monday_headers():
+    return {
+        "Authorization": MONDAY_API_KEY or "",
         "Content-Type": "application/json"
     }
 
+def build_column_values(participant_data):
     phone_value = participant_data.get("phone", "")
     if not phone_value.startswith("+"):
         phone_value = "+" + phone_value.lstrip("+")
@@ -57,28 +61,64 @@ def push_to_monday(participant_data):
     if participant_data.get("rivers_match", False):
         column_values["text_mkrxbqdc"] = "Yes"
 
+    return column_values
+
+def escape_column_values(column_values):
     # Escape properly
-    column_values_str = json.dumps(column_values).replace('\\', '\\\\').replace('"', '\\"')
+    return json.dumps(column_values).replace('\\', '\\\\').replace('"', '\\"')
 
-    query = f'''
-    mutation {{
-      create_item (
+def create_item_mutation(participant_data, alias=""):
+    prefix = f"{alias}: " if alias else ""
+    item_name = json.dumps(participant_data.get("name") or "Hey Hope Lead")
+    return f'''
+      {prefix}create_item (
         board_id: {BOARD_ID},
         group_id: "{GROUP_ID}",
-        item_name: "{participant_data.get("name", "Hey Hope Lead")}",
-        column_values: "{column_values_str}"
+        item_name: {item_name},
+        column_values: "{escape_column_values(build_column_values(participant_data))}"
       ) {{
         id
-      }}
-    }}
-    '''
+      }}'''
 
-    response = requests.post(url, headers=headers, json={"query": query})
-    data = response.json()
+def update_item_mutation(item_id, participant_data, alias=""):
+    prefix = f"{alias}: " if alias else ""
+    return f'''
+      {prefix}change_multiple_column_values (
+        board_id: {BOARD_ID},
+        item_id: {int(item_id)},
+        column_values: "{escape_column_values(build_column_values(participant_data))}"
+      ) {{
+        id
+      }}'''
 
+def build_mutation(fields):
+    return "\n    mutation {" + "".join(fields) + "\n    }\n    "
+
+def build_monday_query(participant_data):
+    return build_mutation([create_item_mutation(participant_data)])
+
+def log_monday_response(data):
     if "errors" in data:
         print("❌ Error pushing to Monday.com:", json.dumps(data, indent=2))
     else:
         print("✅ Successfully pushed to Monday.com:", json.dumps(data, indent=2))
 
+def push_to_monday(participant_data):
+    query = build_monday_query(participant_data)
+    response = requests.post(MONDAY_API_URL, headers=monday_headers(), json={"query": query})
+    data = response.json()
+    log_monday_response(data)
     return data
+
+def get_async_client():
+    # One pooled client per process, created inside the running event loop
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(timeout=httpx.Timeout(15.0))
+    return _async_client
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,114 @@
+import numpy as np
+
+from study_records import BASE_SCORE, MIN_SCORE, MAX_SCORE, RIVER_TAG_BOOST
+
+RIVER_STATES = ("CA", "MT")
+
+class ScoringMatrix:
+    """
+    The catalog's tag rules and hard filters as per-study arrays.
+
+    include/exclude/require hold, per study, how often each tag base appears
+    with that kind (one column per base), so scoring a participant against
+    every study is three matrix-vector products. The filters of
+    matcher.passes_basic_filters are boolean columns combined in bulk.
+
+    The arrays are dense: there is one column per distinct tag base, a
+    dozen or so, so 100k studies take about 15 MB.
+    """
+
+    def __init__(self, records):
+        self.size = len(records)
+        bases = sorted({base for record in records for _, base in record.tag_rules})
+        self.columns = {base: col for col, base in enumerate(bases)}
+        shape = (self.size, max(len(bases), 1))
+        self.include = np.zeros(shape, np.float32)
+        self.exclude = np.zeros(shape, np.float32)
+        self.require = np.zeros(shape, np.float32)
+        kinds = {"include": self.include, "exclude": self.exclude, "require": self.require}
+        for idx, record in enumerate(records):
+            for kind, base in record.tag_rules:
+                kinds[kind][idx, self.columns[base]] += 1
+        self.require_total = self.require.sum(axis=1)
+
+        def column(values, dtype=bool):
+            return np.fromiter(values, dtype=dtype, count=self.size)
+
+        self.river_tag = column("custom_river_program" in r.tags for r in records)
+        self.is_river = column(r.is_river for r in records)
+        self.is_river_trial = column(r.is_river_trial for r in records)
+        self.telehealth = column(r.is_telehealth for r in records)
+        # Only studies without located sites are held to their center coordinates
+        self.center_only = column(r.has_coordinates and not r.has_sites for r in records)
+        self.has_states = column(bool(r.states) for r in records)
+        self.exclude_female = column("exclude_female" in r.tags for r in records)
+        self.exclude_male = column("exclude_male" in r.tags for r in records)
+        self.female_only = column(r.sex == "female" for r in records)
+        self.male_only = column(r.sex == "male" for r in records)
+        self.female_focused = column(r.female_focused for r in records)
+        self.min_age = column((_age(r.min_age) for r in records), np.float64)
+        self.max_age = column((_age(r.max_age) for r in records), np.float64)
+        self.state_masks = {}
+        for idx, record in enumerate(records):
+            for state in record.states:
+                mask = self.state_masks.get(state)
+                if mask is None:
+                    mask = self.state_masks[state] = np.zeros(self.size, bool)
+                mask[idx] = True
+
+    def participant_vector(self, participant_tags):
+        vector = np.zeros(self.include.shape[1], np.float32)
+        for tag in participant_tags:
+            col = self.columns.get(tag)
+            if col is not None:
+                vector[col] = 1
+        return vector
+
+    def scores(self, participant_tags):
+        """Clamped match score of every study, as match_studies computes them one by one."""
+        vector = self.participant_vector(participant_tags)
+        raw = (
+            BASE_SCORE
+            + self.include @ vector
+            - 2 * (self.exclude @ vector)
+            - 2 * (self.require_total - self.require @ vector)
+            + RIVER_TAG_BOOST * self.river_tag
+        )
+        return np.clip(raw, MIN_SCORE, MAX_SCORE).astype(np.int64)
+
+    def passes(self, ids, age, gender, coords, state, center_near, exclude_river, participant_gender):
+        """Which of the candidate ids survive every hard filter."""
+        keep = np.ones(len(ids), bool)
+        if age is not None:
+            # NaN (no bound) compares False, so open-ended studies stay
+            keep &= ~(self.min_age[ids] > age)
+            keep &= ~(self.max_age[ids] < age)
+        if gender == "female":
+            keep &= ~self.exclude_female[ids] & ~self.male_only[ids]
+        elif gender == "male":
+            keep &= ~self.exclude_male[ids] & ~self.female_only[ids]
+        if state not in RIVER_STATES:
+            keep &= ~self.is_river_trial[ids]
+        state_mask = self.state_masks.get(state)
+        in_state = state_mask[ids] if state_mask is not None else False
+        keep &= ~self.has_states[ids] | in_state
+        if coords:
+            keep &= ~self.center_only[ids] | center_near[ids] | self.telehealth[ids]
+        if exclude_river:
+            keep &= ~self.river_tag[ids]
+        if participant_gender == "male":
+            keep &= ~(self.female_focused[ids] & ~self.is_river[ids])
+        return keep
+
+    def rank(self, ids, participant_tags):
+        """ids in display order: score, then River first, then catalog order."""
+        scores = self.scores(participant_tags)[ids]
+        # study_records.rank_bucket, for every id at once
+        buckets = 2 * (MAX_SCORE - scores) + ~self.is_river[ids]
+        return ids[np.lexsort((ids, buckets))]
+
+def _age(value):
+    try:
+        return np.nan if value is None else float(value)
+    except (TypeError, ValueError):
+        return np.nan
@@ -0,0 +1,271 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from urllib.parse import urlparse
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.sqlite3")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+class MemoryBackend:
+    """In-process LRU bounded by entry count and total serialized bytes."""
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES, max_bytes=SESSION_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        blob, _ = self._entries.pop(key)
+        self.bytes -= len(blob)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, blob, ttl):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (blob, time.time() + ttl)
+            self.bytes += len(blob)
+            while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.bytes, "evictions": self.evictions}
+
+class SQLiteBackend:
+    """
+    Sessions in a WAL-mode SQLite file, shared by every worker process on
+    one host. Expired rows and the least recently used rows beyond
+    max_entries are pruned every prune_every writes.
+    """
+
+    def __init__(self, path=SESSION_SQLITE_PATH, max_entries=SESSION_MAX_ENTRIES, prune_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self.evictions = 0
+        self._writes = 0
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._db.executescript("""
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS sessions (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed_at);
+            """)
+        return self._db
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT value FROM sessions WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, blob, ttl):
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, blob, now + ttl, now),
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                pruned = db.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+                pruned += db.execute(
+                    """DELETE FROM sessions WHERE key IN (
+                           SELECT key FROM sessions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)""",
+                    (self.max_entries,),
+                ).rowcount
+                self.evictions += pruned
+            db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn().execute("DELETE FROM sessions WHERE key = ?", (key,))
+            self._conn().commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM sessions"
+            ).fetchone()
+        return {"entries": entries, "bytes": size, "evictions": self.evictions}
+
+class RedisBackend:
+    """
+    Minimal RESP client (GET / SET EX / DEL / DBSIZE) for Redis or anything
+    speaking its protocol. Expiry is SET EX; LRU eviction is the server's
+    maxmemory-policy, so any worker on any node sees the same sessions.
+    """
+
+    def __init__(self, url=SESSION_REDIS_URL, timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.password = parsed.password
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._sock.makefile("rb")
+        try:
+            if self.password:
+                self._call("AUTH", self.password)
+            if self.db:
+                self._call("SELECT", str(self.db))
+        except Exception:
+            # Never reuse a connection that is not authenticated or on the wrong db
+            self._sock.close()
+            self._sock = None
+            raise
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            return [self._read_reply() for _ in range(int(rest))]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _call(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode("utf-8") if isinstance(arg, str) else arg
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def command(self, *args):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except (OSError, ConnectionError):
+                    # Stale connection (server restart, idle timeout); reconnect once
+                    self._sock = None
+                    if attempt:
+                        raise
+
+    def get(self, key):
+        return self.command("GET", key)
+
+    def set(self, key, blob, ttl):
+        self.command("SET", key, blob, "EX", str(max(1, int(ttl))))
+
+    def delete(self, key):
+        self.command("DEL", key)
+
+    def stats(self):
+        return {"entries": self.command("DBSIZE")}
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "sqlite": SQLiteBackend,
+    "redis": RedisBackend,
+}
+
+class SessionStore:
+    """
+    Per-session conversation state as JSON blobs with a sliding TTL: every
+    save pushes the expiry out again. Backends only store strings, so
+    sessions survive restarts (sqlite, redis) and can be served by any
+    worker (redis) without sticky sessions.
+    """
+
+    def __init__(self, backend=None, ttl=SESSION_TTL, prefix="session:"):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.prefix = prefix
+        self.counters = Counter()
+
+    def load(self, session_id):
+        try:
+            blob = self.backend.get(self.prefix + session_id)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print("⚠️ Session store read failed:", e)
+            return None
+        self.counters["hits" if blob is not None else "misses"] += 1
+        return json.loads(blob) if blob is not None else None
+
+    def save(self, session_id, session):
+        blob = json.dumps(session, separators=(",", ":"), default=str)
+        try:
+            self.backend.set(self.prefix + session_id, blob, self.ttl)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print("⚠️ Session store write failed:", e)
+            return
+        self.counters["saves"] += 1
+        self.counters["bytes_written"] += len(blob)
+
+    def delete(self, session_id):
+        self.backend.delete(self.prefix + session_id)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["backend"] = type(self.backend).__name__
+        stats["ttl_s"] = self.ttl
+        try:
+            stats.update(self.backend.stats())
+        except Exception as e:
+            stats["backend_error"] = str(e)
+        return stats
+
+def make_session_store(backend=SESSION_BACKEND):
+    return SessionStore(BACKENDS[backend]())
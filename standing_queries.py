@@ -0,0 +1,359 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+from batch_matching import coordinate_key
+from geo_index import SpatialIndex, valid_point, HAVERSINE_SLACK
+from match_cache import profile_fingerprint
+from matcher import rank_studies, expand_terms, synonym_vocabulary, NEARBY_RADIUS_MILES, EXACT_GEODESIC
+from study_index import CatalogIndex
+
+STANDING_QUERIES_PATH = os.getenv("STANDING_QUERIES_PATH", "standing_queries.sqlite3")
+NEW_MATCHES_PATH = os.getenv("NEW_MATCHES_PATH", "new_matches.jsonl")
+
+# Everything rank_studies reads from a participant
+PROFILE_FIELDS = ("coordinates", "age", "gender", "state", "diagnosis_history")
+
+def matching_profile(participant):
+    return {field: participant[field] for field in PROFILE_FIELDS if field in participant}
+
+def study_digest(study):
+    """
+    Changes when anything matching reads from the study changes. The
+    indexer's per-file XML hash stands for the extracted record; tags and
+    coordinates are written after indexing (tagger, geocoders), so they
+    are folded in. Records without a source hash are hashed whole.
+    """
+    source = study.get("source_sha256")
+    if source is None:
+        return hashlib.sha256(json.dumps(study, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    sites = [(site.get("latitude"), site.get("longitude")) for site in study.get("site_locations_and_contacts") or []]
+    later = hashlib.sha256(repr((study.get("tag_hash"), study.get("tags"), study.get("coordinates"), sites)).encode())
+    return f"{source[:16]}:{later.hexdigest()[:8]}"
+
+def _profile_age(value):
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+class ProfileStore:
+    """
+    Persisted matching profiles of screened participants, the (participant,
+    study) pairs they already know about, and the per-study digests of the
+    last catalog the standing queries were run against. One WAL-mode SQLite
+    file, shared by every worker process on one host.
+    """
+
+    def __init__(self, path=STANDING_QUERIES_PATH):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._db.executescript("""
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS profiles (
+                    participant_id TEXT PRIMARY KEY,
+                    profile TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS known_matches (
+                    participant_id TEXT NOT NULL,
+                    nct_id TEXT NOT NULL,
+                    match_score INTEGER,
+                    catalog_version TEXT,
+                    PRIMARY KEY (participant_id, nct_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS known_matches_study ON known_matches (nct_id);
+                CREATE TABLE IF NOT EXISTS catalog_studies (
+                    nct_id TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+        return self._db
+
+    def save_profile(self, participant_id, participant, matches=(), catalog_version=None):
+        """
+        Store (or replace) one participant's profile. matches are the
+        (nct_id, match_score) pairs they were just shown, so only studies
+        they have not seen are reported later.
+        """
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO profiles (participant_id, profile, updated_at) VALUES (?, ?, ?)",
+                (participant_id, json.dumps(matching_profile(participant)), time.time()),
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO known_matches (participant_id, nct_id, match_score, catalog_version) VALUES (?, ?, ?, ?)",
+                [(participant_id, nct_id, score, catalog_version) for nct_id, score in matches],
+            )
+            db.commit()
+
+    def profiles(self):
+        with self._lock:
+            rows = self._conn().execute("SELECT participant_id, profile FROM profiles").fetchall()
+        return [(participant_id, json.loads(profile)) for participant_id, profile in rows]
+
+    def study_digests(self):
+        with self._lock:
+            return dict(self._conn().execute("SELECT nct_id, digest FROM catalog_studies"))
+
+    def known_pairs(self, nct_ids):
+        found = set()
+        nct_ids = list(nct_ids)
+        with self._lock:
+            db = self._conn()
+            for start in range(0, len(nct_ids), 500):
+                batch = nct_ids[start:start + 500]
+                found.update(db.execute(
+                    f"SELECT participant_id, nct_id FROM known_matches WHERE nct_id IN ({','.join('?' * len(batch))})",
+                    batch,
+                ))
+        return found
+
+    def catalog_state(self):
+        """(version, mtime) of the last catalog a refresh was recorded for."""
+        with self._lock:
+            rows = dict(self._conn().execute(
+                "SELECT key, value FROM meta WHERE key IN ('catalog_version', 'catalog_mtime')"))
+        mtime = rows.get("catalog_mtime")
+        return rows.get("catalog_version"), float(mtime) if mtime is not None else None
+
+    def record_refresh(self, expected_version, version, mtime, digests, removed, new_pairs, stale_pairs):
+        """
+        Apply one catalog refresh in a single transaction, only if the last
+        recorded catalog is still expected_version. Every worker process
+        refreshes on its own, so the first one to commit wins and the rest
+        return False and discard their (identical) delta.
+        """
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()
+                if (row[0] if row else None) != expected_version:
+                    db.rollback()
+                    return False
+                db.executemany("INSERT OR REPLACE INTO catalog_studies (nct_id, digest) VALUES (?, ?)", digests.items())
+                db.executemany("DELETE FROM catalog_studies WHERE nct_id = ?", [(n,) for n in removed])
+                db.executemany("DELETE FROM known_matches WHERE nct_id = ?", [(n,) for n in removed])
+                db.executemany("DELETE FROM known_matches WHERE participant_id = ? AND nct_id = ?", stale_pairs)
+                db.executemany(
+                    "INSERT OR REPLACE INTO known_matches (participant_id, nct_id, match_score, catalog_version) VALUES (?, ?, ?, ?)",
+                    [(p["participant_id"], p["nct_id"], p["match_score"], version) for p in new_pairs],
+                )
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('catalog_version', ?)", (version,))
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('catalog_mtime', ?)", (str(mtime),))
+            except BaseException:
+                db.rollback()
+                raise
+            db.commit()
+        return True
+
+    def stats(self):
+        with self._lock:
+            db = self._conn()
+            profiles = db.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+            pairs = db.execute("SELECT COUNT(*) FROM known_matches").fetchone()[0]
+            studies = db.execute("SELECT COUNT(*) FROM catalog_studies").fetchone()[0]
+            version = db.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()
+        return {"profiles": profiles, "known_matches": pairs, "catalog_studies": studies,
+                "catalog_version": version[0] if version else None}
+
+class ProfileIndex:
+    """
+    study_index.CatalogIndex turned around: location, condition and age
+    indexes over stored profiles, so one study finds the profiles it could
+    match. Profiles with the same fingerprint are one group, and groups are
+    numbered in coordinate order. Lookups return a superset; rank_studies
+    makes the final call.
+    """
+
+    def __init__(self, profiles):
+        groups = {}
+        for participant_id, profile in profiles:
+            groups.setdefault(profile_fingerprint(profile), (profile, []))[1].append(participant_id)
+        self.groups = sorted(groups.values(), key=lambda g: coordinate_key(g[0].get("coordinates")) or ())
+        self.all_ids = frozenset(range(len(self.groups)))
+        self.by_state = defaultdict(set)
+        self.by_term = defaultdict(set)
+        points, ages, self.any_age = [], [], set()
+        for gid, (profile, _) in enumerate(self.groups):
+            self.by_state[(profile.get("state") or "").upper()].add(gid)
+            for term in expand_terms(profile.get("diagnosis_history") or ""):
+                self.by_term[term].add(gid)
+            point = valid_point(*profile["coordinates"]) if profile.get("coordinates") else None
+            if point:
+                points.append((gid, 0, point[0], point[1]))
+            age = _profile_age(profile.get("age"))
+            if age is None:
+                self.any_age.add(gid)
+            else:
+                ages.append((age, gid))
+        ages.sort()
+        self.age_values = [age for age, _ in ages]
+        self.age_ids = [gid for _, gid in ages]
+        self.points = SpatialIndex(points)
+
+    def location_candidates(self, record):
+        if record.is_telehealth:
+            return set(self.all_ids)
+        ids = set()
+        for state in record.states:
+            ids |= self.by_state.get(state, set())
+        study_points = [(s.get("latitude"), s.get("longitude")) for s in record.study.get("site_locations_and_contacts") or []]
+        if record.has_coordinates:
+            study_points.append((record.study["coordinates"].get("lat"), record.study["coordinates"].get("lng")))
+        for lat, lng in study_points:
+            # Haversine slack keeps boundary profiles; rank_studies re-checks the distance
+            near, _ = self.points.within((lat, lng), NEARBY_RADIUS_MILES * HAVERSINE_SLACK)
+            ids.update(self.points.keys[near].tolist())
+        return ids
+
+    def condition_candidates(self, record):
+        if record.is_river:
+            return set(self.all_ids)
+        ids = set()
+        for term, gids in self.by_term.items():
+            if term in record.summary_norm:
+                ids |= gids
+        return ids
+
+    def age_candidates(self, record):
+        lo, hi = _profile_age(record.min_age), _profile_age(record.max_age)
+        start = 0 if lo is None else bisect_left(self.age_values, lo)
+        end = len(self.age_values) if hi is None else bisect_right(self.age_values, hi)
+        return self.any_age.union(self.age_ids[start:end])
+
+    def candidates(self, record):
+        ids = self.location_candidates(record)
+        if ids:
+            ids &= self.condition_candidates(record)
+        if ids:
+            ids &= self.age_candidates(record)
+        return ids
+
+class StandingQueries:
+    """
+    "New matches since the last catalog" for every stored profile.
+
+    refresh(snapshot) diffs the catalog against the digests recorded last
+    time, looks up which profiles each added or changed study could match
+    through ProfileIndex, and runs rank_studies for just those profiles
+    over just the changed studies. Unchanged studies only have their
+    digest compared. Returns the (participant, study) pairs nobody has seen
+    yet; a catalog some other worker already recorded returns [].
+    """
+
+    def __init__(self, store=None):
+        self.store = store or ProfileStore()
+        self.counters = Counter()
+        self.last_refresh = None
+
+    def remember(self, participant_id, participant, matches=(), catalog_version=None):
+        self.store.save_profile(participant_id, participant, matches, catalog_version)
+
+    def refresh(self, snapshot, exclude_river=False):
+        start = time.perf_counter()
+        recorded_version, recorded_mtime = self.store.catalog_state()
+        if recorded_version == snapshot.version or (recorded_mtime is not None and snapshot.mtime < recorded_mtime):
+            # Already done (or superseded) by another worker
+            return []
+        previous = self.store.study_digests()
+        digests = {}
+        changed = []
+        for idx, study in enumerate(snapshot.studies):
+            nct_id = study.get("nct_id")
+            if not nct_id:
+                continue
+            digest = digests[nct_id] = study_digest(study)
+            if previous.get(nct_id) != digest:
+                changed.append(idx)
+        removed = [nct_id for nct_id in previous if nct_id not in digests]
+
+        new_pairs, stale_pairs, evaluated = [], [], 0
+        if changed:
+            records = [snapshot.records[idx] for idx in changed]
+            index = CatalogIndex(records, synonym_vocabulary())
+            profiles = ProfileIndex(self.store.profiles())
+            groups = set()
+            for record in records:
+                groups |= profiles.candidates(record)
+            matched = {}
+            place = proximity = None
+            for gid in sorted(groups):
+                profile, participant_ids = profiles.groups[gid]
+                # Groups are in coordinate order, so neighbours in a ZIP share one proximity pass
+                coords = coordinate_key(profile.get("coordinates"))
+                if proximity is None or coords != place:
+                    place = coords
+                    proximity = index.locator.measure(coords, NEARBY_RADIUS_MILES, exact=EXACT_GEODESIC)
+                ranking = rank_studies(profile, records, exclude_river, index, proximity=proximity)
+                for match in ranking.page():
+                    for participant_id in participant_ids:
+                        matched[participant_id, match["study"]["nct_id"]] = match
+            evaluated = len(groups)
+            changed_ids = {snapshot.studies[idx]["nct_id"] for idx in changed}
+            known = self.store.known_pairs(changed_ids)
+            stale_pairs = sorted(known - matched.keys())
+            new_pairs = [
+                {
+                    "participant_id": participant_id,
+                    "nct_id": nct_id,
+                    "study_title": match["study"].get("study_title"),
+                    "match_score": match["match_score"],
+                    "catalog_version": snapshot.version,
+                }
+                for (participant_id, nct_id), match in sorted(matched.items())
+                if (participant_id, nct_id) not in known
+            ]
+
+        recorded = self.store.record_refresh(
+            recorded_version, snapshot.version, snapshot.mtime,
+            {snapshot.studies[idx]["nct_id"]: digests[snapshot.studies[idx]["nct_id"]] for idx in changed},
+            removed, new_pairs, stale_pairs,
+        )
+        if not recorded:
+            print(f"🔔 Standing queries for catalog {snapshot.version} were recorded by another worker")
+            return []
+        elapsed = time.perf_counter() - start
+        self.counters["refreshes"] += 1
+        self.counters["new_pairs"] += len(new_pairs)
+        self.last_refresh = {
+            "catalog_version": snapshot.version,
+            "changed_studies": len(changed),
+            "removed_studies": len(removed),
+            "profiles_evaluated": evaluated,
+            "new_pairs": len(new_pairs),
+            "stale_pairs": len(stale_pairs),
+            "seconds": round(elapsed, 3),
+        }
+        print(f"🔔 Standing queries for catalog {snapshot.version}: {len(changed)} changed studies, "
+              f"{evaluated} profiles evaluated, {len(new_pairs)} new matches in {elapsed:.2f}s")
+        return new_pairs
+
+    def stats(self):
+        return dict(self.store.stats(), refreshes=self.counters["refreshes"],
+                    new_pairs=self.counters["new_pairs"], last_refresh=self.last_refresh)
+
+def append_new_matches(pairs, path=NEW_MATCHES_PATH):
+    """Append a refresh's delta as JSONL for whatever sends the notifications."""
+    if not pairs:
+        return 0
+    with open(path, "a", encoding="utf-8") as f:
+        for pair in pairs:
+            f.write(json.dumps(pair) + "\n")
+    return len(pairs)
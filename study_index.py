@@ -0,0 +1,172 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+import numpy as np
+
+from geo_index import StudyLocator
+from scoring_matrix import ScoringMatrix
+
+MAX_CACHED_TERMS = 4096
+
+class ConditionIndex:
+    """
+    Inverted index from condition term to the ids of studies whose
+    normalized summary+title contains it.
+
+    Postings keep the matcher's substring semantics: known vocabulary
+    (synonyms and multi-word phrases) is indexed at load time, anything
+    else is scanned once and memoized.
+    """
+
+    def __init__(self, records, vocabulary=()):
+        self.texts = [r.summary_norm for r in records]
+        self.all_ids = frozenset(range(len(records)))
+        self.postings = {}
+        for term in vocabulary:
+            self.postings[term] = self._scan(term)
+        self.vocabulary_size = len(self.postings)
+
+    def _scan(self, term):
+        return frozenset(idx for idx, text in enumerate(self.texts) if term in text)
+
+    def ids_for(self, term):
+        if not term:
+            return self.all_ids
+        ids = self.postings.get(term)
+        if ids is None:
+            if len(self.postings) >= self.vocabulary_size + MAX_CACHED_TERMS:
+                # Drop the oldest memoized (non-vocabulary) term
+                oldest = next(t for i, t in enumerate(self.postings) if i >= self.vocabulary_size)
+                del self.postings[oldest]
+            ids = self.postings[term] = self._scan(term)
+        return ids
+
+    def lookup(self, terms):
+        ids = set()
+        for term in terms:
+            ids |= self.ids_for(term)
+        return ids
+
+class _IntervalNode:
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+def _build_interval_tree(intervals):
+    if not intervals:
+        return None
+    endpoints = sorted(v for lo, hi, _ in intervals for v in (lo, hi))
+    node = _IntervalNode()
+    node.center = endpoints[len(endpoints) // 2]
+    here = [iv for iv in intervals if iv[0] <= node.center <= iv[1]]
+    node.by_start = sorted(here, key=lambda iv: iv[0])
+    node.by_end = sorted(here, key=lambda iv: -iv[1])
+    node.left = _build_interval_tree([iv for iv in intervals if iv[1] < node.center])
+    node.right = _build_interval_tree([iv for iv in intervals if iv[0] > node.center])
+    return node
+
+def _age_bound(value):
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+class AgeIndex:
+    """
+    Inclusive [min_age_years, max_age_years] lookup.
+
+    Studies are split by which bounds they have: open-ended ones always
+    match, one-sided ones are a bisect over sorted endpoints, and two-sided
+    ones are answered by a centered interval tree, so a lookup costs
+    O(log n + k). Nothing is memoized: a result holds nearly every study
+    id, so keeping one per distinct age costs more than recomputing it.
+    """
+
+    def __init__(self, records):
+        self.all_ids = frozenset(range(len(records)))
+        self.open_ids = set()
+        min_only, max_only, both = [], [], []
+        for idx, record in enumerate(records):
+            lo, hi = _age_bound(record.min_age), _age_bound(record.max_age)
+            if lo is None and hi is None:
+                self.open_ids.add(idx)
+            elif hi is None:
+                min_only.append((lo, idx))
+            elif lo is None:
+                max_only.append((hi, idx))
+            elif lo <= hi:
+                both.append((lo, hi, idx))
+            # min > max can never match, so it is left out of every bucket
+        min_only.sort()
+        max_only.sort()
+        self.min_values = [v for v, _ in min_only]
+        self.min_ids = [idx for _, idx in min_only]
+        self.max_values = [v for v, _ in max_only]
+        self.max_ids = [idx for _, idx in max_only]
+        self.tree = _build_interval_tree(both)
+
+    def _stab(self, age, out):
+        node = self.tree
+        while node is not None:
+            if age < node.center:
+                for lo, _, idx in node.by_start:
+                    if lo > age:
+                        break
+                    out.add(idx)
+                node = node.left
+            elif age > node.center:
+                for _, hi, idx in node.by_end:
+                    if hi < age:
+                        break
+                    out.add(idx)
+                node = node.right
+            else:
+                out.update(idx for _, _, idx in node.by_start)
+                break
+
+    def eligible(self, age):
+        if age is None:
+            return self.all_ids
+        found = set(self.open_ids)
+        found.update(self.min_ids[:bisect_right(self.min_values, age)])
+        found.update(self.max_ids[bisect_left(self.max_values, age):])
+        self._stab(age, found)
+        return found
+
+class CatalogIndex:
+    """Candidate-set indexes over one list of StudyRecords, keyed by position."""
+
+    def __init__(self, records, vocabulary=()):
+        self.size = len(records)
+        self.locator = StudyLocator([r.study for r in records])
+        self.conditions = ConditionIndex(records, vocabulary)
+        self.ages = AgeIndex(records)
+        self.by_state = defaultdict(set)
+        self.telehealth = set()
+        self.river = set()
+        # Visiting candidates in this order (best reachable score first) lets
+        # top-k ranking stop once nothing unvisited can outrank the page
+        order = sorted(range(len(records)), key=lambda idx: (records[idx].best_bucket, idx))
+        self.rank_position = [0] * len(records)
+        for position, idx in enumerate(order):
+            self.rank_position[idx] = position
+        self.best_buckets = [record.best_bucket for record in records]
+        self.scoring = ScoringMatrix(records)
+        for idx, record in enumerate(records):
+            for state in record.states:
+                self.by_state[state].add(idx)
+            if record.is_telehealth:
+                self.telehealth.add(idx)
+            if record.is_river:
+                self.river.add(idx)
+
+    def location_candidates(self, proximity, state, radius_miles):
+        near = (proximity.site_miles <= radius_miles) | (proximity.center_miles <= radius_miles)
+        ids = set(np.flatnonzero(near).tolist())
+        ids |= self.telehealth
+        ids |= self.by_state.get(state, set())
+        return ids
+
+    def age_candidates(self, age):
+        return self.ages.eligible(age)
+
+    def condition_candidates(self, terms):
+        return self.conditions.lookup(terms) | self.river
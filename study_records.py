@@ -0,0 +1,100 @@
+import re
+import sys
+
+from eligibility_features import study_features
+from geo_index import valid_point
+
+RIVER_TITLE = "river nonprofit ketamine trial"
+TAG_KINDS = ("include", "exclude", "require")
+
+# match_studies scores: base, per-tag adjustments and River boost, clamped to MIN..MAX
+BASE_SCORE = 5
+MIN_SCORE, MAX_SCORE = 1, 10
+RIVER_TAG_BOOST = 3
+# Display order is score, then River first: one bucket per (score, River) pair
+RANK_BUCKETS = 2 * (MAX_SCORE - MIN_SCORE + 1)
+
+# Identical tag/state sets are shared between records instead of duplicated
+_shared_sets = {}
+
+def normalize(text):
+    return re.sub(r"[^\w\s]", "", text.lower()).strip()
+
+def shared_set(values):
+    key = frozenset(sys.intern(v) for v in values)
+    return _shared_sets.setdefault(key, key)
+
+def normalize_tags(tags):
+    return [t.lower().strip() for t in tags or [] if isinstance(t, str)]
+
+def normalize_states(states):
+    return [s.upper().strip() for s in states or [] if isinstance(s, str)]
+
+def summary_text(study):
+    return normalize((study.get("summary") or "") + " " + (study.get("study_title") or ""))
+
+def precompute_fields(study):
+    """Matching fields the indexer writes next to each study so the server never derives them per request."""
+    return {
+        "tags": normalize_tags(study.get("tags")),
+        "states": normalize_states(study.get("states")),
+        "summary_norm": summary_text(study),
+        "is_river": "river" in (study.get("study_title") or "").lower(),
+    }
+
+def tag_rules(tags):
+    rules = []
+    for tag in tags:
+        kind = tag.split("_", 1)[0]
+        if kind in TAG_KINDS:
+            rules.append((kind, sys.intern(tag.split("_")[-1])))
+    return tuple(rules)
+
+def rank_bucket(score, is_river):
+    """Position of a (score, River) pair in display order; lower ranks first."""
+    return 2 * (MAX_SCORE - score) + (0 if is_river else 1)
+
+def best_rank_bucket(tags, rules, is_river):
+    # Every include tag matched, nothing excluded or missing
+    includes = sum(1 for kind, _ in rules if kind == "include")
+    boost = RIVER_TAG_BOOST if "custom_river_program" in tags else 0
+    return rank_bucket(max(MIN_SCORE, min(BASE_SCORE + includes + boost, MAX_SCORE)), is_river)
+
+class StudyRecord:
+    """
+    Compact, pre-normalized matching view of one study.
+
+    `study` is the original dict (used for display); everything the matcher
+    reads per request is precomputed here.
+    """
+
+    __slots__ = (
+        "study", "tags", "tag_rules", "states", "summary_norm", "is_river",
+        "is_river_trial", "is_telehealth", "has_coordinates", "has_sites", "min_age", "max_age", "best_bucket",
+        "sex", "female_focused",
+    )
+
+    def __init__(self, study):
+        title = (study.get("study_title") or "").lower().strip()
+        summary_norm = study.pop("summary_norm", None)
+        if summary_norm is None:
+            summary_norm = summary_text(study)
+        tags = normalize_tags(study.get("tags"))
+        self.study = study
+        self.tags = shared_set(tags)
+        self.tag_rules = tag_rules(tags)
+        self.states = shared_set(normalize_states(study.get("states")))
+        self.summary_norm = summary_norm
+        self.is_river = bool(study.pop("is_river", "river" in title))
+        self.is_river_trial = title == RIVER_TITLE
+        self.is_telehealth = "include_telehealth" in self.tags
+        self.has_coordinates = bool(study.get("coordinates"))
+        self.has_sites = any(valid_point(site.get("latitude"), site.get("longitude"))
+                             for site in study.get("site_locations_and_contacts") or [])
+        self.min_age = study.get("min_age_years")
+        self.max_age = study.get("max_age_years")
+        self.best_bucket = best_rank_bucket(self.tags, self.tag_rules, self.is_river)
+        # Parsed from the eligibility criteria once, so requests never scan the text
+        features = study_features(study)
+        self.sex = features["sex"]
+        self.female_focused = features["female_focused"]
@@ -0,0 +1,85 @@
+import json
+import mmap
+import os
+import sys
+
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+
+def is_jsonl(path):
+    return path.lower().endswith(JSONL_SUFFIXES)
+
+def iter_studies(path):
+    """
+    Yield study dicts one at a time.
+
+    .jsonl files hold one compact study per line and are read through mmap,
+    so only the current line is ever materialized. Anything else is treated
+    as the legacy JSON array and loaded whole.
+    """
+    if not is_jsonl(path):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+        return
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for line in iter(m.readline, b""):
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+def write_studies(path, studies, spans=None):
+    """
+    Stream studies (any iterable) to path and return how many were written.
+
+    .jsonl paths get one study per line; other paths get the same indented
+    array json.dump(studies, f, indent=2) used to produce. The file is
+    swapped in atomically so readers never see a partial index. If spans
+    is a list, the (byte offset, length) of each study is appended to it.
+    """
+    tmp_path = path + ".tmp"
+    count = 0
+    # json.dumps escapes non-ASCII, so string lengths are byte lengths
+    offset = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        if is_jsonl(path):
+            for study in studies:
+                text = json.dumps(study, separators=(",", ":"))
+                f.write(text)
+                f.write("\n")
+                if spans is not None:
+                    spans.append((offset, len(text)))
+                offset += len(text) + 1
+                count += 1
+        else:
+            f.write("[")
+            offset = 1
+            for study in studies:
+                separator = ",\n  " if count else "\n  "
+                f.write(separator)
+                # JSON strings never contain raw newlines, so this only re-indents structure
+                text = json.dumps(study, indent=2).replace("\n", "\n  ")
+                f.write(text)
+                if spans is not None:
+                    spans.append((offset + len(separator), len(text)))
+                offset += len(separator) + len(text)
+                count += 1
+            f.write("\n]" if count else "]")
+    os.replace(tmp_path, path)
+    return count
+
+def read_span(m, span):
+    """The study stored at a (byte offset, length) span of an mmap'd index written by write_studies."""
+    offset, length = span
+    return json.loads(m[offset:offset + length])
+
+def convert(source, destination):
+    return write_studies(destination, iter_studies(source))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python study_store.py <source.jsonl|.json> <destination.jsonl|.json>")
+        sys.exit(1)
+    count = convert(sys.argv[1], sys.argv[2])
+    print(f"✅ Wrote {count} studies to {sys.argv[2]}")
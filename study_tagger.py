@@ -0,0 +1,186 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from eligibility_features import split_criteria, study_features
+from study_store import iter_studies, write_studies
+
+INPUT_FILE = "indexed_heyhope_filtered_geocoded.json"
+
+# Sections a rule can look at; "text" is all of them
+SECTIONS = ("title", "summary", "inclusion", "exclusion")
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# (tag, sections, phrases). Phrases match whole words, case- and
+# punctuation-insensitive ("post-traumatic" == "post traumatic"); a rule
+# fires when any phrase appears in any of its sections.
+TEXT_RULES = [
+    ("include_depression", "text", ["depression", "depressive", "depressed", "mdd", "trd"]),
+    ("include_anxiety", "text", ["anxiety", "gad", "panic disorder", "social phobia"]),
+    ("include_ptsd", "text", ["ptsd", "posttraumatic stress", "post traumatic stress"]),
+    ("include_insomnia", "text", ["insomnia", "sleep disturbance", "sleep disturbances"]),
+    ("include_alcohol", "text", ["alcohol use disorder", "alcohol use disorders", "alcohol dependence", "heavy drinking"]),
+    ("include_substance use", "text", ["substance use", "opioid use disorder", "cannabis use"]),
+    ("include_seniors", "text", ["older adults", "late life", "geriatric", "elderly"]),
+    ("custom_river_program", ("title",), ["river nonprofit ketamine trial"]),
+]
+
+# (tag, feature): tags read from eligibility_features.extract_eligibility_features,
+# so the indexer and the tagger share one definition of each concept
+FEATURE_RULES = [
+    ("exclude_pregnant", "excludes_pregnancy"),
+    ("exclude_bipolar", "excludes_bipolar"),
+    ("require_veteran", "requires_veteran"),
+    ("include_telehealth", "telehealth"),
+]
+
+def words(text):
+    return WORD_RE.findall((text or "").lower())
+
+def feature_tags(features):
+    """Tags that come straight from the structured eligibility fields."""
+    tags = [tag for tag, feature in FEATURE_RULES if features.get(feature)]
+    if features.get("sex") == "female":
+        tags.append("require_female")
+    elif features.get("sex") == "male":
+        tags.append("require_male")
+    if (features.get("min_age_years") or 0) >= 55:
+        tags.append("include_seniors")
+    return tags
+
+class TagAutomaton:
+    """
+    Every phrase of every rule compiled into one word-level trie, keyed on
+    a phrase's first word. Each section is tokenized once and scanned in a
+    single pass, so the cost grows with the text, not the number of rules.
+    """
+
+    def __init__(self, rules=TEXT_RULES):
+        self.first_words = {}
+        for tag, sections, phrases in rules:
+            allowed = frozenset(SECTIONS if sections == "text" else sections)
+            for phrase in phrases:
+                first, *rest = words(phrase)
+                self.first_words.setdefault(first, []).append((tuple(rest), tag, allowed))
+        self.version = hashlib.sha256(json.dumps([rules, FEATURE_RULES]).encode()).hexdigest()[:12]
+
+    def tags(self, sections):
+        found = set()
+        first_words = self.first_words
+        for section, text in sections.items():
+            tokens = words(text)
+            for i, token in enumerate(tokens):
+                for rest, tag, allowed in first_words.get(token, ()):
+                    if section in allowed and tag not in found and tuple(tokens[i + 1:i + 1 + len(rest)]) == rest:
+                        found.add(tag)
+        return found
+
+_automaton = None
+
+def automaton():
+    # Compiled once per process (each pool worker builds its own)
+    global _automaton
+    if _automaton is None:
+        _automaton = TagAutomaton()
+    return _automaton
+
+def study_sections(study):
+    inclusion, exclusion = split_criteria(study.get("eligibility_text"))
+    return {
+        "title": study.get("study_title") or "",
+        "summary": study.get("summary") or "",
+        "inclusion": inclusion,
+        "exclusion": exclusion,
+    }
+
+def text_hash(study):
+    """Changes when the text a rule could look at, or the rule set itself, changes."""
+    h = hashlib.sha256(automaton().version.encode())
+    for key in ("study_title", "summary", "eligibility_text"):
+        h.update(b"\0" + (study.get(key) or "").encode("utf-8"))
+    h.update(json.dumps(study.get("eligibility_features"), sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+def generate_tags(study):
+    found = automaton().tags(study_sections(study))
+    found.update(feature_tags(study_features(study)))
+    return sorted(found)
+
+def tag_study(study, force=False):
+    """
+    Recompute the generated tags of one study in place, keeping any tags
+    curated by hand. Returns False when its text is unchanged since the
+    last run and nothing was done.
+    """
+    digest = text_hash(study)
+    if not force and study.get("tag_hash") == digest:
+        return False
+    previous = set(study.get("generated_tags") or [])
+    manual = [t for t in study.get("tags") or [] if t not in previous]
+    generated = generate_tags(study)
+    study["generated_tags"] = generated
+    study["tags"] = manual + [t for t in generated if t not in manual]
+    study["tag_hash"] = digest
+    return True
+
+def _tag_chunk(studies, force=False):
+    return [(study, tag_study(study, force)) for study in studies]
+
+def _chunks(studies, size):
+    chunk = []
+    for study in studies:
+        chunk.append(study)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_tagged(studies, workers=1, force=False, chunk_size=500, counts=None):
+    """Yield studies with fresh tags, in input order, tagging chunks across worker processes."""
+    counts = counts if counts is not None else Counter()
+    if workers <= 1:
+        results = (_tag_chunk(chunk, force) for chunk in _chunks(studies, chunk_size))
+        for chunk in results:
+            for study, changed in chunk:
+                counts["tagged" if changed else "unchanged"] += 1
+                yield study
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for chunk in _chunks(studies, chunk_size):
+            futures.append(executor.submit(_tag_chunk, chunk, force))
+            # Keep a bounded number of chunks in flight so memory stays flat
+            if len(futures) >= workers * 4:
+                for study, changed in futures.pop(0).result():
+                    counts["tagged" if changed else "unchanged"] += 1
+                    yield study
+        for future in futures:
+            for study, changed in future.result():
+                counts["tagged" if changed else "unchanged"] += 1
+                yield study
+
+def tag_file(input_path, output_path=None, workers=1, force=False):
+    output_path = output_path or input_path
+    start = time.perf_counter()
+    counts = Counter()
+    written = write_studies(output_path, iter_tagged(iter_studies(input_path), workers, force, counts=counts))
+    elapsed = time.perf_counter() - start
+    rate = written / elapsed if elapsed else 0
+    print(f"🏷️ Tagged {written} studies into {output_path} in {elapsed:.1f}s ({rate:.0f} studies/s, "
+          f"{workers} worker{'s' if workers != 1 else ''}): {counts['tagged']} re-tagged, {counts['unchanged']} unchanged")
+    return counts
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generate include_/exclude_/require_ tags for a study file")
+    arg_parser.add_argument("--input", default=INPUT_FILE)
+    arg_parser.add_argument("--output", help="defaults to rewriting --input")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    arg_parser.add_argument("--full", action="store_true", help="re-tag every study, even if its text is unchanged")
+    args = arg_parser.parse_args()
+    tag_file(args.input, args.output, workers=args.workers, force=args.full)
@@ -0,0 +1,66 @@
+import os
+import sys
+
+# utils builds its GoogleV3 client at import time; tests never call it
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# One synthetic catalog for every test module: `from conftest import make_study, ...`
+CITIES = [("CA", 37.77, -122.42), ("CA", 34.05, -118.24), ("NY", 40.71, -74.01), ("TX", 29.76, -95.37), ("MT", 46.87, -113.99)]
+CONDITIONS = ["depression", "anxiety", "ptsd", "major depressive disorder", "insomnia"]
+TAGS = [
+    "include_depression", "include_anxiety", "include_ptsd", "include_telehealth", "include_female",
+    "exclude_bipolar", "exclude_pregnant", "exclude_female", "exclude_male", "require_female",
+    "require_male", "require_veteran", "require_depression", "custom_river_program",
+]
+
+def make_study(i, rng):
+    """A raw catalog study as the indexer writes it; pass it through normalize_study to match on it directly."""
+    state, lat, lng = rng.choice(CITIES)
+    condition = rng.choice(CONDITIONS)
+    title = "River Nonprofit Ketamine Trial" if rng.random() < 0.03 else f"A {condition} study {i}"
+    low = rng.choice([None, 18, 21, 40])
+    sites = []
+    for _ in range(rng.randint(0, 3)):
+        s_state, s_lat, s_lng = rng.choice(CITIES)
+        sites.append({"state": s_state, "latitude": s_lat + rng.uniform(-1, 1), "longitude": s_lng + rng.uniform(-1, 1)})
+    return {
+        "nct_id": f"NCT{i:08d}",
+        "study_title": title,
+        "summary": f"Treatment for {condition}." + (" For pregnant women." if rng.random() < 0.1 else ""),
+        "eligibility_text": "Mothers only." if rng.random() < 0.05 else "",
+        "sex": rng.choice(["All", "All", "Female", "Male"]),
+        "coordinates": [lat + rng.uniform(-2, 2), lng + rng.uniform(-2, 2)] if rng.random() < 0.8 else None,
+        "states": [state] if rng.random() < 0.2 else [],
+        "tags": rng.sample(TAGS, rng.randint(0, 4)),
+        "min_age_years": low,
+        "max_age_years": rng.choice([None, 30, 65]) if low else rng.choice([None, 65]),
+        "site_locations_and_contacts": sites,
+    }
+
+def make_participant(rng):
+    state, lat, lng = rng.choice(CITIES)
+    return {
+        "coordinates": [round(lat + rng.uniform(-1, 1), 3), round(lng + rng.uniform(-1, 1), 3)] if rng.random() < 0.9 else None,
+        "state": state if rng.random() < 0.9 else "",
+        "age": rng.choice([None, 17, 18, 25, 30, 40, 65, 70]),
+        "gender": rng.choice(["female", "male", "Female", "non-binary", None]),
+        "diagnosis_history": ", ".join(rng.sample(CONDITIONS + ["bipolar", ""], rng.randint(0, 3))),
+    }
+
+class Clock:
+    """Stands in for a module's `time` (and asyncio.sleep): every clock reads `now`, sleeping advances it."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
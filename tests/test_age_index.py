@@ -0,0 +1,82 @@
+import random
+from types import SimpleNamespace
+
+from study_index import AgeIndex, CatalogIndex
+
+def linear_eligible(records, age):
+    # The inclusive min/max check passes_basic_filters has always made
+    ids = set()
+    for idx, record in enumerate(records):
+        if record.min_age is not None and age is not None and age < record.min_age:
+            continue
+        if record.max_age is not None and age is not None and age > record.max_age:
+            continue
+        ids.add(idx)
+    return ids
+
+def make_records(seed=3, count=400):
+    rng = random.Random(seed)
+    bounds = [None, 0, 12, 17.5, 18, 21, 25, 40, 55, 64, 65, 75, 99]
+    return [SimpleNamespace(min_age=rng.choice(bounds), max_age=rng.choice(bounds)) for _ in range(count)]
+
+AGES = [None, 0, 11.9, 12, 17, 17.5, 18, 20.99, 21, 40, 64, 65, 65.01, 75, 99, 120]
+
+def test_matches_linear_check():
+    records = make_records()
+    index = AgeIndex(records)
+    for age in AGES:
+        assert index.eligible(age) == linear_eligible(records, age), age
+
+def test_boundaries_are_inclusive():
+    records = [SimpleNamespace(min_age=18, max_age=65)]
+    index = AgeIndex(records)
+    assert index.eligible(18) == {0}
+    assert index.eligible(65) == {0}
+    assert index.eligible(17.99) == set()
+    assert index.eligible(65.01) == set()
+
+def test_open_ended_and_missing_age():
+    records = [
+        SimpleNamespace(min_age=None, max_age=None),
+        SimpleNamespace(min_age=18, max_age=None),
+        SimpleNamespace(min_age=None, max_age=30),
+    ]
+    index = AgeIndex(records)
+    assert index.eligible(None) == {0, 1, 2}
+    assert index.eligible(10) == {0, 2}
+    assert index.eligible(50) == {0, 1}
+    assert index.eligible(18) == {0, 1, 2}
+
+def test_min_above_max_never_matches():
+    records = [SimpleNamespace(min_age=65, max_age=18), SimpleNamespace(min_age=None, max_age=None)]
+    index = AgeIndex(records)
+    for age in (10, 18, 40, 65, 80):
+        assert index.eligible(age) == {1}
+    # A participant without an age is not age-gated at all
+    assert index.eligible(None) == {0, 1}
+
+def test_results_are_not_shared_between_calls():
+    records = make_records(count=50)
+    index = AgeIndex(records)
+    first = index.eligible(30)
+    first.clear()
+    assert index.eligible(30) == linear_eligible(records, 30)
+
+def test_catalog_index_age_candidates():
+    from catalog import normalize_study
+    from study_records import StudyRecord
+
+    rng = random.Random(5)
+    studies = []
+    for i in range(200):
+        low = rng.choice([None, 18, 21, 60])
+        studies.append(normalize_study({
+            "nct_id": f"NCT{i:08d}",
+            "study_title": f"Study {i}",
+            "min_age_years": low,
+            "max_age_years": rng.choice([None, 17, 65, 80]),
+        }))
+    records = [StudyRecord(s) for s in studies]
+    index = CatalogIndex(records)
+    for age in AGES:
+        assert index.age_candidates(age) == linear_eligible(records, age), age
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+
+import httpx
+import pytest
+
+import batch_geocode
+from batch_geocode import BatchGeocoder, NominatimProvider, OfflineProvider, TokenBucket, geocode_file, place_key
+from geocache import GeocodeCache, ZipCentroids
+
+from conftest import Clock
+
+
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(batch_geocode, "time", clock)
+    monkeypatch.setattr(batch_geocode.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return GeocodeCache(path=str(tmp_path / "geocode.sqlite3"), centroids=ZipCentroids(None))
+
+
+def test_token_bucket_paces_after_the_burst(clock):
+    bucket = TokenBucket(rate=4, burst=2)
+
+    async def run():
+        start = clock.now
+        times = []
+        for _ in range(6):
+            await bucket.acquire()
+            times.append(clock.now - start)
+        return times
+
+    assert asyncio.run(run()) == pytest.approx([0, 0, 0.25, 0.5, 0.75, 1.0])
+    clock.now += 10  # idle time refills only up to the burst
+    assert asyncio.run(run()) == pytest.approx([0, 0, 0.25, 0.5, 0.75, 1.0])
+
+
+def nominatim(statuses):
+    """Replies with each status in turn (then 200) and counts requests."""
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.params["q"])
+        status = statuses.pop(0) if statuses else 200
+        if status != 200:
+            return httpx.Response(status)
+        return httpx.Response(200, json=[{"lat": "37.75", "lon": "-122.41"}])
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler)), requests
+
+
+def fetch(geocoder, client, location):
+    async def run():
+        async with client:
+            return await geocoder.fetch(client, location)
+    return asyncio.run(run())
+
+
+def test_fetch_retries_throttling_with_backoff(clock, cache, monkeypatch):
+    monkeypatch.setattr(batch_geocode, "RETRY_BACKOFF", 2.0)
+    monkeypatch.setattr(batch_geocode, "MAX_RETRIES", 3)
+    geocoder = BatchGeocoder(NominatimProvider(rate=100), cache)
+    client, requests = nominatim([429, 503])
+
+    assert fetch(geocoder, client, "San Francisco, CA") == [37.75, -122.41]
+    assert requests == ["San Francisco, CA"] * 3
+    assert clock.sleeps == [2.0, 4.0]
+    assert (geocoder.counters["retries"], geocoder.counters["failed"]) == (2, 0)
+    assert cache.get(place_key("San Francisco, CA")) == (True, [37.75, -122.41])
+
+
+def test_fetch_records_a_failure_after_the_last_retry(clock, cache, monkeypatch):
+    monkeypatch.setattr(batch_geocode, "MAX_RETRIES", 3)
+    geocoder = BatchGeocoder(NominatimProvider(rate=100), cache)
+    client, requests = nominatim([500, 502, 429, 200])
+
+    assert fetch(geocoder, client, "Nowhere") is None
+    assert len(requests) == 3
+    assert (geocoder.counters["retries"], geocoder.counters["failed"]) == (2, 1)
+    # Failures are not cached, so the next run asks again
+    assert cache.get(place_key("Nowhere")) == (False, None)
+
+
+def test_fetch_does_not_retry_client_errors(clock, cache):
+    geocoder = BatchGeocoder(NominatimProvider(rate=100), cache)
+    client, requests = nominatim([403])
+    assert fetch(geocoder, client, "Somewhere") is None
+    assert len(requests) == 1
+    assert (geocoder.counters["retries"], geocoder.counters["failed"]) == (0, 1)
+
+
+class Killed(BaseException):
+    """Stands in for the process dying; geocode_file must not catch it."""
+
+
+class CountingProvider(OfflineProvider):
+    def __init__(self, centroids, kill_on=None):
+        super().__init__(centroids, concurrency=1)
+        self.kill_on = kill_on
+        self.calls = []
+
+    async def geocode(self, client, location):
+        if location == self.kill_on:
+            raise Killed()
+        self.calls.append(location)
+        return await super().geocode(client, location)
+
+
+ZIPS = [f"{94100 + n}" for n in range(12)]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    with open(tmp_path / "zips.csv", "w", encoding="utf-8") as f:
+        f.write("zip,lat,lng,city,state\n")
+        for n, zip5 in enumerate(ZIPS):
+            f.write(f"{zip5},{37 + n / 10},{-122 - n / 10},San Francisco,CA\n")
+    input_path = str(tmp_path / "studies.jsonl")
+    with open(input_path, "w", encoding="utf-8") as f:
+        for n, zip5 in enumerate(ZIPS):
+            site = {"facility": f"Clinic {n}", "city": "San Francisco", "state": "CA", "zip": zip5}
+            f.write(json.dumps({"nct_id": f"NCT{n:08d}", "site_locations_and_contacts": [site]}) + "\n")
+    return input_path, ZipCentroids(str(tmp_path / "zips.csv"))
+
+
+def test_killed_run_resumes_from_the_checkpoint(tmp_path, corpus):
+    input_path, centroids = corpus
+    cache = GeocodeCache(path=str(tmp_path / "geocode.sqlite3"), centroids=ZipCentroids(None))
+    output = str(tmp_path / "out.jsonl")
+
+    killed = CountingProvider(centroids, kill_on=f"{ZIPS[9]}, United States")
+    with pytest.raises(Killed):
+        asyncio.run(geocode_file(input_path, output, killed, cache, batch_size=4))
+    with open(output + ".partial.jsonl", encoding="utf-8") as f:
+        assert len(f.readlines()) == 8  # two whole batches checkpointed
+    assert not os.path.exists(output)
+
+    resumed = CountingProvider(centroids)
+    counters = asyncio.run(geocode_file(input_path, output, resumed, cache, batch_size=4))
+    assert counters["resumed_after"] == 8
+    # Nothing geocoded before the kill is asked for again
+    assert not set(killed.calls) & set(resumed.calls)
+    assert sorted(killed.calls + resumed.calls) == sorted(f"{z}, United States" for z in ZIPS)
+    assert not any(ZIPS[n] in call for call in resumed.calls for n in range(8))
+    assert not os.path.exists(output + ".partial.jsonl") and not os.path.exists(output + ".checkpoint.json")
+
+    clean = str(tmp_path / "clean.jsonl")
+    fresh = GeocodeCache(path=str(tmp_path / "fresh.sqlite3"), centroids=ZipCentroids(None))
+    asyncio.run(geocode_file(input_path, clean, CountingProvider(centroids), fresh, batch_size=4))
+    with open(output, "rb") as a, open(clean, "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_restart_ignores_the_checkpoint(tmp_path, corpus):
+    input_path, centroids = corpus
+    output = str(tmp_path / "out.jsonl")
+    with pytest.raises(Killed):
+        asyncio.run(geocode_file(input_path, output, CountingProvider(centroids, kill_on=f"{ZIPS[5]}, United States"),
+                                 GeocodeCache(path=str(tmp_path / "a.sqlite3"), centroids=ZipCentroids(None)),
+                                 batch_size=4))
+    provider = CountingProvider(centroids)
+    counters = asyncio.run(geocode_file(input_path, output, provider,
+                                        GeocodeCache(path=str(tmp_path / "b.sqlite3"), centroids=ZipCentroids(None)),
+                                        batch_size=4, resume=False))
+    assert "resumed_after" not in counters
+    assert len(provider.calls) == len(ZIPS)
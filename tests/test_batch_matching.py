@@ -0,0 +1,73 @@
+import json
+import random
+
+import pytest
+
+from batch_matching import MatchPool, match_many
+from catalog import StudyCatalog
+
+from conftest import make_participant, make_study
+
+def write_catalog(path, n, seed):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([make_study(i, rng) for i in range(n)], f)
+
+def make_participants(n):
+    rng = random.Random(3)
+    return [dict(make_participant(rng), id=f"lead-{i}") for i in range(n)]
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = str(tmp_path / "catalog.json")
+    write_catalog(path, 200, seed=1)
+    catalog = StudyCatalog(path, auto_refresh=False)
+    catalog.load()
+    return catalog
+
+@pytest.fixture
+def pool():
+    pool = MatchPool()
+    yield pool
+    pool.shutdown()
+
+def test_pool_is_reused_across_batches(catalog, pool):
+    participants = make_participants(600)
+    serial = sorted(match_many(participants, catalog, limit=5), key=lambda row: row["index"])
+
+    first = sorted(match_many(participants, catalog, limit=5, workers=2, pool=pool), key=lambda row: row["index"])
+    executor = pool._executor
+    second = sorted(match_many(participants, catalog, limit=5, workers=2, pool=pool), key=lambda row: row["index"])
+    assert first == second == serial
+    assert pool._executor is executor
+
+def test_changed_catalog_file_yields_error_row(catalog, pool):
+    participants = make_participants(600)
+    # The file changes before the pool's workers load it
+    write_catalog(catalog.path, 150, seed=2)
+    rows = list(match_many(participants, catalog, limit=5, workers=2, pool=pool))
+    assert rows[-1]["error"] == "catalog_changed"
+    assert catalog.snapshot().version in rows[-1]["detail"]
+    assert all("error" not in row for row in rows[:-1])
+    assert pool._executor is None
+
+    # Once the catalog is reloaded, batches run on a new pool
+    catalog.load()
+    rows = list(match_many(participants, catalog, limit=5, workers=2, pool=pool))
+    assert len(rows) == 600 and all("error" not in row for row in rows)
+
+def test_batch_endpoint_returns_409_when_catalog_changed(catalog, monkeypatch):
+    from fastapi.testclient import TestClient
+    import main
+
+    monkeypatch.setattr(main, "catalog", catalog)
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "token")
+    monkeypatch.setattr(main, "MATCH_BATCH_WORKERS", 2)
+    write_catalog(catalog.path, 150, seed=2)
+    body = "\n".join(json.dumps(p) for p in make_participants(600))
+    try:
+        response = TestClient(main.app).post("/match/batch", content=body, headers={"x-admin-token": "token"})
+    finally:
+        main.match_pool.shutdown()
+    assert response.status_code == 409
+    assert "changed" in response.json()["detail"]
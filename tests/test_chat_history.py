@@ -0,0 +1,71 @@
+import json
+
+from chat_history import build_messages, message_tokens, trim_history, window_start
+
+SYSTEM_PROMPT = "You are a clinical trial assistant."
+
+
+def intake_history(turns):
+    """user/assistant pairs; every assistant reply is the participant JSON so far."""
+    history, fields = [], {}
+    for n in range(turns):
+        history.append({"role": "user", "content": f"Answer number {n}. " + "More detail here. " * 5})
+        fields[f"Field {n}"] = f"value {n}"
+        history.append({"role": "assistant", "content": json.dumps(fields, indent=2)})
+    return history
+
+
+def test_window_keeps_system_prompt_and_latest_turns():
+    history = intake_history(10)
+    history.append({"role": "user", "content": "What studies are near me?"})
+    budget = sum(message_tokens(m) for m in history[-5:])
+    messages = build_messages(SYSTEM_PROMPT, {"history": history}, budget=budget, min_messages=2)
+
+    assert messages[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    kept = messages[2:]
+    assert kept == history[-len(kept):]
+    assert kept[-1]["content"] == "What studies are near me?"
+    assert 3 <= len(kept) < len(history)
+    assert sum(message_tokens(m) for m in kept) <= budget
+
+
+def test_older_turns_are_folded_into_the_summary():
+    history = intake_history(10)
+    history.append({"role": "user", "content": "Anything else?"})
+    session = {"history": history, "known_fields": {"Name": "Jane Doe"}}
+    messages = build_messages(SYSTEM_PROMPT, session, budget=120, min_messages=2)
+
+    summary = messages[1]
+    assert summary["role"] == "system"
+    folded = json.loads(summary["content"].split(": ", 1)[1])
+    start = len(history) - (len(messages) - 2)
+    assert start > 0
+    # Fields from every dropped reply, plus those already folded by trim_history
+    assert folded == dict({"Name": "Jane Doe"}, **json.loads(history[start - 1]["content"]))
+    assert "Field 0" in folded
+
+
+def test_window_never_splits_a_turn():
+    history = intake_history(12)
+    for budget in range(0, 1500, 7):
+        start = window_start(history, budget=budget, min_messages=1)
+        assert history[start]["role"] == "user"
+        assert start <= len(history) - 2  # the latest turn is always kept whole
+
+
+def test_window_is_everything_under_the_budget():
+    history = intake_history(3)
+    assert window_start(history, budget=10000) == 0
+    assert build_messages(SYSTEM_PROMPT, {"history": history}, budget=10000)[1:] == history
+
+
+def test_trim_history_cuts_on_a_turn_boundary():
+    history = intake_history(6)
+    history.insert(3, {"role": "assistant", "content": "Sorry, one more thing."})
+    session = {"history": history, "known_fields": {}}
+    trim_history(session, max_stored=9)
+
+    assert session["history"][0]["role"] == "user"
+    assert len(session["history"]) <= 9
+    assert session["history"][-1]["content"] == json.dumps({f"Field {n}": f"value {n}" for n in range(6)}, indent=2)
+    assert session["known_fields"]["Field 0"] == "value 0"
@@ -0,0 +1,175 @@
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import field_extraction
+import main
+from catalog import StudyCatalog
+from crm_queue import CRMQueue
+from match_cache import MatchCache
+from session_store import SessionStore
+from standing_queries import ProfileStore, StandingQueries
+
+PARTICIPANT = {"age": 30, "state": "CA", "gender": "female", "diagnosis_history": "depression"}
+
+
+def nearby_study(i):
+    return {
+        "nct_id": f"NCT{i:08d}",
+        "study_title": f"Depression study {i}",
+        "summary": "Treatment for depression.",
+        "coordinates": [37.77 + i / 100, -122.42],
+        "states": [],
+        "tags": ["include_depression"],
+        "site_locations_and_contacts": [],
+    }
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    path = tmp_path / "studies.json"
+    path.write_text(json.dumps([nearby_study(i) for i in range(12)]))
+    catalog = StudyCatalog(str(path), auto_refresh=False)
+    catalog.load()
+    monkeypatch.setattr(main, "catalog", catalog)
+    monkeypatch.setattr(main, "crm_queue", CRMQueue(str(tmp_path / "crm.sqlite3")))
+    monkeypatch.setattr(main, "standing_queries", StandingQueries(ProfileStore(str(tmp_path / "standing.sqlite3"))))
+    monkeypatch.setattr(main, "sessions", SessionStore())
+    monkeypatch.setattr(main, "match_cache", MatchCache())
+    monkeypatch.setattr(main, "MATCH_PAGE_SIZE", 10)
+    monkeypatch.setattr(main, "normalize_participant_data", lambda p: dict(p, coordinates=[37.77, -122.42]))
+    monkeypatch.setattr(field_extraction, "FAST_PATH_EXTRACTION", False)
+    return TestClient(main.app)
+
+
+def model_says(monkeypatch, *deltas):
+    async def chunks():
+        for delta in deltas:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta={"content": delta})])
+
+    async def acreate(**kwargs):
+        assert kwargs["stream"]
+        return chunks()
+    monkeypatch.setattr(main.openai.ChatCompletion, "acreate", acreate)
+
+
+def stream(client, message, session_id="s1"):
+    response = client.post("/chat/stream", json={"session_id": session_id, "message": message})
+    assert response.status_code == 200
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        kind, data = block.split("\n")
+        events.append((kind[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def tokens(events):
+    return "".join(data["text"] for kind, data in events if kind == "token")
+
+
+def test_text_before_the_json_in_the_same_delta_is_streamed(app, monkeypatch):
+    model_says(monkeypatch, "Thanks! Here is what I ", "found: {\"age\": 30, ",
+               "\"state\": \"CA\", \"gender\": \"female\", ", "\"diagnosis_history\": \"depression\"}")
+    events = stream(app, "I am 30")
+    assert tokens(events) == "Thanks! Here is what I found: "
+    assert [kind for kind, _ in events].count("card") == 10
+
+
+def test_braces_in_prose_are_streamed_once_parsing_fails(app, monkeypatch):
+    reply = "Use the {name} you gave your doctor. What is your age?"
+    model_says(monkeypatch, "Use the {na", "me} you gave ", "your doctor. What is your age?")
+    events = stream(app, "hello")
+    assert tokens(events) == reply
+    assert events[-1] == ("done", {"reply": reply})
+    assert [kind for kind, _ in events] == ["token"] * 2 + ["done"]
+
+
+def test_unclosed_brace_is_streamed_at_the_end(app, monkeypatch):
+    model_says(monkeypatch, "Pick one of these { options", " and tell me your age.")
+    events = stream(app, "hello")
+    assert tokens(events) == "Pick one of these { options and tell me your age."
+
+
+def test_cards_stream_in_rank_order_before_the_paging_message(app, monkeypatch):
+    model_says(monkeypatch, json.dumps(PARTICIPANT))
+    events = stream(app, "I am 30")
+    kinds = [kind for kind, _ in events]
+    assert kinds == ["card"] * 10 + ["message", "done"]
+    cards = [data["text"] for kind, data in events if kind == "card"]
+    assert [card.split(".")[0].strip("*# ") for card in cards] == [str(n) for n in range(1, 11)]
+    assert "Showing 1–10 of 12" in events[-2][1]["text"]
+    assert events[-1][1]["reply"] == "\n\n".join(data["text"] for kind, data in events[:-1])
+
+
+def test_match_page_yields_each_card_before_building_the_next():
+    class Ranking:
+        catalog_version = "v1"
+
+        def __init__(self, matches):
+            self.matches = matches
+            self.built = 0
+
+        def __len__(self):
+            return len(self.matches)
+
+        def page(self, offset, limit):
+            self.built += limit
+            return self.matches[offset:offset + limit]
+
+    matches = [{"study": nearby_study(i), "match_score": 1, "match_reason": []} for i in range(3)]
+    ranking = Ranking(matches)
+    session = main.new_session()
+    page = main.match_page(session, ranking, exclude_river=False)
+    assert next(page)[0] == "card"
+    assert ranking.built == 1
+    assert [kind for kind, _ in page] == ["card", "card"]
+    assert ranking.built == 3
+    assert [ref["nct_id"] for ref in session["selection"]] == ["NCT00000000", "NCT00000001", "NCT00000002"]
+
+
+def titles(reply):
+    return re.findall(r"\*\*\d+\. (.+?)\*\*", reply)
+
+
+def chat(client, message, session_id="s1"):
+    response = client.post("/chat", json={"session_id": session_id, "message": message})
+    assert response.status_code == 200
+    return response.json()["reply"]
+
+
+def test_more_studies_pages_do_not_overlap(app, monkeypatch):
+    model_says(monkeypatch, json.dumps(PARTICIPANT))
+    first = stream(app, "I am 30")
+    seen = titles("\n\n".join(data["text"] for kind, data in first if kind == "card"))
+    assert len(seen) == 10
+
+    second = chat(app, "more studies")
+    assert len(titles(second)) == 2
+    assert "Showing" not in second
+    assert not set(titles(second)) & set(seen)
+    assert sorted(seen + titles(second)) == sorted(f"Depression study {i}" for i in range(12))
+
+    # The last page was already shown; the next one is empty and says so
+    assert chat(app, "more studies").startswith("That’s every study I found")
+    assert chat(app, "more studies").startswith("That’s every study I found")
+
+
+def test_catalog_change_restarts_paging_from_the_top(app, monkeypatch, tmp_path):
+    model_says(monkeypatch, json.dumps(PARTICIPANT))
+    stream(app, "I am 30")
+    assert len(titles(chat(app, "more studies"))) == 2
+
+    path = tmp_path / "updated.json"
+    path.write_text(json.dumps([nearby_study(i) for i in range(100, 115)]))
+    catalog = StudyCatalog(str(path), auto_refresh=False)
+    catalog.load()
+    monkeypatch.setattr(main, "catalog", catalog)
+
+    reply = chat(app, "more studies")
+    assert reply.startswith("The study list was updated")
+    assert titles(reply) == [f"Depression study {i}" for i in range(100, 110)]
+    assert "Showing 1–10 of 15" in reply
+    assert titles(chat(app, "more studies")) == [f"Depression study {i}" for i in range(110, 115)]
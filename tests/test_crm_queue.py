@@ -0,0 +1,162 @@
+import asyncio
+import json
+import re
+
+import httpx
+import pytest
+
+import crm_queue
+import push_to_monday
+from crm_queue import CRMQueue
+
+from conftest import Clock
+
+
+
+
+class FakeMonday:
+    """Answers aliased create/update mutations with fresh item ids; `script` lists statuses to return first."""
+
+    def __init__(self, script=(), retry_after=None, errors=()):
+        self.script = list(script)
+        self.retry_after = retry_after
+        self.errors = set(errors)
+        self.requests = []
+        self.next_id = 100
+
+    def __call__(self, request):
+        query = json.loads(request.content)["query"]
+        fields = re.findall(r"(?:(\w+): )?(create_item|change_multiple_column_values) \(", query)
+        self.requests.append([name for _, name in fields])
+        status = self.script.pop(0) if self.script else 200
+        if status != 200:
+            headers = {"retry-after": str(self.retry_after)} if self.retry_after else {}
+            return httpx.Response(status, headers=headers, json={"error_message": "outage"})
+        data, errors = {}, []
+        for alias, name in fields:
+            if alias in self.errors:
+                data[alias] = None
+                errors.append({"message": "ColumnValueException", "path": [alias]})
+            else:
+                self.next_id += 1
+                data[alias] = {"id": str(self.next_id)}
+        return httpx.Response(200, json={"data": data, "errors": errors} if errors else {"data": data})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(crm_queue, "time", clock)
+    monkeypatch.setattr(crm_queue, "CRM_BASE_BACKOFF", 2.0)
+    monkeypatch.setattr(crm_queue, "CRM_MAX_ATTEMPTS", 3)
+    return clock
+
+
+def drain(queue, monday, rounds=1):
+    async def run():
+        push_to_monday._async_client = httpx.AsyncClient(transport=httpx.MockTransport(monday))
+        try:
+            for _ in range(rounds):
+                rows = await asyncio.to_thread(queue.due_batch)
+                if rows:
+                    await queue.send_batch(rows)
+        finally:
+            await push_to_monday.close_async_client()
+    asyncio.run(run())
+
+
+def outbox(queue):
+    return queue._conn().execute(
+        "SELECT dedup_key, status, attempts, next_attempt_at FROM outbox ORDER BY id"
+    ).fetchall()
+
+
+def test_claimed_rows_are_invisible_to_other_workers(tmp_path, clock):
+    path = str(tmp_path / "crm.sqlite3")
+    first, second = CRMQueue(path), CRMQueue(path)
+    for n in range(3):
+        first.enqueue({"name": f"Lead {n}"}, f"s{n}")
+
+    claimed = first.due_batch()
+    assert [row[1] for row in claimed] == ["s0", "s1", "s2"]
+    assert second.due_batch() == []
+    assert second.depth() == {"in_flight": 3}
+
+    # A worker that died mid-push gives its rows up when the lease runs out
+    clock.now += crm_queue.CRM_LEASE_SECONDS
+    assert [row[1] for row in second.due_batch()] == ["s0", "s1", "s2"]
+
+
+def test_push_while_in_flight_waits_and_becomes_update(tmp_path, clock):
+    queue = CRMQueue(str(tmp_path / "crm.sqlite3"))
+    monday = FakeMonday()
+    queue.enqueue({"name": "Lead"}, "s1")
+    rows = queue.due_batch()
+    queue.enqueue({"name": "Lead", "rivers_match": True}, "s1")
+    assert queue.due_batch() == []
+
+    async def send():
+        push_to_monday._async_client = httpx.AsyncClient(transport=httpx.MockTransport(monday))
+        await queue.send_batch(rows)
+        await push_to_monday.close_async_client()
+    asyncio.run(send())
+    drain(queue, monday)
+
+    assert monday.requests == [["create_item"], ["change_multiple_column_values"]]
+    assert queue.depth() == {}
+
+
+def test_retry_with_exponential_backoff(tmp_path, clock):
+    queue = CRMQueue(str(tmp_path / "crm.sqlite3"))
+    monday = FakeMonday(script=[503, 500])
+    queue.enqueue({"name": "Lead"}, "s1")
+
+    drain(queue, monday)
+    assert outbox(queue) == [("s1", "pending", 1, clock.now + 2.0)]
+    drain(queue, monday)
+    assert len(monday.requests) == 1  # not due yet
+
+    clock.now += 2.0
+    drain(queue, monday)
+    assert outbox(queue) == [("s1", "pending", 2, clock.now + 4.0)]
+
+    clock.now += 4.0
+    drain(queue, monday)
+    assert outbox(queue) == []
+    assert len(monday.requests) == 3
+    stats = queue.stats()
+    assert (stats["retries"], stats["sent"], stats["pending"]) == (2, 1, 0)
+
+
+def test_retry_after_header_overrides_backoff(tmp_path, clock):
+    queue = CRMQueue(str(tmp_path / "crm.sqlite3"))
+    queue.enqueue({"name": "Lead"}, "s1")
+    drain(queue, FakeMonday(script=[429], retry_after=30))
+    assert outbox(queue) == [("s1", "pending", 1, clock.now + 30)]
+
+
+def test_item_error_retries_only_that_row(tmp_path, clock):
+    queue = CRMQueue(str(tmp_path / "crm.sqlite3"))
+    queue.enqueue({"name": "Good"}, "s1")
+    queue.enqueue({"name": "Bad"}, "s2")
+    drain(queue, FakeMonday(errors={"m1"}))
+    assert outbox(queue) == [("s2", "pending", 1, clock.now + 2.0)]
+
+
+def test_dead_letter_after_max_attempts(tmp_path, clock):
+    queue = CRMQueue(str(tmp_path / "crm.sqlite3"))
+    monday = FakeMonday(script=[503] * 10)
+    queue.enqueue({"name": "Lead"}, "s1")
+    for _ in range(5):
+        drain(queue, monday)
+        clock.now += crm_queue.CRM_MAX_BACKOFF
+
+    assert len(monday.requests) == crm_queue.CRM_MAX_ATTEMPTS
+    row = queue._conn().execute("SELECT status, attempts, last_error FROM outbox").fetchone()
+    assert row == ("failed", 3, "HTTP 503")
+    stats = queue.stats()
+    assert (stats["gave_up"], stats["failed"], stats["pending"]) == (1, 1, 0)
+
+    # A fresh push for the same key is queued alongside the dead letter
+    assert queue.enqueue({"name": "Lead", "notes": "called back"}, "s1")
+    assert queue.depth() == {"failed": 1, "pending": 1}
@@ -0,0 +1,37 @@
+from field_extraction import conditions_uncertain, extract_conditions, fast_path_fields
+
+INTAKE = "Jane Doe, jane@example.com, (555) 123-4567, March 10, 1990, female, 94110, "
+
+def new_session():
+    return {"history": [], "known_fields": {}, "last_participant": None, "river_pending": None}
+
+def test_conditions_in_mention_order():
+    assert extract_conditions("struggling with post-traumatic stress and MDD") == ["PTSD", "Depression"]
+    assert extract_conditions("generalized anxiety disorder") == ["Anxiety"]
+    assert extract_conditions("just feeling tired") is None
+
+def test_negated_condition_is_not_extracted():
+    assert extract_conditions("depression, but no PTSD") == ["Depression"]
+    assert extract_conditions("I don't have anxiety, only depression") == ["Depression"]
+    assert extract_conditions("never been diagnosed with PTSD") is None
+
+def test_uncertain_conditions():
+    assert conditions_uncertain("depression, but no PTSD")
+    assert conditions_uncertain("depression and bipolar disorder")
+    assert conditions_uncertain("anxiety and an eating disorder")
+    assert not conditions_uncertain("major depressive disorder and generalized anxiety disorder")
+    assert not conditions_uncertain(INTAKE + "depression")
+
+def test_fast_path_takes_complete_certain_intake():
+    fields = fast_path_fields(new_session(), INTAKE + "depression and PTSD")
+    assert fields["Conditions"] == ["Depression", "PTSD"]
+    assert fields["Email"] == "jane@example.com"
+
+def test_fast_path_falls_back_for_negation_or_unknown_condition():
+    assert fast_path_fields(new_session(), INTAKE + "depression, not PTSD") is None
+    assert fast_path_fields(new_session(), INTAKE + "depression and bipolar") is None
+
+def test_uncertain_turn_keeps_later_turns_on_the_model():
+    session = new_session()
+    assert fast_path_fields(session, "I have depression and OCD") is None
+    assert fast_path_fields(session, INTAKE + "depression") is None
@@ -0,0 +1,100 @@
+import random
+
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+
+from geo_index import SpatialIndex, haversine_miles
+
+RADIUS = 100
+
+
+def brute_within(points, center, radius):
+    """Every point whose geodesic distance is within radius, by scanning them all."""
+    distances = {i: geodesic(center, point).miles for i, point in enumerate(points)}
+    return {i: miles for i, miles in distances.items() if miles <= radius}
+
+
+def ring(center, radius, bearings=72):
+    """Points just inside and just outside radius (geodesic) in every direction."""
+    inside, outside = [], []
+    for n in range(bearings):
+        bearing = n * 360 / bearings
+        for miles, points in ((radius * 0.9999, inside), (radius * 1.0001, outside)):
+            p = geodesic(miles=miles).destination(center, bearing)
+            points.append((p.latitude, p.longitude))
+    return inside, outside
+
+
+def scatter(center, count, rng, spread=8):
+    lat0, lng0 = center
+    points = []
+    for _ in range(count):
+        lat = min(90, max(-90, lat0 + rng.uniform(-spread, spread)))
+        lng = (lng0 + rng.uniform(-spread, spread) * (20 if abs(lat0) > 70 else 1) + 180) % 360 - 180
+        points.append((lat, lng))
+    return points
+
+
+def index(points):
+    return SpatialIndex((i, i % 3, lat, lng) for i, (lat, lng) in enumerate(points))
+
+
+CENTERS = {
+    "cell corner": (40.0, -74.0),
+    "equator, where the sphere is furthest off": (0.0, 0.0),
+    "cell edge": (35.999999, -100.5),
+    "high latitude": (78.3, 15.6),
+    "circle over the north pole": (89.2, 30.0),
+    "circle over the south pole": (-88.7, -140.0),
+    "antimeridian east": (-17.8, 179.95),
+    "antimeridian west": (52.0, -179.6),
+}
+
+
+@pytest.mark.parametrize("center", CENTERS.values(), ids=CENTERS.keys())
+def test_exact_within_matches_a_geodesic_scan(center):
+    inside, outside = ring(center, RADIUS)
+    points = inside + outside + scatter(center, 400, random.Random(str(center)))
+    ids, miles = index(points).within(center, RADIUS, exact=True)
+
+    expected = brute_within(points, center, RADIUS)
+    assert set(ids.tolist()) == set(expected)
+    assert set(range(len(inside))) <= set(expected)
+    assert miles.tolist() == pytest.approx([expected[i] for i in ids.tolist()])
+
+
+@pytest.mark.parametrize("center", CENTERS.values(), ids=CENTERS.keys())
+def test_haversine_within_matches_a_haversine_scan(center):
+    points = scatter(center, 400, random.Random(str(center)))
+    lat, lng = np.radians([p[0] for p in points]), np.radians([p[1] for p in points])
+    miles = haversine_miles(center[0], center[1], lat, lng, np.cos(lat))
+    ids, _ = index(points).within(center, RADIUS)
+    assert set(ids.tolist()) == set(np.flatnonzero(miles <= RADIUS).tolist())
+
+
+@pytest.mark.parametrize("center", CENTERS.values(), ids=CENTERS.keys())
+def test_nearest_per_key_matches_a_geodesic_scan(center):
+    rng = random.Random(str(center))
+    points = scatter(center, 300, rng, spread=3)
+    keys = [rng.randrange(40) for _ in points]
+    spatial = SpatialIndex((key, i, lat, lng) for i, (key, (lat, lng)) in enumerate(zip(keys, points)))
+    best, nearest = spatial.nearest_per_key(center, RADIUS, 40, exact=True)
+
+    for key in range(40):
+        distances = {i: geodesic(center, points[i]).miles for i in range(len(points)) if keys[i] == key}
+        in_range = {i: d for i, d in distances.items() if d <= RADIUS}
+        if not in_range:
+            assert (best[key], nearest[key]) == (np.inf, -1)
+            continue
+        closest = min(in_range, key=in_range.get)
+        assert best[key] == pytest.approx(in_range[closest])
+        assert nearest[key] == closest
+
+
+def test_poles_and_the_antimeridian_are_one_cell_apart():
+    spatial = index([(89.99, -170.0), (89.99, 10.0), (0.0, -180.0), (0.0, 179.999)])
+    ids, _ = spatial.within((89.99, 100.0), 5, exact=True)
+    assert sorted(ids.tolist()) == [0, 1]
+    ids, _ = spatial.within((0.0, 180.0), 1, exact=True)
+    assert sorted(ids.tolist()) == [2, 3]
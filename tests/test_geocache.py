@@ -0,0 +1,68 @@
+import pytest
+
+import geocache
+import utils
+from geocache import GeocodeCache, ZipCentroids
+
+from conftest import Clock
+
+
+class FakeGoogle:
+    def __init__(self, found=True):
+        self.found = found
+        self.queries = []
+
+    def geocode(self, query=None, components=None):
+        self.queries.append(query or components)
+        if not self.found:
+            return None
+        return type("Location", (), {"latitude": 31.0, "longitude": -99.0, "raw": {}})()
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(geocache, "time", clock)
+    return clock
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = GeocodeCache(path=str(tmp_path / "geocode.sqlite3"), centroids=ZipCentroids(None), ttl=3600, negative_ttl=60)
+    monkeypatch.setattr(utils, "geocode_cache", cache)
+    return cache
+
+def test_unknown_city_geocodes_the_state_it_is_cached_under(cache, monkeypatch):
+    google = FakeGoogle()
+    monkeypatch.setattr(utils, "geolocator", google)
+    assert utils.geocode_location("Unknown", "TX", "") == {"lat": 31.0, "lng": -99.0, "city": "", "state": ""}
+    assert google.queries == ["TX"]
+    assert cache.get("state:TX")[0]
+
+    # A later state-only lookup is answered by that entry
+    utils.geocode_location("", "TX", "")
+    assert google.queries == ["TX"]
+
+def test_city_and_zip_queries(cache, monkeypatch):
+    google = FakeGoogle()
+    monkeypatch.setattr(utils, "geolocator", google)
+    utils.geocode_location("Austin", "TX", "")
+    utils.geocode_location("Austin", "TX", "78701")
+    assert google.queries == ["Austin, TX", {"postal_code": "78701", "country": "US"}]
+
+def test_misses_expire_after_the_negative_ttl(cache, clock, monkeypatch):
+    google = FakeGoogle(found=False)
+    monkeypatch.setattr(utils, "geolocator", google)
+    assert utils.geocode_location("Nowhere", "TX", "") is None
+    clock.now += 30
+    assert utils.geocode_location("Nowhere", "TX", "") is None
+    assert len(google.queries) == 1
+
+    clock.now += 31
+    google.found = True
+    assert utils.geocode_location("Nowhere", "TX", "")["lat"] == 31.0
+    assert len(google.queries) == 2
+
+    # Found values keep the full TTL, in memory and on disk
+    clock.now += 600
+    assert cache.get("city:nowhere|TX")[0]
+    cache._memory.clear()
+    assert cache.get("city:nowhere|TX")[0]
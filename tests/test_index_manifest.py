@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+
+from index_manifest import manifest_path
+from index_studies_general import index_studies
+from study_store import iter_studies
+
+STUDY_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<clinical_study>
+  <id_info><nct_id>NCT{i:08d}</nct_id></id_info>
+  <brief_title>A Study of {condition} Treatment {i}</brief_title>
+  <brief_summary><textblock>This trial evaluates a treatment for {condition}. {note}</textblock></brief_summary>
+  <overall_status>Recruiting</overall_status>
+  <eligibility><criteria><textblock>Inclusion Criteria: adults 18 to 65 years.</textblock></criteria></eligibility>
+  <location>
+    <facility><name>Site {i}</name><address><city>Austin</city><state>Texas</state>
+    <zip>78701</zip><country>United States</country></address></facility>
+  </location>
+  <location_countries><country>United States</country></location_countries>
+</clinical_study>
+"""
+
+def write_study(xml_dir, i, condition="depression", note=""):
+    with open(os.path.join(xml_dir, f"NCT{i:08d}.xml"), "w", encoding="utf-8") as f:
+        f.write(STUDY_XML.format(i=i, condition=condition, note=note))
+
+def rebuild(xml_dir, output):
+    full = output + ".full" + os.path.splitext(output)[1]
+    index_studies(["depression"], xml_dir, full, incremental=False)
+    return list(iter_studies(full))
+
+@pytest.mark.parametrize("name", ["index.jsonl", "index.json"])
+def test_incremental_run_matches_full_rebuild(tmp_path, name):
+    xml_dir = tmp_path / "xml"
+    xml_dir.mkdir()
+    output = str(tmp_path / name)
+    for i in range(30):
+        write_study(xml_dir, i, "depression" if i % 3 else "asthma", note="Ünïcode ✓")
+    index_studies(["depression"], str(xml_dir), output)
+
+    # Edit, add, filter out and delete a few files
+    write_study(xml_dir, 4, note="Updated eligibility.")
+    write_study(xml_dir, 30)
+    write_study(xml_dir, 5, "asthma")
+    write_study(xml_dir, 6, "depression")
+    os.remove(xml_dir / "NCT00000007.xml")
+    index_studies(["depression"], str(xml_dir), output)
+    studies = list(iter_studies(output))
+    assert studies == rebuild(str(xml_dir), output)
+    assert "Updated eligibility." in next(s for s in studies if s["nct_id"] == "NCT00000004")["summary"]
+
+    # Nothing changed: every study is copied from the previous output
+    index_studies(["depression"], str(xml_dir), output)
+    assert list(iter_studies(output)) == studies
+
+def test_manifest_keeps_spans_not_studies(tmp_path):
+    xml_dir = tmp_path / "xml"
+    xml_dir.mkdir()
+    output = str(tmp_path / "index.jsonl")
+    for i in range(5):
+        write_study(xml_dir, i)
+    index_studies(["depression"], str(xml_dir), output)
+    with open(manifest_path(output), encoding="utf-8") as f:
+        entry = json.load(f)["files"]["NCT00000002.xml"]
+    assert set(entry) == {"size", "mtime", "sha256", "span"}
+    offset, length = entry["span"]
+    with open(output, "rb") as f:
+        f.seek(offset)
+        assert json.loads(f.read(length))["nct_id"] == "NCT00000002"
+
+def test_edited_output_forces_rebuild(tmp_path):
+    xml_dir = tmp_path / "xml"
+    xml_dir.mkdir()
+    output = str(tmp_path / "index.jsonl")
+    for i in range(5):
+        write_study(xml_dir, i)
+    index_studies(["depression"], str(xml_dir), output)
+    with open(output, "w", encoding="utf-8") as f:
+        f.write("")
+    index_studies(["depression"], str(xml_dir), output)
+    assert len(list(iter_studies(output))) == 5
+
+def test_parallel_run_matches_serial_run(tmp_path):
+    xml_dir = tmp_path / "xml"
+    xml_dir.mkdir()
+    for i in range(40):
+        write_study(xml_dir, i, "depression" if i % 4 else "asthma")
+    serial, parallel = str(tmp_path / "serial.jsonl"), str(tmp_path / "parallel.jsonl")
+    index_studies(["depression"], str(xml_dir), serial, workers=1)
+    index_studies(["depression"], str(xml_dir), parallel, workers=2)
+
+    with open(serial, "rb") as a, open(parallel, "rb") as b:
+        assert a.read() == b.read()
+    with open(manifest_path(serial), encoding="utf-8") as a, open(manifest_path(parallel), encoding="utf-8") as b:
+        serial_manifest, parallel_manifest = json.load(a), json.load(b)
+    assert parallel_manifest["files"] == serial_manifest["files"]
+    assert parallel_manifest["output"]["size"] == serial_manifest["output"]["size"]
+
+def test_failed_read_keeps_the_previous_study(tmp_path, monkeypatch):
+    import index_studies_general
+
+    xml_dir = tmp_path / "xml"
+    xml_dir.mkdir()
+    output = str(tmp_path / "index.jsonl")
+    for i in range(5):
+        write_study(xml_dir, i)
+    index_studies(["depression"], str(xml_dir), output)
+    before = list(iter_studies(output))
+
+    # Both files look changed; one read fails, the other is new and fails too
+    write_study(xml_dir, 2, note="Edited while the disk was flaky.")
+    write_study(xml_dir, 9)
+    flaky = {str(xml_dir / "NCT00000002.xml"), str(xml_dir / "NCT00000009.xml")}
+    refresh_file = index_studies_general.refresh_file
+    monkeypatch.setattr(index_studies_general, "refresh_file",
+                        lambda path, *args: (None, None, "failed") if path in flaky else refresh_file(path, *args))
+    index_studies(["depression"], str(xml_dir), output)
+    assert list(iter_studies(output)) == before
+
+    # The next run retries both files
+    monkeypatch.setattr(index_studies_general, "refresh_file", refresh_file)
+    index_studies(["depression"], str(xml_dir), output)
+    studies = {s["nct_id"]: s for s in iter_studies(output)}
+    assert "Edited while the disk was flaky." in studies["NCT00000002"]["summary"]
+    assert "NCT00000009" in studies
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+from match_cache import MatchCache, profile_fingerprint
+
+PARTICIPANT = {"coordinates": (37.75, -122.41), "age": 36, "gender": "female", "state": "CA",
+               "diagnosis_history": "Depression, Anxiety"}
+
+def test_same_profile_same_key():
+    reordered = dict(PARTICIPANT, diagnosis_history="anxiety,  depression ", state="ca")
+    assert profile_fingerprint(PARTICIPANT) == profile_fingerprint(reordered)
+
+def test_empty_condition_part_changes_key():
+    # "depression," expands to the "" term, which widens the candidate set
+    assert profile_fingerprint(dict(PARTICIPANT, diagnosis_history="depression")) != \
+        profile_fingerprint(dict(PARTICIPANT, diagnosis_history="depression,"))
+
+class FakeRanking:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+def test_evicts_by_bytes():
+    cache = MatchCache(max_entries=100, max_bytes=250)
+    snapshot = SimpleNamespace(version="v1")
+    for age in range(5):
+        cache.get_or_match(snapshot, dict(PARTICIPANT, age=age), False, lambda p, e: FakeRanking(100))
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 200
+    assert stats["evictions"] == 3
+
+def test_new_catalog_version_resets_bytes():
+    cache = MatchCache(max_entries=100, max_bytes=1000)
+    cache.get_or_match(SimpleNamespace(version="v1"), PARTICIPANT, False, lambda p, e: FakeRanking(300))
+    cache.get_or_match(SimpleNamespace(version="v2"), PARTICIPANT, False, lambda p, e: FakeRanking(100))
+    assert cache.stats()["bytes"] == 100
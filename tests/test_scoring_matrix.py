@@ -0,0 +1,70 @@
+import copy
+import random
+from collections import Counter
+
+import pytest
+
+import matcher
+from catalog import normalize_study
+from matcher import match_studies, synonym_vocabulary
+from study_index import CatalogIndex
+from study_records import StudyRecord
+
+from conftest import make_participant, make_study
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = random.Random(11)
+    records = [StudyRecord(normalize_study(make_study(i, rng))) for i in range(1500)]
+    return records, CatalogIndex(records, synonym_vocabulary())
+
+@pytest.mark.parametrize("seed", range(4))
+def test_vectorized_matches_per_study_loop(catalog, seed, monkeypatch):
+    records, index = catalog
+    rng = random.Random(seed)
+    for _ in range(50):
+        participant = make_participant(rng)
+        for exclude_river in (False, True):
+            for limit in (None, 10):
+                monkeypatch.setattr(matcher, "VECTORIZED_SCORING", False)
+                expected = match_studies(participant, records, exclude_river, index, limit)
+                monkeypatch.setattr(matcher, "VECTORIZED_SCORING", True)
+                assert match_studies(participant, records, exclude_river, index, limit) == expected, participant
+
+@pytest.mark.parametrize("vectorized", (False, True))
+def test_scores_match_pages(catalog, vectorized, monkeypatch):
+    records, index = catalog
+    monkeypatch.setattr(matcher, "VECTORIZED_SCORING", vectorized)
+    rng = random.Random(7)
+    for _ in range(30):
+        ranking = matcher.rank_studies(make_participant(rng), records, False, index)
+        assert ranking.scores() == [(m["study"]["nct_id"], m["match_score"]) for m in ranking.page()]
+
+@pytest.mark.parametrize("vectorized", (False, True))
+def test_multi_site_study_matches_near_any_site(vectorized, monkeypatch):
+    from batch_geocode import apply_coordinates
+
+    study = {
+        "nct_id": "NCT00000001",
+        "study_title": "A depression study",
+        "summary": "Treatment for depression.",
+        "site_locations_and_contacts": [
+            {"city": "New York", "state": "NY", "zip": "10001"},
+            {"city": "San Francisco", "state": "CA", "zip": "94110"},
+        ],
+    }
+    apply_coordinates(study, {"10001, United States": (40.75, -73.99), "94110, United States": (37.75, -122.41)},
+                      Counter())
+    assert study.get("coordinates") is None
+    # Catalogs geocoded before sites were matched individually carry the first site as center
+    legacy = dict(study, coordinates=[40.75, -73.99])
+    monkeypatch.setattr(matcher, "VECTORIZED_SCORING", vectorized)
+    for catalog in ([study], [legacy]):
+        records = [StudyRecord(normalize_study(copy.deepcopy(s))) for s in catalog]
+        index = CatalogIndex(records, synonym_vocabulary())
+        for coords, state in (((40.71, -74.01), "NY"), ((37.77, -122.42), "CA")):
+            participant = {"coordinates": coords, "state": state, "age": 30, "diagnosis_history": "depression"}
+            matches = match_studies(participant, records, False, index)
+            assert [m["study"]["nct_id"] for m in matches] == ["NCT00000001"], (catalog, state)
+        far = {"coordinates": (29.76, -95.37), "state": "TX", "age": 30, "diagnosis_history": "depression"}
+        assert match_studies(far, records, False, index) == []
@@ -0,0 +1,198 @@
+import socket
+import socketserver
+import threading
+
+import pytest
+
+import session_store
+from session_store import MemoryBackend, RedisBackend, SQLiteBackend, SessionStore
+
+from conftest import Clock
+
+
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store, "time", clock)
+    return clock
+
+
+def test_memory_backend_evicts_least_recently_used(clock):
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", "1", 60)
+    backend.set("b", "2", 60)
+    assert backend.get("a") == "1"  # b is now the least recently used
+    backend.set("c", "3", 60)
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == ("1", None, "3")
+    assert backend.stats() == {"entries": 2, "bytes": 2, "evictions": 1}
+
+
+def test_memory_backend_bounds_bytes(clock):
+    backend = MemoryBackend(max_bytes=10)
+    backend.set("a", "x" * 6, 60)
+    backend.set("a", "x" * 4, 60)  # replacing a key frees its old blob
+    assert backend.stats()["bytes"] == 4
+    backend.set("b", "y" * 6, 60)
+    assert backend.stats() == {"entries": 2, "bytes": 10, "evictions": 0}
+    backend.set("c", "z", 60)
+    assert backend.get("a") is None
+    assert backend.stats() == {"entries": 2, "bytes": 7, "evictions": 1}
+    backend.delete("b")
+    assert backend.stats()["bytes"] == 1
+
+
+def test_memory_backend_expires(clock):
+    backend = MemoryBackend()
+    backend.set("a", "1", 60)
+    clock.now += 59
+    assert backend.get("a") == "1"
+    clock.now += 1
+    assert backend.get("a") is None
+    assert backend.stats()["bytes"] == 0
+
+
+def test_session_store_slides_expiry_on_save(clock):
+    store = SessionStore(MemoryBackend(), ttl=60)
+    store.save("s1", {"history": ["hi"]})
+    clock.now += 50
+    store.save("s1", store.load("s1"))
+    clock.now += 50
+    assert store.load("s1") == {"history": ["hi"]}
+    clock.now += 60
+    assert store.load("s1") is None
+    assert (store.counters["hits"], store.counters["misses"], store.counters["saves"]) == (2, 1, 2)
+
+
+def test_sqlite_backend_persists_and_expires(tmp_path, clock):
+    path = str(tmp_path / "sessions.sqlite3")
+    SQLiteBackend(path).set("a", "1", 60)
+    backend = SQLiteBackend(path)
+    assert backend.get("a") == "1"
+    clock.now += 60
+    assert backend.get("a") is None
+    backend.set("b", "2", 60)
+    backend.delete("b")
+    assert backend.get("b") is None
+
+
+def test_sqlite_backend_prunes_expired_and_least_recent(tmp_path, clock):
+    backend = SQLiteBackend(str(tmp_path / "sessions.sqlite3"), max_entries=3, prune_every=5)
+    backend.set("short", "x", 1)
+    for key in "abc":
+        clock.now += 1
+        backend.set(key, key, 60)
+    assert backend.stats()["entries"] == 4  # nothing pruned before the 5th write
+    clock.now += 1
+    backend.set("d", "d", 60)
+    # "short" has expired; of the rest only the 3 most recently written stay
+    assert backend.stats() == {"entries": 3, "bytes": 3, "evictions": 2}
+    assert [backend.get(key) for key in ("short", "a", "b", "c", "d")] == [None, None, "b", "c", "d"]
+
+
+def start_stub(password=None):
+    """A RESP server over a dict that records every command and can drop a connection mid-session."""
+    state = {"data": {}, "commands": [], "drop": False}
+
+    def reply(args):
+        name = args[0].upper()
+        if name == b"AUTH":
+            return b"+OK\r\n" if args[1].decode() == password else b"-WRONGPASS invalid password\r\n"
+        if name in (b"SELECT", b"SET"):
+            if name == b"SET":
+                state["data"][args[1]] = args[2]
+            return b"+OK\r\n"
+        if name == b"GET":
+            value = state["data"].get(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"DEL":
+            return b":%d\r\n" % sum(state["data"].pop(k, None) is not None for k in args[1:])
+        if name == b"DBSIZE":
+            return b":%d\r\n" % len(state["data"])
+        if name == b"KEYS":
+            keys = sorted(state["data"])
+            return b"*%d\r\n" % len(keys) + b"".join(b"$%d\r\n%s\r\n" % (len(k), k) for k in keys)
+        return b"-ERR unknown command '%s'\r\n" % args[0]
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int(self.rfile.readline()[1:-2])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                if state["drop"]:
+                    state["drop"] = False
+                    return
+                state["commands"].append([arg.decode() for arg in args])
+                self.wfile.write(reply(args))
+
+    class Server(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+@pytest.fixture
+def resp_stub():
+    server, state = start_stub(password="secret")
+    yield server.server_address[1], state
+    server.shutdown()
+    server.server_close()
+
+
+def test_redis_backend_round_trips_bulk_strings(resp_stub):
+    port, state = resp_stub
+    backend = RedisBackend(f"redis://:secret@127.0.0.1:{port}/2")
+    blob = '{"history": ["Café ☕", "line\\r\\nbreak"]}\r\nraw CRLF inside'
+    backend.set("session:s1", blob, 0.4)
+    assert backend.get("session:s1") == blob
+    assert backend.get("session:missing") is None
+    assert backend.stats() == {"entries": 1}
+    assert backend.command("KEYS", "*") == ["session:s1"]
+    backend.delete("session:s1")
+    assert backend.get("session:s1") is None
+    assert state["commands"][:3] == [["AUTH", "secret"], ["SELECT", "2"], ["SET", "session:s1", blob, "EX", "1"]]
+
+
+def test_redis_backend_raises_error_replies(resp_stub):
+    port, _ = resp_stub
+    backend = RedisBackend(f"redis://127.0.0.1:{port}/0")
+    with pytest.raises(RuntimeError, match="unknown command 'NOPE'"):
+        backend.command("NOPE")
+    # The error reply is consumed whole; the connection is still usable
+    backend.set("k", "v", 60)
+    assert backend.get("k") == "v"
+
+    unauthorized = RedisBackend(f"redis://:wrong@127.0.0.1:{port}/0")
+    for _ in range(2):
+        # A failed AUTH must not leave an unauthenticated connection behind for the next call
+        with pytest.raises(RuntimeError, match="WRONGPASS"):
+            unauthorized.get("k")
+
+
+def test_redis_backend_reconnects_after_a_dropped_connection(resp_stub):
+    port, state = resp_stub
+    store = SessionStore(RedisBackend(f"redis://127.0.0.1:{port}/0"), ttl=60)
+    store.save("s1", {"history": []})
+    state["drop"] = True
+    assert store.load("s1") == {"history": []}
+    assert store.counters["errors"] == 0
+
+
+def test_session_store_counts_backend_errors():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    store = SessionStore(RedisBackend(f"redis://127.0.0.1:{port}/0", timeout=0.5), ttl=60)
+    # Nothing listens there any more; sessions fall back to fresh ones instead of failing the chat
+    assert store.load("s1") is None
+    store.save("s1", {})
+    assert store.counters["errors"] == 2
@@ -0,0 +1,123 @@
+import copy
+import json
+import random
+
+import pytest
+
+from catalog import StudyCatalog
+from matcher import rank_studies
+from standing_queries import ProfileStore, StandingQueries, study_digest
+
+from conftest import TAGS, make_participant, make_study
+
+def load(tmp_path, name, studies):
+    path = tmp_path / name
+    path.write_text(json.dumps(studies))
+    return StudyCatalog(str(path), auto_refresh=False).load()
+
+def all_matches(snapshot, profiles):
+    pairs = {}
+    for participant_id, profile in profiles:
+        for match in rank_studies(profile, snapshot.records, index=snapshot.index).page():
+            pairs[participant_id, match["study"]["nct_id"]] = match["match_score"]
+    return pairs
+
+@pytest.fixture
+def catalogs(tmp_path):
+    rng = random.Random(21)
+    base = [make_study(i, rng) for i in range(400)]
+    changed = copy.deepcopy(base)
+    edit_rng = random.Random(22)
+    for study in edit_rng.sample(changed, 30):
+        study["tags"] = edit_rng.sample(TAGS, 2)
+        study["min_age_years"], study["max_age_years"] = edit_rng.choice([(None, None), (18, 25)])
+    removed = {s["nct_id"] for s in edit_rng.sample(changed, 10)}
+    changed = [s for s in changed if s["nct_id"] not in removed]
+    changed += [make_study(i, edit_rng) for i in range(400, 440)]
+    return load(tmp_path, "a.json", base), load(tmp_path, "b.json", changed)
+
+@pytest.fixture
+def profiles():
+    rng = random.Random(23)
+    return [(f"lead-{i}", make_participant(rng)) for i in range(150)]
+
+def test_delta_equals_full_rematch(tmp_path, catalogs, profiles):
+    before, after = catalogs
+    standing = StandingQueries(ProfileStore(str(tmp_path / "standing.sqlite3")))
+    shown = all_matches(before, profiles)
+    for participant_id, profile in profiles:
+        standing.remember(participant_id, profile, [(n, s) for (p, n), s in shown.items() if p == participant_id])
+    assert standing.refresh(before) == []
+
+    delta = standing.refresh(after)
+    now = all_matches(after, profiles)
+    assert {(d["participant_id"], d["nct_id"]): d["match_score"] for d in delta} == \
+        {pair: score for pair, score in now.items() if pair not in shown}
+    assert delta, "the edits should produce some new matches"
+    unchanged = {study_digest(study) for study in before.studies}
+    assert standing.last_refresh["changed_studies"] == sum(study_digest(s) not in unchanged for s in after.studies)
+
+def test_unchanged_catalog_is_a_noop(tmp_path, catalogs, profiles):
+    before, _ = catalogs
+    standing = StandingQueries(ProfileStore(str(tmp_path / "standing.sqlite3")))
+    for participant_id, profile in profiles:
+        standing.remember(participant_id, profile)
+    assert standing.refresh(before)
+    assert standing.refresh(before) == []
+
+def test_concurrent_workers_record_a_refresh_once(tmp_path, catalogs, profiles, monkeypatch):
+    before, after = catalogs
+    path = str(tmp_path / "standing.sqlite3")
+    first, second = StandingQueries(ProfileStore(path)), StandingQueries(ProfileStore(path))
+    for participant_id, profile in profiles:
+        first.remember(participant_id, profile)
+    first.refresh(before)
+
+    # The first worker commits while the second is still evaluating
+    known_pairs = second.store.known_pairs
+    winner = []
+
+    def race(nct_ids):
+        winner.extend(first.refresh(after))
+        return known_pairs(nct_ids)
+
+    monkeypatch.setattr(second.store, "known_pairs", race)
+    assert second.refresh(after) == []
+    assert winner
+    assert first.store.catalog_state()[0] == after.version
+
+def test_digest_follows_post_index_fields():
+    study = {"nct_id": "NCT1", "source_sha256": "ab" * 32, "tags": ["include_anxiety"],
+             "coordinates": {"lat": 1.0, "lng": 2.0}, "site_locations_and_contacts": []}
+    digest = study_digest(study)
+    assert digest == study_digest(dict(study, summary="ignored: covered by the XML hash"))
+    assert digest != study_digest(dict(study, coordinates={"lat": 1.5, "lng": 2.0}))
+    assert digest != study_digest(dict(study, tags=["include_ptsd"]))
+
+def test_startup_does_not_wait_for_the_first_refresh(tmp_path, catalogs, monkeypatch):
+    import threading
+    from fastapi.testclient import TestClient
+    import main
+    from crm_queue import CRMQueue
+
+    started, release, finished = threading.Event(), threading.Event(), threading.Event()
+
+    def slow_refresh(snapshot):
+        started.set()
+        release.wait(5)
+        finished.set()
+        return []
+
+    monkeypatch.setattr(main, "catalog", StudyCatalog(catalogs[0].path, auto_refresh=False))
+    monkeypatch.setattr(main, "crm_queue", CRMQueue(str(tmp_path / "crm.sqlite3")))
+    monkeypatch.setattr(main.standing_queries, "refresh", slow_refresh)
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "token")
+    with TestClient(main.app) as client:
+        try:
+            assert started.wait(10)
+            response = client.get("/admin/match-cache/stats", headers={"x-admin-token": "token"})
+            assert response.status_code == 200
+            # Startup returned and served a request while the refresh was still running
+            assert not finished.is_set()
+        finally:
+            release.set()
@@ -0,0 +1,26 @@
+from eligibility_features import extract_eligibility_features
+from study_tagger import generate_tags
+
+def tagged(title="A depression study", summary="", criteria=""):
+    study = {"study_title": title, "summary": summary, "eligibility_text": criteria}
+    study["eligibility_features"] = extract_eligibility_features(criteria, description=f"{title} {summary}")
+    return generate_tags(study)
+
+def test_feature_tags():
+    tags = tagged(criteria="Inclusion Criteria: veterans aged 18-65. "
+                           "Exclusion Criteria: pregnancy or breastfeeding; history of bipolar disorder")
+    assert {"require_veteran", "exclude_pregnant", "exclude_bipolar"} <= set(tags)
+
+def test_inclusion_mentions_are_not_exclusions():
+    tags = tagged(criteria="Inclusion Criteria: pregnant women with bipolar depression. Exclusion Criteria: none")
+    assert "exclude_pregnant" not in tags
+    assert "exclude_bipolar" not in tags
+
+def test_telehealth_from_summary_or_inclusion():
+    assert "include_telehealth" in tagged(summary="Visits are held by telemedicine.")
+    assert "include_telehealth" in tagged(criteria="Inclusion Criteria: able to attend video visits")
+
+def test_telehealth_ignores_exclusions_and_generic_phrases():
+    assert "include_telehealth" not in tagged(criteria="Inclusion Criteria: adults. "
+                                                       "Exclusion Criteria: unable to attend telehealth visits")
+    assert "include_telehealth" not in tagged(summary="Participants complete diaries from home.")
@@ -3,8 +3,10 @@ from datetime import datetime
 import re
 import os
 from geopy.geocoders import GoogleV3
+from geocache import GeocodeCache, US_STATES, cache_key
 
 geolocator = GoogleV3(api_key=os.getenv("GOOGLE_MAPS_API_KEY"))
+geocode_cache = GeocodeCache()
 
 def flatten_dict(d, parent_key='', sep=' - '):
     items = {}
@@ -27,21 +29,6 @@ def normalize_gender(g):
     return g
 
 def normalize_state(state_input):
-    US_STATES = {
-        "alabama": "AL", "alaska": "AK", "arizona": "AZ", "arkansas": "AR",
-        "california": "CA", "colorado": "CO", "connecticut": "CT", "delaware": "DE",
-        "florida": "FL", "georgia": "GA", "hawaii": "HI", "idaho": "ID",
-        "illinois": "IL", "indiana": "IN", "iowa": "IA", "kansas": "KS",
-        "kentucky": "KY", "louisiana": "LA", "maine": "ME", "maryland": "MD",
-        "massachusetts": "MA", "michigan": "MI", "minnesota": "MN", "mississippi": "MS",
-        "missouri": "MO", "montana": "MT", "nebraska": "NE", "nevada": "NV",
-        "new hampshire": "NH", "new jersey": "NJ", "new mexico": "NM", "new york": "NY",
-        "north carolina": "NC", "north dakota": "ND", "ohio": "OH", "oklahoma": "OK",
-        "oregon": "OR", "pennsylvania": "PA", "rhode island": "RI", "south carolina": "SC",
-        "south dakota": "SD", "tennessee": "TN", "texas": "TX", "utah": "UT",
-        "vermont": "VT", "virginia": "VA", "washington": "WA", "west virginia": "WV",
-        "wisconsin": "WI", "wyoming": "WY", "district of columbia": "DC"
-    }
     s = state_input.strip().lower()
     return US_STATES.get(s, s.upper())
 
@@ -70,20 +57,38 @@ def calculate_age(dob_str):
     print("⚠️ Unrecognized DOB format:", dob_str)
     return None
 
+def location_from_google(loc):
+    if not loc:
+        return None
+    city = state = ""
+    for component in (loc.raw or {}).get("address_components", []):
+        types = component.get("types", [])
+        if "locality" in types or ("postal_town" in types and not city):
+            city = component.get("long_name", "")
+        elif "administrative_area_level_1" in types:
+            state = component.get("short_name", "")
+    return {"lat": loc.latitude, "lng": loc.longitude, "city": city, "state": state}
+
+def geocode_location(city, state, zip_code):
+    # Cached (memory → SQLite → offline ZIP table) before any GoogleV3 call.
+    # The query follows the cache key, so e.g. an "Unknown" city geocodes the state alone
+    key = cache_key(zip_code, city, state)
+
+    def fetch():
+        if key.startswith("zip:"):
+            return location_from_google(geolocator.geocode(components={"postal_code": zip_code, "country": "US"}))
+        elif key.startswith("city:"):
+            return location_from_google(geolocator.geocode(f"{city}, {state}"))
+        elif key.startswith("state:"):
+            return location_from_google(geolocator.geocode(state))
+        return None
+
+    return geocode_cache.lookup(fetch, zip_code, city, state)
+
 def get_coordinates(city, state, zip_code):
-    try:
-        if zip_code:
-            loc = geolocator.geocode({"postalcode": zip_code, "country": "US"})
-        elif city and state:
-            loc = geolocator.geocode(f"{city}, {state}")
-        elif state:
-            loc = geolocator.geocode(state)
-        else:
-            return None
-        if loc:
-            return (loc.latitude, loc.longitude)
-    except Exception as e:
-        print("⚠️ Failed to geocode location:", city, state, zip_code, "→", str(e))
+    location = geocode_location(city, state, zip_code)
+    if location:
+        return (location["lat"], location["lng"])
     return None
 
 def normalize_participant_data(raw):
@@ -105,16 +110,12 @@ def normalize_participant_data(raw):
     raw["state"] = normalize_state(raw.get("state") or get_any("state"))
 
     if (not raw["city"] or not raw["state"]) and raw.get("zip"):
-        try:
-            loc = geolocator.geocode(f"{raw['zip']}, USA")
-            if loc:
-                print("📦 Raw geocoder output:", loc)
-                parts = loc.address.split(", ")
-                print("📍 Parsed from string:", parts)
-                raw["city"] = raw["city"] or parts[0] if len(parts) >= 2 else ""
-                raw["state"] = raw["state"] or normalize_state(parts[1]) if len(parts) >= 2 else ""
-        except Exception as e:
-            print("⚠️ ZIP enrichment error:", e)
+        # Same cache key as the coordinates lookup below, so one provider call at most
+        location = geocode_location("", "", raw["zip"])
+        if location:
+            print("📦 ZIP enrichment:", location)
+            raw["city"] = raw["city"] or location["city"]
+            raw["state"] = raw["state"] or normalize_state(location["state"])
 
     raw["city"] = raw.get("city") or "Unknown"
     raw["state"] = raw.get("state") or "Unknown"
@@ -137,45 +138,40 @@ def normalize_participant_data(raw):
     print("📊 Final participant data before match:", raw)
     return raw
 
-def format_matches_for_gpt(matches):
-    if not matches:
-        return "😕 Sorry, I couldn't find any matching studies at the moment."
-
-    formatted = []
-    for i, match in enumerate(matches, 1):
-        study = match["study"]
-        score = match.get("score", 6)
-        rationale = match.get("rationale", "General match")
-        locs = study.get("site_locations_and_contacts", [])
-
-        locations = []
-        for site in locs:
-            city = site.get("city", "")
-            state = site.get("state", "")
-            if city and state:
-                locations.append(f"{city}, {state}")
-            elif state:
-                locations.append(state)
-        location_str = ", ".join(locations) if locations else "No location info"
-
-        contact = study.get("study_contact", {})
-        contact_line = ""
-        if contact.get("email"):
-            contact_line += f"📧 {contact['email']}  "
-        if contact.get("phone"):
-            contact_line += f"📞 {contact['phone']}"
-
-        summary = study.get("summary", "").strip()
-        if len(summary) > 350:
-            summary = summary[:347] + "..."
-
-        formatted.append(
-            f"**{i}. {study.get('study_title', 'Untitled Study')}**\n"
-            f"{summary}\n"
-            f"🌍 Location: {location_str}\n"
-            f"🔗 [Study Link]({study.get('study_link', '#')})\n"
-            f"{contact_line}\n"
-            f"💡 Match Confidence: {score}/10 — {rationale}"
-        )
-
-    return "\n\n".join(formatted)
+def format_match_card(i, match):
+    study = match["study"]
+    score = match["match_score"]
+    rationale = "; ".join(match["match_reason"]) or "General match"
+    locs = study.get("site_locations_and_contacts", [])
+
+    locations = []
+    for site in locs:
+        city = site.get("city", "")
+        state = site.get("state", "")
+        if city and state:
+            locations.append(f"{city}, {state}")
+        elif state:
+            locations.append(state)
+    location_str = ", ".join(locations) if locations else "No location info"
+
+    contact = study.get("study_contact", {})
+    contact_line = ""
+    if contact.get("email"):
+        contact_line += f"📧 {contact['email']}  "
+    if contact.get("phone"):
+        contact_line += f"📞 {contact['phone']}"
+
+    summary = study.get("summary", "").strip()
+    if len(summary) > 350:
+        summary = summary[:347] + "..."
+
+    return (
+        f"**{i}. {study.get('study_title', 'Untitled Study')}**\n"
+        f"{summary}\n"
+        f"🌍 Location: {location_str}\n"
+        f"🔗 [Study Link]({study.get('study_link', '#')})\n"
+        f"{contact_line}\n"
+        f"💡 Match Confidence: {score}/10 — {rationale}"
+    )
+
+NO_MATCHES_MESSAGE = "😕 Sorry, I couldn't find any matching studies at the moment."